@@ -1,6 +1,13 @@
 
 from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 import os
+import sys
+
+# Started as `python app.py` this module is __main__; register it as `app` as well, so the
+# blueprints' `from app import ...` share this instance instead of importing a second copy
+# with its own history store, job registry, metrics and log handlers
+sys.modules.setdefault('app', sys.modules[__name__])
+
 import json
 import subprocess
 import time
@@ -10,8 +17,11 @@ import logging
 import glob
 import tempfile
 import re
+import base64
+import signal
+import textwrap
 import pytz
-from logging.handlers import RotatingFileHandler
+from log_queue import BatchStreamHandler, BatchRotatingFileHandler, start_queue_logging
 from werkzeug.utils import secure_filename
 from routes.auth_routes import auth_bp
 from datetime import datetime, timedelta, timezone
@@ -20,6 +30,22 @@ from routes.auth_routes import get_current_user
 # Import DB routes
 from routes.db_routes import db_routes
 from routes.template_routes import template_bp
+from routes.profiler_routes import profiler_bp
+from hash_catalog import HashCatalog
+from sql_engine import SqlEngine, SQL_STATEMENT_TIMEOUT_SECONDS, SQL_PSQL_TIMEOUT_SECONDS, default_mode, parse_statement_timeout
+from sql_parser import ScriptParseCache
+from file_transfer import TRANSFER_MODES, select_transfer_mode, render_transfer_tasks
+import relay_distribution
+from template_executor import TemplateExecutor, TEMPLATE_MAX_PARALLEL, build_dependency_graph
+from template_checkpoints import CheckpointLog, step_fingerprint
+from job_control import JobRegistry, TERMINAL_STATUSES
+from host_progress import HostProgress, summarize_progress
+from phase_timer import PhaseTimer, phase_percentiles
+from log_records import append_log, LogIndexCache, LOG_LEVELS, LOG_QUERY_MAX_LIMIT
+from search_index import SearchIndex, record_epoch, SEARCH_MAX_PER_PAGE
+from retention import HistoryCompactor
+from history_store import HistoryStore
+import metrics
 # Register the blueprint
 #app.register_blueprint(db_blueprint, url_prefix='/api')
 
@@ -31,6 +57,7 @@ app = Flask(__name__, static_folder='../frontend/dist')
 app.register_blueprint(db_routes)
 app.register_blueprint(auth_bp)
 app.register_blueprint(template_bp)
+app.register_blueprint(profiler_bp)
 #app.register_blueprint(db_routes)
 
 
@@ -41,7 +68,19 @@ FIX_FILES_DIR = os.environ.get('FIX_FILES_DIR', '/app/fixfiles')
 # Directory for deployment logs
 DEPLOYMENT_LOGS_DIR = os.environ.get('DEPLOYMENT_LOGS_DIR', '/app/logs')
 APP_LOG_FILE = os.environ.get('APP_LOG_FILE', os.path.join(DEPLOYMENT_LOGS_DIR, 'application.log'))
+# Single-file history written by earlier versions; migrated into the history store on first start
 DEPLOYMENT_HISTORY_FILE = os.path.join(DEPLOYMENT_LOGS_DIR, 'deployment_history.json')
+# Deployment history store: one record per line, and the index of it that startup reads
+DEPLOYMENT_STORE_FILE = os.path.join(DEPLOYMENT_LOGS_DIR, 'deployment_history.jsonl')
+DEPLOYMENT_INDEX_FILE = os.path.join(DEPLOYMENT_LOGS_DIR, 'deployment_history.idx')
+# Also copy every job log line into application.log at DEBUG (set to false to keep only the deployment record)
+LOG_JOB_LINES = os.environ.get('LOG_JOB_LINES', 'true').lower() == 'true'
+# Most log records the background listener writes in one go
+LOG_BATCH_SIZE = int(os.environ.get('LOG_BATCH_SIZE', 500))
+# Deployments per page of /api/deployments/history when ?page= is given without ?per_page=
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', 1000))
+# SQLite full-text index behind /api/deployments/search
+SEARCH_DB_FILE = os.environ.get('SEARCH_DB_FILE', os.path.join(DEPLOYMENT_LOGS_DIR, 'search_index.db'))
 
 
 # Configure application logging
@@ -64,21 +103,20 @@ except PermissionError:
 
 
 # Console handler
-console_handler = logging.StreamHandler()
+console_handler = BatchStreamHandler()
 console_handler.setLevel(logging.INFO)
 console_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 console_handler.setFormatter(console_format)
 
 # File handler (with rotation)
 os.makedirs(os.path.dirname(APP_LOG_FILE), exist_ok=True)  # Ensure log directory exists
-file_handler = RotatingFileHandler(APP_LOG_FILE, maxBytes=10485760, backupCount=10) # 10MB per file, keep 10 files
+file_handler = BatchRotatingFileHandler(APP_LOG_FILE, maxBytes=10485760, backupCount=10) # 10MB per file, keep 10 files
 file_handler.setLevel(logging.DEBUG)
 file_format = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 file_handler.setFormatter(file_format)
 
-# Add handlers
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+# Handlers are written by a background listener; logging calls in job threads only enqueue
+log_listener = start_queue_logging(logger, [console_handler, file_handler], batch_size=LOG_BATCH_SIZE)
 
 logger.info("Starting Fix Deployment Orchestrator with enhanced logging")
 logger.debug(f"Application environment: FLASK_ENV={os.environ.get('FLASK_ENV', 'production')}")
@@ -86,47 +124,49 @@ logger.debug(f"Fix files directory: {FIX_FILES_DIR}")
 logger.debug(f"Deployment logs directory: {DEPLOYMENT_LOGS_DIR}")
 logger.debug(f"Application log file: {APP_LOG_FILE}")
 
-# Dictionary to store deployment information
-deployments = {}
+# SHA-256 catalog of fix files, used to skip identical transfers and to validate targets
+hash_catalog = HashCatalog(FIX_FILES_DIR)
+sql_engine = SqlEngine()
+sql_parse_cache = ScriptParseCache()
+# Per-deployment indexes behind the log query API
+log_indexes = LogIndexCache()
+
+def deployment_pinned(deployment_id, record):
+    """Records of unfinished jobs stay in memory: job threads keep writing to them"""
+    return record.get('status') not in TERMINAL_STATUSES or jobs.is_active(deployment_id)
+
+# Dictionary-like store of deployment information; startup reads only its index
+store_existed = os.path.exists(DEPLOYMENT_STORE_FILE)
+deployments = HistoryStore(DEPLOYMENT_STORE_FILE, DEPLOYMENT_INDEX_FILE, is_pinned=deployment_pinned)
 
 # Store deployments in app config so it can be accessed via current_app
 app.config['deployments'] = deployments
 
-# Try to load previous deployments if they exist
-try:
-    if os.path.exists(DEPLOYMENT_HISTORY_FILE):
-        with open(DEPLOYMENT_HISTORY_FILE, 'r') as f:
+# Migrate the single-file history of earlier versions (or its newest readable backup) once
+if not store_existed:
+    try:
+        legacy_files = [DEPLOYMENT_HISTORY_FILE] if os.path.exists(DEPLOYMENT_HISTORY_FILE) else \
+            sorted(glob.glob(os.path.join(DEPLOYMENT_LOGS_DIR, 'deployment_history_*.json')), reverse=True)
+        for legacy_file in legacy_files:
             try:
-                deployments = json.load(f)
-                logger.info(f"Loaded {len(deployments)} previous deployments from history file")
+                with open(legacy_file, 'r') as f:
+                    deployments.import_records(json.load(f))
+                logger.info(f"Migrated {len(deployments)} previous deployments from {legacy_file} to {DEPLOYMENT_STORE_FILE}")
+                os.rename(legacy_file, f'{legacy_file}.migrated')
+                break
             except json.JSONDecodeError as e:
-                logger.error(f"Error parsing deployment history file: {str(e)}")
-                # Create a backup of the corrupted file
-                backup_file = os.path.join(DEPLOYMENT_LOGS_DIR, f'deployment_history_corrupt_{int(time.time())}.json')
-                os.rename(DEPLOYMENT_HISTORY_FILE, backup_file)
-                logger.info(f"Renamed corrupted history file to {backup_file}")
-                deployments = {}
-    else:
-        # Look for backup history files in the logs directory
-        backup_files = sorted(glob.glob(os.path.join(DEPLOYMENT_LOGS_DIR, 'deployment_history_*.json')), reverse=True)
-        if backup_files:
-            logger.info(f"Found {len(backup_files)} backup deployment history files, loading most recent")
-            for backup_file in backup_files:
-                try:
-                    with open(backup_file, 'r') as f:
-                        deployments = json.load(f)
-                    logger.info(f"Loaded {len(deployments)} previous deployments from backup file {backup_file}")
-                    break
-                except (json.JSONDecodeError, Exception) as e:
-                    logger.error(f"Error loading from backup file {backup_file}: {str(e)}")
-                    continue
+                logger.error(f"Error parsing deployment history file {legacy_file}: {str(e)}")
+                continue
         else:
-            logger.info("No deployment history file found, creating new one")
-            # Create an empty history file
-            with open(DEPLOYMENT_HISTORY_FILE, 'w') as f:
-                json.dump({}, f)
-except Exception as e:
-    logger.error(f"Failed to load deployment history: {str(e)}")
+            logger.info("No deployment history file found, starting a new history store")
+    except Exception as e:
+        logger.error(f"Failed to migrate deployment history: {str(e)}")
+else:
+    logger.info(f"Indexed {len(deployments)} previous deployments from {DEPLOYMENT_INDEX_FILE}")
+
+# Full-text index over deployment metadata and logs, caught up with the loaded history in the background
+search_index = SearchIndex(SEARCH_DB_FILE, deployments.peek)
+search_index.start(deployments.summaries())
 
 # Load inventory from file or create a default one
 INVENTORY_FILE = os.environ.get('INVENTORY_FILE', '/app/inventory/inventory.json')
@@ -135,86 +175,81 @@ os.makedirs(os.path.dirname(INVENTORY_FILE), exist_ok=True)
 try:
     with open(INVENTORY_FILE, 'r') as f:
         inventory = json.load(f)
+    metrics.INVENTORY_RELOADS.inc()
     logger.info(f"Loaded inventory with {len(inventory.get('vms', []))} VMs")
 except (FileNotFoundError, json.JSONDecodeError) as e:
     logger.error(f"Error loading inventory: {str(e)} - Please create/fix inventory.json manually")
     inventory = {"vms": [], "users": [], "systemd_services": []}
     # Don't save the empty inventory - let user create it manually
 
-# Function to save deployment history with backup
+# Function to save deployment history
 
 
 def save_deployment_history():
+    save_started = time.time()
     try:
-        logger.info(f"Starting to save deployment history. Current deployments count: {len(deployments)}")
-        
-        # Ensure the deployment logs directory exists
-        try:
-            os.makedirs(DEPLOYMENT_LOGS_DIR, exist_ok=True)
-            logger.debug(f"Ensured directory exists: {DEPLOYMENT_LOGS_DIR}")
-        except Exception as e:
-            logger.error(f"Failed to create DEPLOYMENT_LOGS_DIR: {e}")
-            raise
-        
-        # Create a backup of the current history file if it exists
-        if os.path.exists(DEPLOYMENT_HISTORY_FILE):
-            # timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            timestamp = datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S')
-            backup_file = os.path.join(DEPLOYMENT_LOGS_DIR, f'deployment_history_{timestamp}.json')
-            try:
-                with open(DEPLOYMENT_HISTORY_FILE, 'r') as src:
-                    with open(backup_file, 'w') as dst:
-                        dst.write(src.read())
-                logger.debug(f"Created backup of deployment history: {backup_file}")
-            except Exception as e:
-                logger.error(f"Error creating backup of history file: {str(e)}")
-                # Don't raise here, continue with saving
-        
-        # Ensure the directory for the main history file exists
-        history_dir = os.path.dirname(DEPLOYMENT_HISTORY_FILE)
-        if history_dir:
-            os.makedirs(history_dir, exist_ok=True)
-        
-        # Save the current deployment history
-        try:
-            with open(DEPLOYMENT_HISTORY_FILE, 'w') as f:
-                json.dump(deployments, f, default=str, indent=2)
-            logger.info(f"Saved {len(deployments)} deployments to history file: {DEPLOYMENT_HISTORY_FILE}")
-        except Exception as e:
-            logger.error(f"Failed to write deployment history file: {e}")
-            raise
-        
-        # Clean up old backup files (keep only last 10)
-        try:
-            backup_files = sorted(glob.glob(os.path.join(DEPLOYMENT_LOGS_DIR, 'deployment_history_*.json')))
-            if len(backup_files) > 10:
-                for old_file in backup_files[:-10]:
-                    try:
-                        os.remove(old_file)
-                        logger.debug(f"Removed old backup file: {old_file}")
-                    except Exception as e:
-                        logger.error(f"Error removing old backup file {old_file}: {str(e)}")
-        except Exception as e:
-            logger.error(f"Error during backup cleanup: {e}")
-            # Don't raise here, the main save was successful
-            
+        # Only records changed since the last save are appended to the history store
+        history_bytes = deployments.save()
+        metrics.HISTORY_BYTES_WRITTEN.inc(history_bytes)
+        metrics.HISTORY_SIZE.set(deployments.data_size)
+        logger.info(f"Saved deployment history ({history_bytes} bytes appended, {len(deployments)} deployments): {DEPLOYMENT_STORE_FILE}")
     except Exception as e:
         logger.error(f"Failed to save deployment history: {str(e)}")
         raise  # Re-raise so the API returns 500
+    finally:
+        metrics.HISTORY_SAVE_DURATION.observe(time.time() - save_started)
 
 
 
 # Helper function to log message to deployment log
-def log_message(deployment_id, message):
-    """Log a message to the deployment logs and the application log"""
+def log_message(deployment_id, message, level=None, host=None, source='system'):
+    """Log a message to the deployment logs and the application log.
+
+    Level and host are inferred from the text when not given; source names what produced
+    the line (system, ansible, psql, template).
+    """
     if deployment_id in deployments:
-        # Add to deployment logs
-        if "logs" not in deployments[deployment_id]:
-            deployments[deployment_id]["logs"] = []
-        deployments[deployment_id]["logs"].append(message)
-        
+        # Add to deployment logs along with its structured entry
+        append_log(deployments[deployment_id], message, level=level, host=host, source=source)
+        search_index.mark(deployment_id)
+
         # Also log to application log
-        logger.debug(f"[{deployment_id}] {message}")
+        if LOG_JOB_LINES:
+            logger.debug(f"[{deployment_id}] {message}")
+
+def finish_cancelled_job(deployment_id, reason):
+    """Mark a deployment whose job was cancelled once its worker thread has stopped"""
+    if deployment_id in deployments:
+        log_message(deployment_id, f"CANCELLED: {reason}")
+        deployments[deployment_id]["status"] = "cancelled"
+        save_deployment_history()
+
+def record_job_finished(deployment_id, job_type):
+    """Count a finished job by its final status and refresh its search entry"""
+    status = deployments.get(deployment_id, {}).get("status", "unknown")
+    metrics.DEPLOYMENTS_FINISHED.inc(type=job_type, status=status)
+    search_index.mark(deployment_id)
+
+jobs = JobRegistry(on_cancelled=finish_cancelled_job, on_finished=record_job_finished)
+
+# Applies the retention policy in the background; also serves /api/deployments/clear
+compactor = HistoryCompactor(deployments, save_deployment_history, jobs.is_active,
+                             on_deleted=search_index.mark_many)
+compactor.start()
+
+metrics.REGISTRY.gauge('fdo_jobs_active', 'Deployment jobs currently running, by job type', ['type'],
+                       callback=lambda: {(job_type,): count for job_type, count in jobs.job_counts().items()})
+metrics.REGISTRY.gauge('fdo_subprocesses_running', 'Subprocesses started by deployment jobs that are still running',
+                       callback=jobs.process_count)
+
+def track_hosts(deployment_id, vms):
+    """Start the per-host progress table for a multi-host job"""
+    progress = HostProgress(deployments[deployment_id], vms)
+    known_vms = {v["name"] for v in inventory["vms"]}
+    for vm_name in vms:
+        if vm_name not in known_vms:
+            progress.complete(vm_name, False, "VM not found in inventory")
+    return progress
 
 
 # Check SSH key permissions and setup
@@ -303,6 +338,8 @@ def get_fts():
     if os.path.exists(fts_dir):
         all_fts = [d for d in os.listdir(fts_dir) if os.path.isdir(os.path.join(fts_dir, d))]
         logger.debug(f"Found {len(all_fts)} FTs in directory")
+        # Forget hashes of fix files removed since the last listing
+        hash_catalog.prune()
     else:
         logger.warning(f"FTs directory does not exist: {fts_dir}")
     
@@ -341,6 +378,17 @@ def get_ft_files(ft):
     logger.debug(f"Found {len(files)} files in FT: {ft}")
     return jsonify(files)
 
+# API to get SHA-256 hashes for the files of an FT
+@app.route('/api/fts/<ft>/hashes')
+def get_ft_file_hashes(ft):
+    logger.info(f"Getting file hashes for FT: {ft}")
+
+    if not os.path.isdir(os.path.join(FIX_FILES_DIR, 'AllFts', ft)):
+        logger.warning(f"FT directory does not exist for hash lookup: {ft}")
+        return jsonify({"error": "FT not found"}), 404
+
+    return jsonify(hash_catalog.get_ft_hashes(ft))
+
 # API to get VMs
 @app.route('/api/vms')
 def get_vms():
@@ -373,6 +421,7 @@ def load_inventory():
             inventory = json.load(f)
         with open('/app/inventory/db_inventory.json', 'r') as f:
             db_inventory = json.load(f)
+        metrics.INVENTORY_RELOADS.inc()
         return inventory, db_inventory
     except Exception as e:
         deploy_template_logger.error(f"Error loading inventory: {str(e)}")
@@ -406,64 +455,148 @@ def get_helm_command(helm_type, inventory):
             return helm['command']
     return None
 
+def template_source_path(step, file_name):
+    """Get the source path of a file referenced by a template step"""
+    if step.get('ftNumber'):
+        return os.path.join(FIX_FILES_DIR, 'AllFts', step['ftNumber'], file_name)
+    return os.path.join(FIX_FILES_DIR, file_name)
+
+def template_source_hash(step, file_name):
+    """Get the SHA-256 of a template step's source file, or None if it is missing"""
+    source_path = template_source_path(step, file_name)
+    if not os.path.isfile(source_path):
+        return None
+    return hash_catalog.get_file_hash(source_path)
+
+class StepLog:
+    """List-like log for a template step that streams each line into the deployment log.
+
+    Steps can run for many minutes, so lines are forwarded with log_message as they are
+    produced (tagged with the step, since steps run concurrently) instead of being buffered
+    until the step ends. Nothing is retained here, which keeps memory bounded.
+    """
+
+    def __init__(self, deployment_id, order):
+        self.deployment_id = deployment_id
+        self.prefix = f"[step {order}] "
+
+    def append(self, line):
+        log_message(self.deployment_id, f"{self.prefix}{line}", source='template')
+
+    def extend(self, lines):
+        for line in lines:
+            self.append(line)
+
+class JobOutput:
+    """List-like sink for a multi-host job's output: logs each line and feeds its host progress table"""
+
+    def __init__(self, deployment_id, progress):
+        self.deployment_id = deployment_id
+        self.progress = progress
+
+    def append(self, line):
+        log_message(self.deployment_id, line, source='ansible')
+        self.progress.feed(line)
+
+def stream_command(command, logs, timeout, env=None, stdout_prefix="", stderr_prefix="", deployment_id=None):
+    """Run a command, appending stdout and stderr lines to logs as they arrive.
+
+    Returns the exit code, or None if the command was killed after `timeout` seconds.
+    A timeout of None lets the command run until it exits. With a deployment_id the
+    process is tracked by the job registry so cancelling the deployment stops it.
+    """
+    process = jobs.popen(
+        deployment_id,
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        bufsize=1,
+        env=env
+    )
+
+    timed_out = threading.Event()
+
+    def kill_on_timeout():
+        # The command may have exited just before the timer fired; that is not a timeout
+        if process.poll() is not None:
+            return
+        timed_out.set()
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def pump(stream, prefix):
+        for line in stream:
+            line = line.rstrip('\n')
+            if line.strip():
+                logs.append(f"{prefix}{line}")
+        stream.close()
+
+    timer = threading.Timer(timeout, kill_on_timeout) if timeout else None
+    readers = [
+        threading.Thread(target=pump, args=(process.stdout, stdout_prefix), daemon=True),
+        threading.Thread(target=pump, args=(process.stderr, stderr_prefix), daemon=True)
+    ]
+    if timer:
+        timer.start()
+    for reader in readers:
+        reader.start()
+    try:
+        for reader in readers:
+            reader.join()
+        process.wait()
+    finally:
+        if timer:
+            timer.cancel()
+
+    return None if timed_out.is_set() else process.returncode
+
 def run_ansible_command(command, logs):
-    """Run ansible command and capture output"""
+    """Run ansible command and stream its output"""
     try:
-        result = subprocess.run(command, capture_output=True, text=True, timeout=300)
-        
-        if result.stdout:
-            logs.extend(result.stdout.split('\n'))
-        if result.stderr:
-            logs.extend(result.stderr.split('\n'))
-        
-        if result.returncode == 0:
+        returncode = stream_command(command, logs, timeout=300, deployment_id=logs.deployment_id)
+
+        if returncode is None:
+            logs.append(f"Command timed out: {' '.join(command)}")
+            return False
+        if returncode == 0:
             logs.append(f"Command executed successfully: {' '.join(command)}")
             return True
         else:
-            logs.append(f"Command failed with return code {result.returncode}: {' '.join(command)}")
+            logs.append(f"Command failed with return code {returncode}: {' '.join(command)}")
             return False
-            
-    except subprocess.TimeoutExpired:
-        logs.append(f"Command timed out: {' '.join(command)}")
-        return False
+
     except Exception as e:
         logs.append(f"Error executing command: {str(e)}")
         return False
 
 def run_command_with_logging(command, logs):
-    """Run command and capture output with logging"""
+    """Run command and stream its output with logging"""
     try:
         logs.append(f"Executing command: {' '.join(command)}")
-        
-        result = subprocess.run(command, capture_output=True, text=True, timeout=600)
-        
-        if result.stdout:
-            for line in result.stdout.split('\n'):
-                if line.strip():
-                    logs.append(f"STDOUT: {line}")
-        
-        if result.stderr:
-            for line in result.stderr.split('\n'):
-                if line.strip():
-                    logs.append(f"STDERR: {line}")
-        
-        if result.returncode == 0:
+
+        returncode = stream_command(command, logs, timeout=600, stdout_prefix="STDOUT: ", stderr_prefix="STDERR: ",
+                                    deployment_id=logs.deployment_id)
+
+        if returncode is None:
+            logs.append(f"Command timed out after 10 minutes")
+            return False
+        if returncode == 0:
             logs.append(f"Command completed successfully")
             return True
         else:
-            logs.append(f"Command failed with return code {result.returncode}")
+            logs.append(f"Command failed with return code {returncode}")
             return False
-            
-    except subprocess.TimeoutExpired:
-        logs.append(f"Command timed out after 10 minutes")
-        return False
+
     except Exception as e:
         logs.append(f"Error executing command: {str(e)}")
         return False
 
 def execute_file_deployment_step(step, inventory, deployment_id):
     """Execute file deployment step using ansible"""
-    logs = []
+    logs = StepLog(deployment_id, step['order'])
     success = True
     
     try:
@@ -488,7 +621,7 @@ def execute_file_deployment_step(step, inventory, deployment_id):
         for file_name in step.get('files', []):
             logs.append(f"Deploying file: {file_name}")
             
-            source_path = f"/app/fixfiles/{file_name}"
+            source_path = template_source_path(step, file_name)
             target_path = step.get('targetPath', '/tmp')
             target_user = step.get('targetUser', 'root')
             
@@ -522,7 +655,7 @@ def execute_file_deployment_step(step, inventory, deployment_id):
 
 def execute_sql_deployment_step(step, db_inventory, deployment_id):
     """Execute SQL deployment step"""
-    logs = []
+    logs = StepLog(deployment_id, step['order'])
     success = True
     
     try:
@@ -546,7 +679,7 @@ def execute_sql_deployment_step(step, db_inventory, deployment_id):
         
         # Process SQL files
         for file_name in step.get('files', []):
-            sql_file_path = f"/app/fixfiles/{file_name}"
+            sql_file_path = template_source_path(step, file_name)
             
             if not os.path.exists(sql_file_path):
                 logs.append(f"Error: SQL file {sql_file_path} not found")
@@ -554,7 +687,27 @@ def execute_sql_deployment_step(step, db_inventory, deployment_id):
                 continue
             
             logs.append(f"Executing SQL file: {file_name}")
-            
+
+            with open(sql_file_path, 'r') as f:
+                sql_text = f.read()
+
+            statement_timeout = step.get('statementTimeout', SQL_STATEMENT_TIMEOUT_SECONDS)
+
+            if sql_engine.can_execute(sql_text):
+                statements = sql_parse_cache.parse(sql_text)['statements']
+                result = sql_engine.execute_batch(
+                    db_details['hostname'], db_details['port'], db_details['db_name'], db_user, db_password,
+                    [{'file': file_name, 'statements': statements}], default_mode(statements, step.get('atomic', False)), logs.append,
+                    statement_timeout=statement_timeout, job=jobs.handle(deployment_id))
+                if result['success']:
+                    logs.append(f"SQL file {file_name} executed successfully in {result['files'][0]['duration']}s")
+                else:
+                    logs.append(f"SQL file {file_name} failed")
+                    success = False
+                continue
+
+            # Scripts with psql meta-commands, or no psycopg2, fall back to the psql client
+            logs.append(f"Running {file_name} through psql")
             # Create psql command
             psql_cmd = [
                 'psql',
@@ -569,24 +722,23 @@ def execute_sql_deployment_step(step, db_inventory, deployment_id):
             # Set password environment variable
             env = os.environ.copy()
             env['PGPASSWORD'] = db_password
+            if statement_timeout:
+                env['PGOPTIONS'] = f"-c statement_timeout={int(statement_timeout * 1000)}"
             
             try:
-                result = subprocess.run(psql_cmd, capture_output=True, text=True, env=env, timeout=300)
-                
-                if result.stdout:
-                    logs.extend(result.stdout.split('\n'))
-                if result.stderr:
-                    logs.extend(result.stderr.split('\n'))
-                
-                if result.returncode == 0:
+                # Long migrations are bounded per statement, and the whole file by SQL_PSQL_TIMEOUT_SECONDS
+                returncode = stream_command(psql_cmd, logs, timeout=SQL_PSQL_TIMEOUT_SECONDS or None, env=env,
+                                            deployment_id=deployment_id)
+
+                if returncode is None:
+                    logs.append(f"SQL file {file_name} did not finish within {SQL_PSQL_TIMEOUT_SECONDS}s and was stopped")
+                    success = False
+                elif returncode == 0:
                     logs.append(f"SQL file {file_name} executed successfully")
                 else:
-                    logs.append(f"SQL file {file_name} failed with return code {result.returncode}")
+                    logs.append(f"SQL file {file_name} failed with return code {returncode}")
                     success = False
-                    
-            except subprocess.TimeoutExpired:
-                logs.append(f"SQL execution timed out for file {file_name}")
-                success = False
+
             except Exception as e:
                 logs.append(f"Error executing SQL file {file_name}: {str(e)}")
                 success = False
@@ -601,7 +753,7 @@ def execute_sql_deployment_step(step, db_inventory, deployment_id):
 
 def execute_service_restart_step(step, inventory, deployment_id):
     """Execute service restart step using systemctl"""
-    logs = []
+    logs = StepLog(deployment_id, step['order'])
     success = True
     
     try:
@@ -652,7 +804,7 @@ def execute_service_restart_step(step, inventory, deployment_id):
 
 def execute_ansible_playbook_step(step, inventory, deployment_id):
     """Execute ansible playbook step"""
-    logs = []
+    logs = StepLog(deployment_id, step['order'])
     success = True
     
     try:
@@ -676,6 +828,9 @@ def execute_ansible_playbook_step(step, inventory, deployment_id):
             '-i', playbook_details['inventory'],
             '-f', str(playbook_details.get('forks', 10))
         ]
+
+        if playbook_details.get('env_type'):
+            ansible_cmd.extend(['-e', f"env_type={playbook_details['env_type']}"])
         
         # Add extra vars
         for extra_var_file in playbook_details.get('extra_vars', []):
@@ -700,7 +855,7 @@ def execute_ansible_playbook_step(step, inventory, deployment_id):
 
 def execute_helm_upgrade_step(step, inventory, deployment_id):
     """Execute helm upgrade step"""
-    logs = []
+    logs = StepLog(deployment_id, step['order'])
     success = True
     
     try:
@@ -736,18 +891,21 @@ def execute_template_step(step, inventory, db_inventory, deployment_id):
     step_type = step.get('type')
     
     if step_type == 'file_deployment':
-        return execute_file_deployment_step(step, inventory, deployment_id)
+        success, _ = execute_file_deployment_step(step, inventory, deployment_id)
     elif step_type == 'sql_deployment':
-        return execute_sql_deployment_step(step, db_inventory, deployment_id)
+        success, _ = execute_sql_deployment_step(step, db_inventory, deployment_id)
     elif step_type == 'service_restart':
-        return execute_service_restart_step(step, inventory, deployment_id)
+        success, _ = execute_service_restart_step(step, inventory, deployment_id)
     elif step_type == 'ansible_playbook':
-        return execute_ansible_playbook_step(step, inventory, deployment_id)
+        success, _ = execute_ansible_playbook_step(step, inventory, deployment_id)
     elif step_type == 'helm_upgrade':
-        return execute_helm_upgrade_step(step, inventory, deployment_id)
+        success, _ = execute_helm_upgrade_step(step, inventory, deployment_id)
     else:
         return False, [f"Unknown step type: {step_type}"]
 
+    # The step's output was already streamed into the deployment log
+    return success, []
+
 # =============================================================================
 # FLASK ROUTES - Add these routes to your app.py
 # =============================================================================
@@ -792,6 +950,128 @@ def get_template(template_name):
         deploy_template_logger.error(f"Error loading template {template_name}: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+def start_template_deployment(template_name, template_data, inventory, db_inventory,
+                              max_parallel=TEMPLATE_MAX_PARALLEL, resumed_from=None, ft_number=None):
+    """Register a template deployment and run its step DAG in a background thread"""
+    steps = template_data.get('steps', [])
+    dependencies = template_data.get('dependencies', [])
+
+    # Validate the dependency graph and step settings before anything is started (raises ValueError)
+    build_dependency_graph(steps, dependencies)
+    for step in steps:
+        if 'statementTimeout' in step:
+            parse_statement_timeout(step['statementTimeout'])
+
+    # Fingerprint every step's inputs; a resume only skips steps whose inputs are unchanged
+    fingerprints = {step.get('order'): step_fingerprint(step, inventory, db_inventory, template_source_hash)
+                    for step in steps}
+    skip_orders = set()
+    if resumed_from:
+        skip_orders = CheckpointLog(resumed_from).completed_steps(fingerprints)
+
+    # Generate deployment ID
+    deployment_id = str(uuid.uuid4())
+    checkpoints = CheckpointLog(deployment_id)
+
+    deployments[deployment_id] = {
+        'id': deployment_id,
+        'type': 'template_deployment',
+        'status': 'running',
+        'logs': [],
+        'template_name': template_name,
+        'ft_number': ft_number or template_data.get('metadata', {}).get('ft_number', 'unknown'),
+        'start_time': datetime.now(timezone.utc).isoformat(),
+        'timestamp': time.time(),
+        'steps_total': len(steps),
+        'steps_completed': 0,
+        'max_parallel': max_parallel,
+        'step_results': {}
+    }
+    if resumed_from:
+        deployments[deployment_id]['resumed_from'] = resumed_from
+        deployments[deployment_id]['steps_skipped'] = sorted(skip_orders)
+    save_deployment_history()
+    deploy_template_logger.info(f"Starting template deployment {deployment_id} for {template_name}")
+
+    # Execute template in background thread
+    def execute_template_background():
+        deployment = deployments[deployment_id]
+        phases = PhaseTimer(deployment)
+        try:
+            if resumed_from:
+                log_message(deployment_id, f"Resuming from deployment {resumed_from}: skipping {len(skip_orders)} completed steps with unchanged inputs", source='template')
+
+            def on_step_event(event, order, result):
+                step = next((s for s in steps if s.get('order') == order), {})
+                if event == 'started':
+                    log_message(deployment_id, f"\n=== Starting Step {order}: {step.get('type')} ===", source='template')
+                    log_message(deployment_id, f"Description: {step.get('description', 'N/A')}", source='template')
+                elif event == 'finished':
+                    # Step output is streamed as it is produced; only errors raised outside a step arrive here
+                    for line in result.pop('logs', []):
+                        log_message(deployment_id, f"[step {order}] {line}", source='template')
+                    deployment['steps_completed'] += 1
+                    if result['status'] == 'success':
+                        log_message(deployment_id, f"Step {order} completed successfully in {result['duration']}s", source='template')
+                    else:
+                        log_message(deployment_id, f"Step {order} failed after {result['duration']}s - cancelling dependent steps", level='error', source='template')
+                elif event == 'skipped':
+                    deployment['steps_completed'] += 1
+                    log_message(deployment_id, f"Step {order} skipped: already completed in {resumed_from} with unchanged inputs", source='template')
+                elif event == 'cancelled':
+                    log_message(deployment_id, f"Step {order} cancelled: {result['reason']}", source='template')
+                deployment['step_results'][str(order)] = dict(result)
+                if event == 'finished':
+                    # Steps overlap, so per-type step time can add up to more than execute_steps
+                    phases.add(f"step:{step.get('type', 'unknown')}", result['duration'])
+                    metrics.TEMPLATE_STEP_DURATION.observe(result['duration'], step_type=step.get('type', 'unknown'),
+                                                           status=result['status'])
+
+                # Checkpoint terminal outcomes durably so a later resume can skip them
+                if event in ('finished', 'skipped'):
+                    checkpoints.record(order, result['status'], fingerprints.get(order),
+                                       start_time=result.get('start_time'), end_time=result.get('end_time'),
+                                       skipped=event == 'skipped')
+
+            executor = TemplateExecutor(
+                steps, dependencies,
+                lambda step: execute_template_step(step, inventory, db_inventory, deployment_id),
+                on_step_event=on_step_event,
+                max_parallel=max_parallel,
+                skip_orders=skip_orders,
+                should_stop=lambda: jobs.is_cancelled(deployment_id)
+            )
+            overall_success = executor.run()
+            phases.lap("execute_steps")
+
+            # Update final status
+            final_status = 'success' if overall_success else 'failed'
+            deployment['status'] = final_status
+            deployment['end_time'] = datetime.now(timezone.utc).isoformat()
+
+            log_message(deployment_id, f"\n=== Template Deployment {final_status.upper()} ===", source='template')
+
+            deploy_template_logger.info(f"Template deployment {deployment_id} completed with status: {final_status}")
+
+        except Exception as e:
+            deploy_template_logger.error(f"Error in template execution background thread: {str(e)}")
+            deployment['status'] = 'failed'
+            log_message(deployment_id, f"Template execution failed: {str(e)}", level='error', source='template')
+            deployment['end_time'] = datetime.now(timezone.utc).isoformat()
+
+        phases.skip()
+        save_deployment_history()
+        phases.lap("save_history", record=False)
+
+    # Start background execution
+    jobs.start(deployment_id, 'template', execute_template_background)
+
+    return deployment_id
+
+# The template blueprint reaches the shared engine and inventory through current_app
+app.config['start_template_deployment'] = start_template_deployment
+app.config['load_inventory'] = load_inventory
+
 @app.route('/api/deploy/templates/execute', methods=['POST'])
 def execute_template():
     """Execute a deployment template"""
@@ -814,89 +1094,77 @@ def execute_template():
         inventory, db_inventory = load_inventory()
         if not inventory or not db_inventory:
             return jsonify({'error': 'Failed to load inventory'}), 500
-        
-        # Generate deployment ID
-        deployment_id = str(uuid.uuid4())
-        
-        
-        deployments[deployment_id] = {
-            'type': 'template_deployment',
-            'status': 'running',
-            'logs': [],
-            'template_name': template_name,
-            'ft_number': template_data.get('metadata', {}).get('ft_number', 'unknown'),
-            'start_time': datetime.now(timezone.utc).isoformat(),
-            'steps_total': len(template_data.get('steps', [])),
-            'steps_completed': 0
-        }
-        save_deployment_history()
-        deploy_template_logger.info(f"Starting template deployment {deployment_id} for {template_name}")
-        
-        # Execute template in background thread
-        def execute_template_background():
-            try:
-                steps = template_data.get('steps', [])
-                dependencies = template_data.get('dependencies', [])
-                
-                # Sort steps by order
-                steps.sort(key=lambda x: x.get('order', 0))
-                
-                overall_success = True
-                
-                for step in steps:
-                    step_order = step.get('order')
-                    step_type = step.get('type')
-                    
-                    app.deployments[deployment_id]['logs'].append(f"\n=== Starting Step {step_order}: {step_type} ===")
-                    app.deployments[deployment_id]['logs'].append(f"Description: {step.get('description', 'N/A')}")
-                    
-                    # Execute the step
-                    success, step_logs = execute_template_step(step, inventory, db_inventory, deployment_id)
-                    
-                    # Add step logs to deployment logs
-                    app.deployments[deployment_id]['logs'].extend(step_logs)
-                    
-                    # Update progress
-                    app.deployments[deployment_id]['steps_completed'] += 1
-                    
-                    if not success:
-                        overall_success = False
-                        app.deployments[deployment_id]['logs'].append(f"Step {step_order} failed - stopping template execution")
-                        break
-                    
-                    app.deployments[deployment_id]['logs'].append(f"Step {step_order} completed successfully")
-                
-                # Update final status
-                final_status = 'success' if overall_success else 'failed'
-                app.deployments[deployment_id]['status'] = final_status
-                app.deployments[deployment_id]['end_time'] = datetime.now(timezone.utc).isoformat()
-                
-                app.deployments[deployment_id]['logs'].append(f"\n=== Template Deployment {final_status.upper()} ===")
-                
-                deploy_template_logger.info(f"Template deployment {deployment_id} completed with status: {final_status}")
-                
-            except Exception as e:
-                deploy_template_logger.error(f"Error in template execution background thread: {str(e)}")
-                app.deployments[deployment_id]['status'] = 'failed'
-                app.deployments[deployment_id]['logs'].append(f"Template execution failed: {str(e)}")
-                app.deployments[deployment_id]['end_time'] = datetime.now(timezone.utc).isoformat()
-        
-        # Start background execution
-        import threading
-        thread = threading.Thread(target=execute_template_background)
-        thread.daemon = True
-        thread.start()
-        
+
+        try:
+            max_parallel = max(1, int(data.get('max_parallel', TEMPLATE_MAX_PARALLEL)))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'max_parallel must be a positive integer'}), 400
+
+        try:
+            deployment_id = start_template_deployment(
+                template_name, template_data, inventory, db_inventory, max_parallel=max_parallel)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid template: {str(e)}'}), 400
+
         return jsonify({
             'deployment_id': deployment_id,
             'status': 'started',
             'template_name': template_name
         })
-        save_deployment_history()
     except Exception as e:
         deploy_template_logger.error(f"Error executing template: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/deploy/templates/<deployment_id>/resume', methods=['POST'])
+def resume_template(deployment_id):
+    """Resume a failed template deployment, skipping steps that already succeeded with unchanged inputs"""
+    try:
+        data = request.get_json(silent=True) or {}
+        previous = deployments.get(deployment_id)
+
+        if not previous or previous.get('type') != 'template_deployment':
+            return jsonify({'error': 'Template deployment not found'}), 404
+
+        if previous.get('status') == 'running':
+            return jsonify({'error': 'Template deployment is still running'}), 409
+
+        template_name = previous.get('template_name')
+        template_path = f'/app/deployment_templates/{template_name}'
+        if not os.path.exists(template_path):
+            return jsonify({'error': 'Template not found'}), 404
+
+        # The current template is used, so edits made to fix the failure take effect
+        with open(template_path, 'r') as f:
+            template_data = json.load(f)
+
+        inventory, db_inventory = load_inventory()
+        if not inventory or not db_inventory:
+            return jsonify({'error': 'Failed to load inventory'}), 500
+
+        try:
+            max_parallel = max(1, int(data.get('max_parallel', previous.get('max_parallel', TEMPLATE_MAX_PARALLEL))))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'max_parallel must be a positive integer'}), 400
+
+        try:
+            new_deployment_id = start_template_deployment(
+                template_name, template_data, inventory, db_inventory,
+                max_parallel=max_parallel, resumed_from=deployment_id)
+        except ValueError as e:
+            return jsonify({'error': f'Invalid template: {str(e)}'}), 400
+
+        deploy_template_logger.info(f"Resumed template deployment {deployment_id} as {new_deployment_id}")
+        return jsonify({
+            'deployment_id': new_deployment_id,
+            'resumed_from': deployment_id,
+            'steps_skipped': deployments[new_deployment_id].get('steps_skipped', []),
+            'status': 'started',
+            'template_name': template_name
+        })
+    except Exception as e:
+        deploy_template_logger.error(f"Error resuming template deployment {deployment_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 # =============================================================================
 # END OF DEPLOY TEMPLATE CODE TO ADD TO app.py
 # =============================================================================
@@ -919,12 +1187,21 @@ def deploy_file():
     vms = data.get('vms')
     sudo = data.get('sudo', False)
     create_backup = data.get('createBackup', True)  # Default to true for safety
-    
+    skip_identical = data.get('skipIdentical', True)  # Skip hosts that already have identical bytes
+    transfer_mode = data.get('transferMode', 'auto')  # copy, rsync or auto (by file size)
+    distribution = data.get('distribution', 'direct')  # direct, relay or auto (by VM count)
+
     logger.info(f"File deployment request received from {current_user['username']}: {file_name} from FT {ft} to {len(vms)} VMs")
     
     if not all([ft, file_name, user, target_path, vms]):
         logger.error("Missing required parameters for file deployment")
         return jsonify({"error": "Missing required parameters"}), 400
+
+    if transfer_mode not in TRANSFER_MODES:
+        return jsonify({"error": f"Invalid transferMode. Must be one of: {', '.join(TRANSFER_MODES)}"}), 400
+
+    if distribution not in relay_distribution.DISTRIBUTION_MODES:
+        return jsonify({"error": f"Invalid distribution. Must be one of: {', '.join(relay_distribution.DISTRIBUTION_MODES)}"}), 400
     
     # Generate a unique deployment ID
     deployment_id = str(uuid.uuid4())
@@ -942,6 +1219,9 @@ def deploy_file():
         "vms": vms,
         "sudo": sudo,
         "create_backup": create_backup,
+        "skip_identical": skip_identical,
+        "transfer_mode": transfer_mode,
+        "distribution": distribution,
         "status": "running",
         "timestamp": time.time(),
         "logs": []
@@ -951,7 +1231,7 @@ def deploy_file():
     save_deployment_history()
     
     # Start deployment in a separate thread
-    threading.Thread(target=process_file_deployment, args=(deployment_id,)).start()
+    jobs.start(deployment_id, 'file', process_file_deployment, (deployment_id,))
     
     logger.info(f"File deployment initiated by {current_user['username']} with ID: {deployment_id}")
     return jsonify({
@@ -961,6 +1241,8 @@ def deploy_file():
 
 def process_file_deployment(deployment_id):
     deployment = deployments[deployment_id]
+    progress = track_hosts(deployment_id, deployment["vms"])
+    phases = PhaseTimer(deployment)
     
     try:
         ft = deployment["ft"]
@@ -986,12 +1268,29 @@ def process_file_deployment(deployment_id):
             error_msg = f"Source file not found: {source_file}"
             log_message(deployment_id, f"ERROR: {error_msg}")
             deployments[deployment_id]["status"] = "failed"
+            progress.finish(False)
             logger.error(error_msg)
             save_deployment_history()
             return
         
         log_message(deployment_id, f"Starting file deployment for {file_name} to {len(vms)} VMs (initiated by {logged_in_user})")
-        
+
+        # Hash the source once (cached by mtime) so targets with identical bytes can be skipped
+        skip_identical = deployment.get("skip_identical", True)
+        source_sha256 = hash_catalog.get_file_hash(source_file)
+        deployments[deployment_id]["source_sha256"] = source_sha256
+        log_message(deployment_id, f"Source file SHA-256: {source_sha256}")
+
+        transfer_mode = select_transfer_mode(source_file, deployment.get("transfer_mode", "auto"))
+        deployments[deployment_id]["transfer_mode_used"] = transfer_mode
+        log_message(deployment_id, f"Transfer mode: {transfer_mode} ({os.path.getsize(source_file)} bytes)")
+        phases.lap("prepare")
+
+        # Large VM sets can be served peer-to-peer instead of from the orchestrator pod
+        if relay_distribution.use_relay(deployment.get("distribution", "direct"), len(vms)):
+            process_relay_file_deployment(deployment_id, source_file, progress, phases)
+            return
+
         # Generate an ansible playbook for file deployment
         playbook_file = f"/tmp/file_deploy_{deployment_id}.yml"
         
@@ -1026,15 +1325,27 @@ def process_file_deployment(deployment_id):
     - name: Check if file already exists
       ansible.builtin.stat:
         path: "{final_target_path}"
+        get_checksum: true
+        checksum_algorithm: sha256
       register: file_stat
-      
+
+    # Compare the target against the precomputed source hash
+    - name: Check if target already matches source
+      ansible.builtin.set_fact:
+        target_identical: "{{{{ {str(skip_identical).lower()} and file_stat.stat.exists and (file_stat.stat.checksum | default('')) == '{source_sha256}' }}}}"
+
+    - name: Log unchanged target
+      ansible.builtin.debug:
+        msg: "Target already identical (sha256={source_sha256}), skipping transfer"
+      when: target_identical | bool
+
     # Create backup of existing file if requested
     - name: Create backup of existing file if it exists
       ansible.builtin.copy:
         src: "{final_target_path}"
         dest: "{final_target_path}.bak.{{ ansible_date_time.epoch }}"
         remote_src: yes
-      when: file_stat.stat.exists and {str(create_backup).lower()}
+      when: file_stat.stat.exists and {str(create_backup).lower()} and not (target_identical | bool)
       register: backup_result
       
     # Log backup creation
@@ -1043,21 +1354,15 @@ def process_file_deployment(deployment_id):
         msg: "Created backup at {{ backup_result.dest }} (deployment by {logged_in_user})"
       when: backup_result.changed is defined and backup_result.changed
       
-    # Copy the file to the target location
-    - name: Copy file to target VMs
-      ansible.builtin.copy:
-        src: "{source_file}"
-        dest: "{final_target_path}"
-        mode: '0644'
-        owner: "{user}"
-      register: copy_result
-      
+    # Transfer the file to the target location
+{render_transfer_tasks(transfer_mode, source_file, final_target_path, user, "not (target_identical | bool)", "copy_result")}
     - name: Log copy result
       ansible.builtin.debug:
         msg: "File copied successfully to {vms} (deployment by {logged_in_user})"
       when: copy_result.changed
 """)
         logger.debug(f"Created Ansible playbook: {playbook_file}")
+        phases.lap("render_playbook")
         
         # Generate inventory file for ansible
         inventory_file = f"/tmp/inventory_{deployment_id}"
@@ -1073,24 +1378,27 @@ def process_file_deployment(deployment_id):
         
         logger.debug(f"Created Ansible inventory: {inventory_file}")
         log_message(deployment_id, f"Created inventory file with targets: {', '.join(vms)}")
+        phases.lap("write_inventory")
         
         # Test SSH connection to each target VM
         for vm_name in vms:
             vm = next((v for v in inventory["vms"] if v["name"] == vm_name), None)
             if vm:
-                log_message(deployment_id, f"Testing SSH connection to {vm_name} ({vm['ip']})")
+                log_message(deployment_id, f"Testing SSH connection to {vm_name} ({vm['ip']})", host=vm_name)
                 cmd = ["ssh", "-o", "StrictHostKeyChecking=no", "-o", "UserKnownHostsFile=/dev/null", 
                       "-i", "/home/users/infadm/.ssh/id_rsa", f"infadm@{vm['ip']}", "echo 'SSH Connection Test'"]
                 
                 try:
                     result = subprocess.run(cmd, capture_output=True, text=True, timeout=5)
                     if result.returncode == 0:
-                        log_message(deployment_id, f"SSH connection to {vm_name} successful")
+                        log_message(deployment_id, f"SSH connection to {vm_name} successful", host=vm_name)
                     else:
-                        log_message(deployment_id, f"SSH connection to {vm_name} failed: {result.stderr.strip()}")
+                        log_message(deployment_id, f"SSH connection to {vm_name} failed: {result.stderr.strip()}", host=vm_name, level='error')
                 except Exception as e:
                     log_message(deployment_id, f"SSH connection test error: {str(e)}")
         
+        phases.lap("ssh_probe")
+
         # Create ssh control directory to avoid "cannot bind to path" errors
         os.makedirs('/tmp/ansible-ssh', exist_ok=True)
         # os.chmod('/tmp/ansible-ssh', 0o777)
@@ -1099,6 +1407,7 @@ def process_file_deployment(deployment_id):
         except PermissionError:
             logger.info("Could not set permissions on /tmp/ansible-ssh - continuing with existing permissions")
         log_message(deployment_id, "Ensured ansible control path directory exists with permissions 777")
+        phases.lap("control_dir")
         
         # Run ansible playbook
         env_vars = os.environ.copy()
@@ -1112,15 +1421,17 @@ def process_file_deployment(deployment_id):
         log_message(deployment_id, f"Executing: {' '.join(cmd)}")
         logger.info(f"Executing Ansible command: {' '.join(cmd)}")
         
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env_vars)
+        progress.begin()
+        process = jobs.popen(deployment_id, cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env_vars)
         
         for line in process.stdout:
             line_stripped = line.strip()
-            log_message(deployment_id, line_stripped)
-            # Also log to main application log
-            logger.debug(f"[{deployment_id}] {line_stripped}")
+            log_message(deployment_id, line_stripped, source='ansible')
+            progress.feed(line_stripped)
         
         process.wait()
+        progress.finish(process.returncode == 0)
+        phases.lap("ansible")
         
         if process.returncode == 0:
             log_message(deployment_id, f"SUCCESS: File deployment completed successfully (initiated by {logged_in_user})")
@@ -1138,17 +1449,432 @@ def process_file_deployment(deployment_id):
             logger.debug(f"Cleaned up temporary files for deployment {deployment_id}")
         except Exception as e:
             logger.warning(f"Error cleaning up temporary files: {str(e)}")
+        phases.lap("cleanup")
         
         # Save deployment history after completion
         save_deployment_history()
+        phases.lap("save_history", record=False)
         
     except Exception as e:
         log_message(deployment_id, f"ERROR: Exception during file deployment: {str(e)}")
         deployments[deployment_id]["status"] = "failed"
+        progress.finish(False)
         logger.exception(f"Exception in file deployment {deployment_id}: {str(e)}")
         save_deployment_history()
 
 
+def run_relay_playbook(deployment_id, playbook_text, assignments, run_label, progress, phases):
+    """Run one relay playbook against the assigned VMs and return {vm_name: succeeded}"""
+    playbook_file = f"/tmp/relay_{deployment_id}_{run_label}.yml"
+    inventory_file = f"/tmp/relay_inventory_{deployment_id}_{run_label}"
+    ssh_args = "ansible_user=infadm ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'"
+    vms_by_name = {v["name"]: v for v in inventory["vms"]}
+
+    with open(playbook_file, 'w') as f:
+        f.write(playbook_text)
+
+    # Sources are listed in their own group so delegate_to can reach them
+    with open(inventory_file, 'w') as f:
+        f.write("[relay_tier]\n")
+        for assignment in assignments:
+            vm = vms_by_name[assignment["vm"]]
+            source_var = f" relay_source={assignment['source']}" if assignment.get("source") else ""
+            f.write(f"{vm['name']} ansible_host={vm['ip']} {ssh_args}{source_var}\n")
+        f.write("[relay_sources]\n")
+        for source in sorted({a["source"] for a in assignments if a.get("source")}):
+            f.write(f"{source} ansible_host={vms_by_name[source]['ip']} {ssh_args}\n")
+
+    env_vars = os.environ.copy()
+    env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
+    env_vars["ANSIBLE_HOST_KEY_CHECKING"] = "False"
+    env_vars["ANSIBLE_SSH_CONTROL_PATH"] = "/tmp/ansible-ssh/%h-%p-%r"
+    env_vars["ANSIBLE_SSH_CONTROL_PATH_DIR"] = "/tmp/ansible-ssh"
+
+    cmd = ["ansible-playbook", "-i", inventory_file, playbook_file, "-v"]
+    log_message(deployment_id, f"Executing: {' '.join(cmd)}")
+    phases.lap("render_playbook")
+
+    recap_lines = []
+    process = jobs.popen(deployment_id, cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env_vars)
+    for line in process.stdout:
+        line_stripped = line.strip()
+        log_message(deployment_id, line_stripped, source='ansible')
+        progress.feed(line_stripped, settle=run_label == "install")
+        if relay_distribution.RECAP_PATTERN.match(line_stripped):
+            recap_lines.append(line_stripped)
+    process.wait()
+    phases.lap("install" if run_label == "install" else "relay_transfer")
+
+    try:
+        os.remove(playbook_file)
+        os.remove(inventory_file)
+    except Exception as e:
+        logger.warning(f"Error cleaning up temporary files: {str(e)}")
+    phases.lap("cleanup")
+
+    recap = relay_distribution.parse_recap(recap_lines)
+    return {a["vm"]: recap.get(a["vm"], False) for a in assignments}
+
+def process_relay_file_deployment(deployment_id, source_file, progress, phases):
+    """Distribute a file through seed VMs and peer-to-peer tiers, then install it everywhere"""
+    deployment = deployments[deployment_id]
+    file_name = deployment["file"]
+    logged_in_user = deployment["logged_in_user"]
+    final_target_path = os.path.join(deployment["target_path"], file_name)
+    staging_file = f"/tmp/fdo_relay/{deployment_id}/{file_name}"
+
+    vm_types = {v["name"]: v.get("type", "default") for v in inventory["vms"]}
+    pending = [vm for vm in deployment["vms"] if vm in vm_types]
+    failed_vms = [vm for vm in deployment["vms"] if vm not in vm_types]
+    for vm_name in failed_vms:
+        log_message(deployment_id, f"ERROR: VM {vm_name} not found in inventory", host=vm_name)
+
+    # Hosts stay running until the final install; staging failures close them early
+    progress.begin()
+    planned = relay_distribution.plan_relay_tiers(pending, vm_types)
+    log_message(deployment_id, f"Relay distribution planned: {len(pending)} VMs in {len(planned)} tiers (fanout {relay_distribution.RELAY_FANOUT})")
+
+    holders = []
+    tiers = []
+    deployments[deployment_id]["relay_tiers"] = tiers
+
+    while pending:
+        assignments = relay_distribution.plan_next_tier(holders, pending, vm_types)
+        tier_index = len(tiers)
+        tier = {
+            "tier": tier_index,
+            "hosts": [a["vm"] for a in assignments],
+            "sources": {a["vm"]: a["source"] or "orchestrator" for a in assignments},
+            "status": "running"
+        }
+        tiers.append(tier)
+        log_message(deployment_id, f"Relay tier {tier_index}: {len(assignments)} VMs")
+
+        tier_start = time.time()
+        for seed_tier in (True, False):
+            group = [a for a in assignments if (a["source"] is None) == seed_tier]
+            if not group:
+                continue
+            playbook_text = relay_distribution.render_tier_playbook(
+                source_file, staging_file, seed_tier, final_target_path, deployment["source_sha256"],
+                deployment.get("skip_identical", True), deployment.get("transfer_mode_used", "copy"))
+            label = f"tier{tier_index}_{'seed' if seed_tier else 'peer'}"
+            for vm_name, succeeded in run_relay_playbook(deployment_id, playbook_text, group, label, progress, phases).items():
+                if succeeded:
+                    holders.append(vm_name)
+                else:
+                    failed_vms.append(vm_name)
+
+        assigned = {a["vm"] for a in assignments}
+        pending = [vm for vm in pending if vm not in assigned]
+        tier_failed = [vm for vm in tier["hosts"] if vm in failed_vms]
+        tier["duration"] = round(time.time() - tier_start, 3)
+        tier["status"] = "failed" if tier_failed else "success"
+        log_message(deployment_id, f"Relay tier {tier_index} finished in {tier['duration']}s: {len(tier['hosts']) - len(tier_failed)} ok, {len(tier_failed)} failed")
+
+    if holders:
+        log_message(deployment_id, f"Installing relayed file on {len(holders)} VMs")
+        install_playbook = relay_distribution.render_install_playbook(
+            staging_file, final_target_path, os.path.dirname(final_target_path),
+            deployment["user"], deployment["sudo"], deployment.get("create_backup", True),
+            deployment.get("skip_identical", True))
+        install_results = run_relay_playbook(deployment_id, install_playbook, [{"vm": vm, "source": None} for vm in holders], "install", progress, phases)
+        failed_vms.extend(vm for vm, succeeded in install_results.items() if not succeeded)
+        for vm_name, succeeded in install_results.items():
+            progress.complete(vm_name, succeeded)
+    progress.finish(False)
+
+    if not failed_vms:
+        log_message(deployment_id, f"SUCCESS: File deployment completed successfully (initiated by {logged_in_user})")
+        deployments[deployment_id]["status"] = "success"
+        logger.info(f"Relay file deployment {deployment_id} completed successfully")
+    else:
+        log_message(deployment_id, f"ERROR: File deployment failed on VMs: {', '.join(failed_vms)} (initiated by {logged_in_user})")
+        deployments[deployment_id]["status"] = "failed"
+        logger.error(f"Relay file deployment {deployment_id} failed on {len(failed_vms)} VMs")
+
+    phases.skip()
+    save_deployment_history()
+    phases.lap("save_history", record=False)
+
+
+# API to deploy many files (across one or more FTs) in a single ansible run
+@app.route('/api/deploy/files/batch', methods=['POST'])
+def deploy_file_batch():
+    # Get current authenticated user
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"error": "Authentication required"}), 401
+
+    data = request.json or {}
+    entries = data.get('entries') or []
+    vms = data.get('vms')
+    sudo = data.get('sudo', False)
+    create_backup = data.get('createBackup', True)
+    skip_identical = data.get('skipIdentical', True)
+    transfer_mode = data.get('transferMode', 'auto')
+
+    if not all([entries, vms]):
+        logger.error("Missing required parameters for batch file deployment")
+        return jsonify({"error": "Missing required parameters"}), 400
+
+    if transfer_mode not in TRANSFER_MODES:
+        return jsonify({"error": f"Invalid transferMode. Must be one of: {', '.join(TRANSFER_MODES)}"}), 400
+
+    manifest = []
+    for index, entry in enumerate(entries):
+        if not all([entry.get('ft'), entry.get('file'), entry.get('targetPath'), entry.get('user')]):
+            logger.error(f"Batch entry {index} is missing ft, file, targetPath or user")
+            return jsonify({"error": f"Entry {index} is missing ft, file, targetPath or user"}), 400
+        manifest.append({
+            "id": str(index),
+            "ft": entry['ft'],
+            "file": entry['file'],
+            "target_path": entry['targetPath'],
+            "user": entry['user']
+        })
+
+    logger.info(f"Batch file deployment request received from {current_user['username']}: {len(manifest)} files to {len(vms)} VMs")
+
+    # Generate a unique deployment ID
+    deployment_id = str(uuid.uuid4())
+
+    deployments[deployment_id] = {
+        "id": deployment_id,
+        "type": "file_batch",
+        "entries": manifest,
+        "logged_in_user": current_user['username'],  # User who initiated the deployment
+        "user_role": current_user['role'],  # Role of the user who initiated
+        "vms": vms,
+        "sudo": sudo,
+        "create_backup": create_backup,
+        "skip_identical": skip_identical,
+        "transfer_mode": transfer_mode,
+        "status": "running",
+        "timestamp": time.time(),
+        "logs": [],
+        "file_results": []
+    }
+
+    # Save deployment history
+    save_deployment_history()
+
+    # Start deployment in a separate thread
+    jobs.start(deployment_id, 'file_batch', process_file_batch_deployment, (deployment_id,))
+
+    logger.info(f"Batch file deployment initiated by {current_user['username']} with ID: {deployment_id}")
+    return jsonify({
+        "deploymentId": deployment_id,
+        "initiatedBy": current_user['username'],
+        "files": len(manifest)
+    })
+
+def process_file_batch_deployment(deployment_id):
+    deployment = deployments[deployment_id]
+    progress = track_hosts(deployment_id, deployment["vms"])
+    phases = PhaseTimer(deployment)
+
+    try:
+        entries = deployment["entries"]
+        vms = deployment["vms"]
+        sudo = deployment["sudo"]
+        logged_in_user = deployment["logged_in_user"]
+        create_backup = deployment.get("create_backup", True)
+        skip_identical = deployment.get("skip_identical", True)
+        transfer_mode = deployment.get("transfer_mode", "auto")
+
+        log_message(deployment_id, f"Starting batch deployment of {len(entries)} files to {len(vms)} VMs (initiated by {logged_in_user})")
+
+        # Resolve and hash every source once on the controller
+        batch_files = []
+        missing = []
+        for entry in entries:
+            source_file = os.path.join(FIX_FILES_DIR, 'AllFts', entry["ft"], entry["file"])
+            if not os.path.exists(source_file):
+                missing.append(source_file)
+                continue
+            batch_files.append({
+                "id": entry["id"],
+                "src": source_file,
+                "dest": os.path.join(entry["target_path"], entry["file"]),
+                "user": entry["user"],
+                "sha256": hash_catalog.get_file_hash(source_file),
+                "transfer_mode": select_transfer_mode(source_file, transfer_mode)
+            })
+
+        if missing:
+            for source_file in missing:
+                log_message(deployment_id, f"ERROR: Source file not found: {source_file}")
+            deployments[deployment_id]["status"] = "failed"
+            progress.finish(False)
+            logger.error(f"Batch deployment {deployment_id} aborted: {len(missing)} source files missing")
+            save_deployment_history()
+            return
+
+        target_dirs = sorted({os.path.dirname(f["dest"]) for f in batch_files})
+        rsync_count = sum(1 for f in batch_files if f["transfer_mode"] == "rsync")
+        log_message(deployment_id, f"Transfer modes: {len(batch_files) - rsync_count} copy, {rsync_count} rsync")
+        phases.lap("prepare")
+
+        # Copy and rsync entries are split into separate looped tasks
+        needs_transfer = "not (skip_identical and item.stat.exists and (item.stat.checksum | default('')) == item.item.sha256)"
+        copy_tasks = render_transfer_tasks(
+            "copy", "{{ item.item.src }}", "{{ item.item.dest }}", "{{ item.item.user }}", needs_transfer, "batch_copies",
+            loop="{{ batch_stats.results | selectattr('item.transfer_mode', 'equalto', 'copy') | list }}",
+            label="{{ item.item.dest }}", become_user="{{ item.item.user }}")
+        sync_tasks = render_transfer_tasks(
+            "rsync", "{{ item.item.src }}", "{{ item.item.dest }}", "{{ item.item.user }}", needs_transfer, "batch_syncs",
+            loop="{{ batch_stats.results | selectattr('item.transfer_mode', 'equalto', 'rsync') | list }}",
+            label="{{ item.item.dest }}", become_user="{{ item.item.user }}")
+
+        playbook_file = f"/tmp/file_batch_{deployment_id}.yml"
+        with open(playbook_file, 'w') as f:
+            f.write(f"""---
+- name: Deploy {len(batch_files)} files to VMs (initiated by {logged_in_user})
+  hosts: deployment_targets
+  gather_facts: false
+  become: {"true" if sudo else "false"}
+  become_method: sudo
+  vars:
+    batch_files: {json.dumps(batch_files)}
+    create_backup: {str(create_backup).lower()}
+    skip_identical: {str(skip_identical).lower()}
+    backup_suffix: "{{{{ lookup('pipe', 'date +%s') }}}}"
+  tasks:
+    - name: Test connection
+      ansible.builtin.ping:
+
+    - name: Create target directories if they do not exist
+      ansible.builtin.file:
+        path: "{{{{ item }}}}"
+        state: directory
+        mode: '0755'
+      loop: {json.dumps(target_dirs)}
+
+    - name: Stat target files
+      ansible.builtin.stat:
+        path: "{{{{ item.dest }}}}"
+        get_checksum: true
+        checksum_algorithm: sha256
+      loop: "{{{{ batch_files }}}}"
+      loop_control:
+        label: "{{{{ item.dest }}}}"
+      register: batch_stats
+
+    - name: Back up existing files that will change
+      ansible.builtin.copy:
+        src: "{{{{ item.item.dest }}}}"
+        dest: "{{{{ item.item.dest }}}}.bak.{{{{ backup_suffix }}}}"
+        remote_src: yes
+      loop: "{{{{ batch_stats.results }}}}"
+      loop_control:
+        label: "{{{{ item.item.dest }}}}"
+      when: create_backup and item.stat.exists and (item.stat.checksum | default('')) != item.item.sha256
+
+    - name: Transfer files to target VMs
+      block:
+{textwrap.indent(copy_tasks + chr(10) + sync_tasks, '    ')}
+      ignore_errors: true
+
+    - name: Report per-file results
+      ansible.builtin.debug:
+        msg: "BATCH_RESULT|{{{{ inventory_hostname }}}}|{{{{ item.item.item.id }}}}|{{{{ 'unchanged' if (item.skipped | default(false)) else ('failed' if (item.failed | default(false)) else ('changed' if item.changed else 'unchanged')) }}}}"
+      loop: "{{{{ (batch_copies.results | default([])) + (batch_syncs.results | default([])) }}}}"
+      loop_control:
+        label: "{{{{ item.item.item.dest }}}}"
+""")
+        logger.debug(f"Created Ansible batch playbook: {playbook_file}")
+        phases.lap("render_playbook")
+
+        inventory_file = f"/tmp/inventory_{deployment_id}"
+        with open(inventory_file, 'w') as f:
+            f.write("[deployment_targets]\n")
+            for vm_name in vms:
+                vm = next((v for v in inventory["vms"] if v["name"] == vm_name), None)
+                if vm:
+                    f.write(f"{vm_name} ansible_host={vm['ip']} ansible_user=infadm ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'\n")
+                else:
+                    log_message(deployment_id, f"WARNING: VM {vm_name} not found in inventory", host=vm_name)
+
+        phases.lap("write_inventory")
+
+        env_vars = os.environ.copy()
+        env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
+        env_vars["ANSIBLE_HOST_KEY_CHECKING"] = "False"
+        env_vars["ANSIBLE_SSH_CONTROL_PATH"] = "/tmp/ansible-ssh/%h-%p-%r"
+        env_vars["ANSIBLE_SSH_CONTROL_PATH_DIR"] = "/tmp/ansible-ssh"
+
+        cmd = ["ansible-playbook", "-i", inventory_file, playbook_file, "-v"]
+        log_message(deployment_id, f"Executing: {' '.join(cmd)}")
+        logger.info(f"Executing Ansible command: {' '.join(cmd)}")
+
+        # Collect per-host, per-file outcomes while streaming the output
+        host_results = {}
+        result_pattern = re.compile(r'BATCH_RESULT\|([^|"]+)\|([^|"]+)\|(\w+)')
+
+        progress.begin()
+        process = jobs.popen(deployment_id, cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env_vars)
+        for line in process.stdout:
+            line_stripped = line.strip()
+            log_message(deployment_id, line_stripped, source='ansible')
+            progress.feed(line_stripped)
+            match = result_pattern.search(line_stripped)
+            if match:
+                host, entry_id, outcome = match.groups()
+                host_results.setdefault(entry_id, {})[host] = outcome
+        process.wait()
+        phases.lap("ansible")
+
+        # Build one result per manifest entry; hosts without a result never reached the copy
+        file_results = []
+        any_failed = process.returncode != 0
+        for entry in entries:
+            hosts = {vm_name: host_results.get(entry["id"], {}).get(vm_name, "not_run") for vm_name in vms}
+            entry_failed = any(outcome in ("failed", "not_run") for outcome in hosts.values())
+            any_failed = any_failed or entry_failed
+            file_results.append({
+                "ft": entry["ft"],
+                "file": entry["file"],
+                "target_path": entry["target_path"],
+                "status": "failed" if entry_failed else "success",
+                "hosts": hosts
+            })
+        deployments[deployment_id]["file_results"] = file_results
+        for vm_name in vms:
+            progress.complete(vm_name, not any(r["hosts"][vm_name] in ("failed", "not_run") for r in file_results))
+
+        changed = sum(1 for r in file_results for outcome in r["hosts"].values() if outcome == "changed")
+        unchanged = sum(1 for r in file_results for outcome in r["hosts"].values() if outcome == "unchanged")
+        log_message(deployment_id, f"Batch summary: {changed} transfers, {unchanged} already identical, {len(file_results)} files")
+
+        if not any_failed:
+            log_message(deployment_id, f"SUCCESS: Batch file deployment completed successfully (initiated by {logged_in_user})")
+            deployments[deployment_id]["status"] = "success"
+            logger.info(f"Batch file deployment {deployment_id} completed successfully")
+        else:
+            failed_files = [r["file"] for r in file_results if r["status"] == "failed"]
+            log_message(deployment_id, f"ERROR: Batch file deployment failed for: {', '.join(failed_files) or 'ansible run'} (initiated by {logged_in_user})")
+            deployments[deployment_id]["status"] = "failed"
+            logger.error(f"Batch file deployment {deployment_id} failed with return code {process.returncode}")
+
+        try:
+            os.remove(playbook_file)
+            os.remove(inventory_file)
+        except Exception as e:
+            logger.warning(f"Error cleaning up temporary files: {str(e)}")
+        phases.lap("cleanup")
+
+        save_deployment_history()
+        phases.lap("save_history", record=False)
+
+    except Exception as e:
+        log_message(deployment_id, f"ERROR: Exception during batch file deployment: {str(e)}")
+        deployments[deployment_id]["status"] = "failed"
+        progress.finish(False)
+        logger.exception(f"Exception in batch file deployment {deployment_id}: {str(e)}")
+        save_deployment_history()
+
+
 # # API to validate file deployment
 
 @app.route('/api/deploy/<deployment_id>/validate', methods=['POST'])
@@ -1173,13 +1899,20 @@ def validate_deployment(deployment_id):
     target_path = os.path.join(deployment["target_path"], file_name)
 
     log_message(deployment_id, f"Starting validation for file {file_name} on {len(vms)} VMs")
+
+    # Expected hash of the source file, compared server-side against each target
+    expected_sha256 = hash_catalog.get_ft_file_hash(deployment.get("ft", ""), file_name)
+    if expected_sha256:
+        log_message(deployment_id, f"Expected SHA-256 from source: {expected_sha256}")
+    else:
+        log_message(deployment_id, f"WARNING: Source file for {file_name} not found, hash comparison skipped")
     
     results = []
 
     for vm_name in vms:
         vm = next((v for v in inventory["vms"] if v["name"] == vm_name), None)
         if not vm:
-            log_message(deployment_id, f"ERROR: VM {vm_name} not found in inventory")
+            log_message(deployment_id, f"ERROR: VM {vm_name} not found in inventory", host=vm_name)
             results.append({
                 "vm": vm_name,
                 "status": "ERROR",
@@ -1217,17 +1950,22 @@ def validate_deployment(deployment_id):
       shell: ls -la "{target_path}" | awk '{{print $1, $3, $4}}'
       register: perm_result
       when: file_check.stat.exists
+
+    - name: Get file SHA-256
+      shell: sha256sum "{target_path}" | awk '{{print $1}}'
+      register: sha256_result
+      when: file_check.stat.exists
 """)
             # log_message(deployment_id, f"Validation on {vm_name}: {result_message}")
             validate_inventory = f"/tmp/validate_inventory_{deployment_id}_{vm_name}"
             with open(validate_inventory, 'w') as f:
                 f.write(f"{vm_name} ansible_host={vm['ip']} ansible_user=infadm ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'")
 
-            log_message(deployment_id, f"Running validation on {vm_name}")
+            log_message(deployment_id, f"Running validation on {vm_name}", host=vm_name)
             cmd = ["ansible-playbook", "-i", validate_inventory, validate_playbook, "--limit", vm_name, "-v"]
             output = subprocess.check_output(cmd, stderr=subprocess.STDOUT).decode().strip()
             logger.debug(f"Validation output for {vm_name}: {output}")
-            log_message(deployment_id, f"Raw validation output on {vm_name}: {output}")
+            log_message(deployment_id, f"Raw validation output on {vm_name}: {output}", host=vm_name)
 
             # Initialize defaults
             cksum_info = "File not found"
@@ -1257,19 +1995,34 @@ def validate_deployment(deployment_id):
                     perm_info = fallback_perm.group(1).strip()
                     logger.debug(f"Extracted permissions (fallback) for {vm_name}: {perm_info}")
 
-            result_message = f"Checksum={cksum_info}, Permissions={perm_info}"
-            log_message(deployment_id, f"Validation on {vm_name}: {result_message}")           
+            # Extract SHA-256 and compare it with the source hash
+            sha256_info = None
+            sha256_match = re.search(r'TASK \[Get file SHA-256\].*?"stdout": "([0-9a-f]{64})"', output, re.DOTALL)
+            if sha256_match:
+                sha256_info = sha256_match.group(1)
+                logger.debug(f"Extracted SHA-256 for {vm_name}: {sha256_info}")
+
+            if expected_sha256 and sha256_info:
+                hash_status = "match" if sha256_info == expected_sha256 else "mismatch"
+            else:
+                hash_status = "unknown"
+
+            result_message = f"Checksum={cksum_info}, Permissions={perm_info}, SHA-256 {hash_status}"
+            log_message(deployment_id, f"Validation on {vm_name}: {result_message}", host=vm_name)
             results.append({
                 "vm": vm_name,
                 "status": "SUCCESS",
                 "message": result_message,
                 "cksum": cksum_info,
-                "permissions": perm_info
+                "permissions": perm_info,
+                "sha256": sha256_info,
+                "expected_sha256": expected_sha256,
+                "hash_status": hash_status
             })
 
         except subprocess.CalledProcessError as e:
             error = e.output.decode().strip()
-            log_message(deployment_id, f"Validation failed on {vm_name}: {error}")
+            log_message(deployment_id, f"Validation failed on {vm_name}: {error}", host=vm_name, level='error')
             results.append({
                 "vm": vm_name,
                 "status": "ERROR",
@@ -1289,6 +2042,112 @@ def validate_deployment(deployment_id):
     save_deployment_history()
     return jsonify({"results": results})
 
+# API to detect drift between an FT's files and what is deployed on a set of VMs
+@app.route('/api/fts/<ft>/drift', methods=['POST'])
+def detect_ft_drift(ft):
+    data = request.json or {}
+    vms = data.get('vms')
+    target_path = data.get('targetPath')
+    use_sudo = data.get('sudo', False)
+
+    logger.info(f"Drift check requested for FT {ft} at {target_path}")
+
+    if not all([vms, target_path]):
+        logger.error("Missing required parameters for drift check")
+        return jsonify({"error": "Missing required parameters"}), 400
+
+    source_hashes = hash_catalog.get_ft_hashes(ft)
+    files = data.get('files') or list(source_hashes.keys())
+    files = [f for f in files if f in source_hashes]
+    if not files:
+        return jsonify({"error": "No source files found for FT"}), 404
+
+    playbook_file = f"/tmp/drift_{uuid.uuid4()}.yml"
+    inventory_file = f"/tmp/drift_inventory_{uuid.uuid4()}"
+
+    try:
+        # One playbook run stats every file on every VM
+        with open(playbook_file, 'w') as f:
+            f.write(f"""---
+- name: Detect drift for FT {ft}
+  hosts: drift_targets
+  gather_facts: false
+  become: {"true" if use_sudo else "false"}
+  tasks:
+    - name: Stat target files
+      ansible.builtin.stat:
+        path: "{target_path}/{{{{ item }}}}"
+        get_checksum: true
+        checksum_algorithm: sha256
+      loop: {json.dumps(files)}
+      register: drift_stats
+
+    - name: Report target hashes
+      ansible.builtin.debug:
+        msg: "DRIFT|{{{{ inventory_hostname }}}}|{{{{ item.item }}}}|{{{{ item.stat.checksum | default('missing') }}}}"
+      loop: "{{{{ drift_stats.results }}}}"
+      loop_control:
+        label: "{{{{ item.item }}}}"
+""")
+
+        with open(inventory_file, 'w') as f:
+            f.write("[drift_targets]\n")
+            for vm_name in vms:
+                vm = next((v for v in inventory["vms"] if v["name"] == vm_name), None)
+                if vm:
+                    f.write(f"{vm_name} ansible_host={vm['ip']} ansible_user=infadm ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'\n")
+
+        env_vars = os.environ.copy()
+        env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
+        env_vars["ANSIBLE_HOST_KEY_CHECKING"] = "False"
+
+        cmd = ["ansible-playbook", "-i", inventory_file, playbook_file, "-v"]
+        result = subprocess.run(cmd, capture_output=True, text=True, env=env_vars, timeout=300)
+        output = result.stdout + result.stderr
+
+        target_hashes = {}
+        for host, file_name, checksum in re.findall(r'DRIFT\|([^|"]+)\|([^|"]+)\|([^"]+)"', output):
+            target_hashes.setdefault(host, {})[file_name] = checksum
+
+        results = []
+        for vm_name in vms:
+            host_hashes = target_hashes.get(vm_name)
+            for file_name in files:
+                expected = source_hashes[file_name]["sha256"]
+                if host_hashes is None:
+                    status = "unreachable"
+                    actual = None
+                else:
+                    actual = host_hashes.get(file_name, "missing")
+                    if actual == "missing":
+                        status = "missing"
+                    else:
+                        status = "match" if actual == expected else "mismatch"
+                results.append({
+                    "vm": vm_name,
+                    "file": file_name,
+                    "status": status,
+                    "sha256": actual if actual != "missing" else None,
+                    "expected_sha256": expected
+                })
+
+        drifted = [r for r in results if r["status"] != "match"]
+        logger.info(f"Drift check for FT {ft} completed: {len(drifted)} of {len(results)} entries drifted")
+        return jsonify({"ft": ft, "results": results, "drifted": len(drifted)})
+
+    except subprocess.TimeoutExpired:
+        logger.error(f"Drift check for FT {ft} timed out")
+        return jsonify({"error": "Drift check timed out"}), 504
+    except Exception as e:
+        logger.error(f"Error during drift check for FT {ft}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        for path in (playbook_file, inventory_file):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
 # API to run shell command
 @app.route('/api/command/shell', methods=['POST'])
 def run_shell_command():
@@ -1333,7 +2192,7 @@ def run_shell_command():
     save_deployment_history()
     
     # Start command execution in a separate thread
-    threading.Thread(target=process_shell_command, args=(deployment_id,)).start()
+    jobs.start(deployment_id, 'command', process_shell_command, (deployment_id,))
     
     logger.info(f"Shell command initiated by {current_user['username']} with ID: {deployment_id}")
     return jsonify({
@@ -1345,6 +2204,8 @@ def run_shell_command():
 
 def process_shell_command(deployment_id):
     deployment = deployments[deployment_id]
+    progress = track_hosts(deployment_id, deployment["vms"])
+    phases = PhaseTimer(deployment)
     
     try:
         command = deployment["command"]
@@ -1412,6 +2273,7 @@ def process_shell_command(deployment_id):
       when: command_result.stderr_lines is defined and command_result.stderr_lines | length > 0
 """)
         logger.debug(f"Created Ansible playbook for shell command: {playbook_file}")
+        phases.lap("render_playbook")
         
         # Generate inventory file for ansible
         inventory_file = f"/tmp/inventory_{deployment_id}"
@@ -1425,6 +2287,7 @@ def process_shell_command(deployment_id):
                     f.write(f"{vm_name} ansible_host={vm['ip']} ansible_user=infadm ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'\n")
         
         logger.debug(f"Created Ansible inventory: {inventory_file}")
+        phases.lap("write_inventory")
         
         # Ensure control path directory exists
         os.makedirs('/tmp/ansible-ssh', exist_ok=True)
@@ -1434,6 +2297,8 @@ def process_shell_command(deployment_id):
         except PermissionError:
             logger.info("Could not set permissions on /tmp/ansible-ssh - continuing with existing permissions")
         
+        phases.lap("control_dir")
+        
         # Run ansible playbook
         env_vars = os.environ.copy()
         env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
@@ -1446,15 +2311,17 @@ def process_shell_command(deployment_id):
         log_message(deployment_id, f"Executing: {' '.join(cmd)}")
         logger.info(f"Executing Ansible command: {' '.join(cmd)}")
         
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env_vars)
+        progress.begin()
+        process = jobs.popen(deployment_id, cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env_vars)
         
         for line in process.stdout:
             line_stripped = line.strip()
-            log_message(deployment_id, line_stripped)
-            # Also log to main application log
-            logger.debug(f"[{deployment_id}] {line_stripped}")
+            log_message(deployment_id, line_stripped, source='ansible')
+            progress.feed(line_stripped)
         
         process.wait()
+        progress.finish(process.returncode == 0)
+        phases.lap("ansible")
         
         if process.returncode == 0:
             log_message(deployment_id, f"SUCCESS: Shell command executed successfully (initiated by {logged_in_user})")
@@ -1471,13 +2338,16 @@ def process_shell_command(deployment_id):
             os.remove(inventory_file)
         except Exception as e:
             logger.warning(f"Error cleaning up temporary files: {str(e)}")
+        phases.lap("cleanup")
         
         # Save deployment history after completion
         save_deployment_history()
+        phases.lap("save_history", record=False)
         
     except Exception as e:
         log_message(deployment_id, f"ERROR: Exception during shell command execution: {str(e)}")
         deployments[deployment_id]["status"] = "failed"
+        progress.finish(False)
         logger.exception(f"Exception in shell command {deployment_id}: {str(e)}")
         save_deployment_history()
 
@@ -1491,132 +2361,42 @@ def get_deployment_history():
         logger.debug(f"Request headers: {dict(request.headers)}")
         logger.debug(f"Request args: {request.args}")
         
-        # Log deployments variable state
-        logger.debug(f"Deployments variable exists: {deployments is not None}")
-        logger.debug(f"Deployments type: {type(deployments)}")
-        logger.debug(f"Deployments length: {len(deployments) if deployments else 0}")
-        logger.debug(f"Deployments keys: {list(deployments.keys()) if deployments else []}")
-        
-        # Check if deployments is empty, try to reload from file
-        if not deployments:
-            logger.info("Deployments dictionary is empty, attempting to reload from file")
-            try:
-                logger.debug(f"Checking if history file exists: {DEPLOYMENT_HISTORY_FILE}")
-                logger.debug(f"File exists: {os.path.exists(DEPLOYMENT_HISTORY_FILE)}")
-                
-                if os.path.exists(DEPLOYMENT_HISTORY_FILE):
-                    with open(DEPLOYMENT_HISTORY_FILE, 'r') as f:
-                        loaded_deployments = json.load(f)
-                        logger.debug(f"Loaded deployments type: {type(loaded_deployments)}")
-                        logger.debug(f"Loaded deployments length: {len(loaded_deployments) if loaded_deployments else 0}")
-                        
-                        if loaded_deployments:
-                            # Update global deployments dictionary
-                            deployments.clear()
-                            deployments.update(loaded_deployments)
-                            logger.info(f"Successfully reloaded {len(deployments)} deployments from history file")
-                        else:
-                            logger.warning("Loaded deployments is empty or None")
-                else:
-                    logger.warning(f"Deployment history file does not exist: {DEPLOYMENT_HISTORY_FILE}")
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error when loading deployment history: {str(e)}")
-                logger.error(f"Error line: {e.lineno}, column: {e.colno}")
-            except Exception as e:
-                logger.error(f"Failed to reload deployment history: {str(e)}")
-                import traceback
-                logger.error(f"Full traceback: {traceback.format_exc()}")
-        
-        # Log current deployments state before processing
-        logger.debug(f"Final deployments count before processing: {len(deployments)}")
-        
-        # Get deployment values and normalize timestamps
-        logger.debug("Starting deployment processing...")
-        deployment_values = list(deployments.values())
-        logger.debug(f"Deployment values count: {len(deployment_values)}")
-        
-        # Normalize timestamps to consistent format (float/unix timestamp)
-        for i, d in enumerate(deployment_values):
-            original_timestamp = d.get("timestamp", 0)
-            logger.debug(f"Processing deployment {i}: original timestamp={original_timestamp} (type: {type(original_timestamp)})")
-            
-            try:
-                # Convert timestamp to float (unix timestamp) for consistent sorting
-                if isinstance(original_timestamp, str):
-                    # Try to parse string timestamp
-                    try:
-                        # Try ISO format first
-                        from datetime import datetime
-                        dt = datetime.fromisoformat(original_timestamp.replace('Z', '+00:00'))
-                        normalized_timestamp = dt.timestamp()
-                        logger.debug(f"Converted ISO string timestamp to float: {normalized_timestamp}")
-                    except ValueError:
-                        try:
-                            # Try other common formats
-                            dt = datetime.strptime(original_timestamp, '%Y-%m-%dT%H:%M:%S')
-                            normalized_timestamp = dt.timestamp()
-                            logger.debug(f"Converted string timestamp to float: {normalized_timestamp}")
-                        except ValueError:
-                            # If parsing fails, try to convert directly to float
-                            try:
-                                normalized_timestamp = float(original_timestamp)
-                                logger.debug(f"Converted string to float directly: {normalized_timestamp}")
-                            except ValueError:
-                                logger.warning(f"Could not parse timestamp '{original_timestamp}', using current time")
-                                normalized_timestamp = time.time()
-                elif isinstance(original_timestamp, (int, float)):
-                    normalized_timestamp = float(original_timestamp)
-                    logger.debug(f"Timestamp already numeric: {normalized_timestamp}")
-                else:
-                    logger.warning(f"Unknown timestamp type: {type(original_timestamp)}, using current time")
-                    normalized_timestamp = time.time()
-                
-                # Store normalized timestamp for sorting
-                d["_sort_timestamp"] = normalized_timestamp
-                
-            except Exception as e:
-                logger.error(f"Error processing timestamp for deployment {i}: {str(e)}")
-                d["_sort_timestamp"] = time.time()  # Default fallback
-        
-        # Sort deployments by normalized timestamp, newest first
-        logger.debug("Starting deployment sorting...")
-        sorted_deployments = sorted(
-            deployment_values,
-            key=lambda x: x.get("_sort_timestamp", 0),
-            reverse=True
-        )
-        logger.debug(f"Sorted deployments count: {len(sorted_deployments)}")
+        # Callers that do not ask for a page get the whole history, newest first
+        paged = 'page' in request.args or 'per_page' in request.args
+        page = request.args.get('page', 1, type=int)
+        per_page = request.args.get('per_page', HISTORY_PAGE_SIZE, type=int)
+        if page < 1 or per_page < 1:
+            return jsonify({"error": "page and per_page must be positive integers"}), 400
+        
+        # Sort on the history index, so only the requested page of records is read from disk;
+        # a timestamp that cannot be parsed sorts as the current time, as it always has
+        now = time.time()
+        ordered = sorted(((summary.epoch if summary.epoch is not None else now, deployment_id)
+                          for deployment_id, summary in deployments.summaries().items()), reverse=True)
+        if paged:
+            logger.debug(f"Deployments count: {len(ordered)}, page {page} of {per_page}")
+            selected = ordered[(page - 1) * per_page:page * per_page]
+        else:
+            logger.debug(f"Deployments count: {len(ordered)}")
+            selected = ordered
         
-        # Convert timestamps to ISO format for API response and clean up sort field
-        logger.debug("Converting timestamps for API response...")
-        for i, d in enumerate(sorted_deployments):
-            sort_timestamp = d.get("_sort_timestamp", 0)
-            
-            try:
-                # Convert to ISO format for API response
-                # d["timestamp"] = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(sort_timestamp))
-                # d["timestamp"] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(sort_timestamp))
-                d["timestamp"] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(sort_timestamp))
-                logger.debug(f"Final timestamp for deployment {i}: {d['timestamp']}")
-            except Exception as e:
-                logger.error(f"Error converting timestamp for deployment {i}: {str(e)}")
-                d["timestamp"] = "1970-01-01T00:00:00"  # Default fallback
-            
-            # Remove the temporary sort field
-            if "_sort_timestamp" in d:
-                del d["_sort_timestamp"]
-            
-            # Ensure logs field is present
-            if "logs" not in d:
-                d["logs"] = []
-                logger.debug(f"Added empty logs array to deployment {i}")
-            else:
-                logger.debug(f"Deployment {i} already has {len(d.get('logs', []))} log entries")
+        page_deployments = []
+        for sort_timestamp, deployment_id in selected:
+            record = deployments.peek(deployment_id)
+            if record is None:
+                continue
+            # Logs are served by /api/deploy/<id>/logs (and log_meta by .../logs/query), not with every listing
+            d = {k: v for k, v in record.items() if k not in ("logs", "log_meta")}
+            d["timestamp"] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(sort_timestamp))
+            d["log_count"] = len(record.get("logs") or [])
+            page_deployments.append(d)
         
-        logger.info(f"Successfully processed {len(sorted_deployments)} deployments")
+        logger.info(f"Successfully processed {len(page_deployments)} deployments")
         logger.debug("=== END: Getting deployment history ===")
         
-        return jsonify(sorted_deployments)
+        response = jsonify(page_deployments)
+        response.headers['X-Total-Count'] = str(len(ordered))
+        return response
         
     except Exception as e:
         import traceback
@@ -1646,9 +2426,17 @@ def get_recent_file_deployments():
         # Filter and sort deployments
         file_deployments = []
         
-        for deployment_id, deployment in deployments.items():
+        # Pick the candidates from the history index so only ten records are read;
+        # records without a timestamp sort first, as they are stamped with the current time below
+        candidates = [(summary.epoch if summary.epoch is not None else float('inf'), deployment_id)
+                      for deployment_id, summary in deployments.summaries().items()
+                      if summary.type == "file" and summary.status == "success"]
+        candidates.sort(reverse=True)
+        
+        for _, deployment_id in candidates[:10]:
+            deployment = deployments.peek(deployment_id)
             # Only include successful file deployments
-            if (deployment.get("type") == "file" and 
+            if (deployment and deployment.get("type") == "file" and 
                 deployment.get("status") == "success"):
                 
                 # Ensure timestamp is properly formatted
@@ -1665,6 +2453,7 @@ def get_recent_file_deployments():
                     deployment_copy = deployment.copy()
                     deployment_copy["timestamp"] = datetime.now(timezone.utc).isoformat()
                 
+                deployment_copy.pop("log_meta", None)
                 file_deployments.append(deployment_copy)
         
         # Sort by timestamp (most recent first)
@@ -1699,6 +2488,80 @@ def get_recent_file_deployments():
         logger.error(f"Error fetching recent file deployments: {str(e)}")
         return jsonify({"error": "Failed to fetch recent deployments"}), 500
 
+# API to search deployment logs and metadata, best matches first
+@app.route('/api/deployments/search', methods=['GET'])
+def search_deployments():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"error": "Missing search query (q)"}), 400
+    sort = request.args.get('sort', 'relevance')
+    if sort not in ('relevance', 'newest'):
+        return jsonify({"error": "Invalid sort. Must be one of: relevance, newest"}), 400
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), SEARCH_MAX_PER_PAGE)
+    # since/until accept epoch seconds or ISO 8601
+    since = record_epoch(request.args['since']) if request.args.get('since') else None
+    until = record_epoch(request.args['until']) if request.args.get('until') else None
+
+    try:
+        started = time.perf_counter()
+        total, results = search_index.search(
+            query,
+            job_type=request.args.get('type'),
+            status=request.args.get('status'),
+            since=since,
+            until=until,
+            sort=sort,
+            page=page,
+            per_page=per_page
+        )
+        return jsonify({
+            "query": query,
+            "total": total,
+            "page": page,
+            "per_page": per_page,
+            "results": results,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2)
+        })
+    except Exception as e:
+        logger.error(f"Error searching deployments for '{query}': {str(e)}")
+        return jsonify({"error": "Search failed"}), 500
+
+# API to get per-phase timing percentiles across recent deployments
+@app.route('/api/deployments/phases', methods=['GET'])
+def get_phase_percentiles():
+    try:
+        job_type = request.args.get('type')
+        limit = request.args.get('limit', 1000, type=int)
+
+        # Walk the history index newest first and read records only until `limit` with phases are found
+        candidates = sorted(((summary.epoch or 0, deployment_id) for deployment_id, summary in deployments.summaries().items()
+                             if not job_type or summary.type == job_type), reverse=True)
+        records = []
+        for _, deployment_id in candidates:
+            if len(records) >= limit:
+                break
+            record = deployments.peek(deployment_id)
+            if record and record.get('phases'):
+                records.append(record)
+        return jsonify(phase_percentiles(records))
+    except Exception as e:
+        logger.error(f"Error computing phase percentiles: {str(e)}")
+        return jsonify({"error": "Failed to compute phase percentiles"}), 500
+
+def count_sse_connection(stream, events):
+    """Pass an SSE generator through while counting it as an open connection"""
+    metrics.SSE_CONNECTIONS.inc(stream=stream)
+    try:
+        yield from events
+    finally:
+        metrics.SSE_CONNECTIONS.dec(stream=stream)
+
+# Prometheus scrape endpoint; reads metric snapshots only, never the deployments state
+@app.route('/metrics')
+def get_metrics():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 # API to get logs for a specific deployment
 
 
@@ -1712,46 +2575,13 @@ def get_deployment_logs(deployment_id):
         for attempt in range(max_retries):
             logger.debug(f"Attempt {attempt + 1} to find deployment {deployment_id}")
             
-            # First check in-memory deployments
-            if deployment_id in deployments:
-                logger.info(f"Found deployment {deployment_id} in memory on attempt {attempt + 1}")
-                return deployments[deployment_id]
-            
-            # If not found in memory, try to load from history file
-            logger.debug(f"Deployment {deployment_id} not in memory, checking history file (attempt {attempt + 1})")
-            
+            # The history store covers both running deployments and saved ones on disk
             try:
-                if os.path.exists(DEPLOYMENT_HISTORY_FILE):
-                    # Add increasing delay for each retry to handle race conditions
-                    if attempt > 0:
-                        delay = 0.5 * attempt
-                        logger.debug(f"Waiting {delay}s before reading file (attempt {attempt + 1})")
-                        time.sleep(delay)
-                    
-                    with open(DEPLOYMENT_HISTORY_FILE, 'r') as f:
-                        saved_deployments = json.load(f)
-                        
-                        if deployment_id in saved_deployments:
-                            logger.info(f"Found deployment {deployment_id} in history file on attempt {attempt + 1}")
-                            deployment = saved_deployments[deployment_id]
-                            
-                            # Add it back to memory for future requests
-                            deployments[deployment_id] = deployment
-                            logger.debug(f"Added deployment {deployment_id} back to memory")
-                            
-                            return deployment
-                        else:
-                            logger.debug(f"Deployment {deployment_id} not found in history file (attempt {attempt + 1})")
-                            
-                else:
-                    logger.warning(f"History file {DEPLOYMENT_HISTORY_FILE} does not exist (attempt {attempt + 1})")
-                    
-            except json.JSONDecodeError as e:
-                logger.error(f"JSON decode error on attempt {attempt + 1}: {str(e)}")
-                if attempt == max_retries - 1:  # Last attempt
-                    return None
-                # Continue to next attempt
-                
+                deployment = deployments.get(deployment_id)
+                if deployment is not None:
+                    logger.info(f"Found deployment {deployment_id} on attempt {attempt + 1}")
+                    return deployment
+                logger.debug(f"Deployment {deployment_id} not found yet (attempt {attempt + 1})")
             except Exception as e:
                 logger.error(f"Error reading deployment history on attempt {attempt + 1}: {str(e)}")
                 if attempt == max_retries - 1:  # Last attempt
@@ -1781,7 +2611,7 @@ def get_deployment_logs(deployment_id):
                 yield f"data: {json.dumps({'status': current_status})}\n\n"
 
                 # Return if deployment is already completed
-                if current_status in ["success", "failed"]:
+                if current_status in TERMINAL_STATUSES:
                     logger.info(f"Deployment {deployment_id} is already completed with status: {current_status}")
                     return
                 
@@ -1803,7 +2633,8 @@ def get_deployment_logs(deployment_id):
                     
                     # Check if deployment status has changed
                     status = current_deployment.get("status", "running")
-                    if status in ["success", "failed"]:
+                    # A cancelled job reports its final status only once its worker has stopped
+                    if status in TERMINAL_STATUSES and not jobs.is_active(deployment_id):
                         yield f"data: {json.dumps({'status': status})}\n\n"
                         break
                     
@@ -1817,7 +2648,7 @@ def get_deployment_logs(deployment_id):
             else:
                 yield f"data: {json.dumps({'error': 'Deployment not found'})}\n\n"
 
-        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+        return Response(stream_with_context(count_sse_connection('deployment', generate())), mimetype='text/event-stream')
     else:
         # Return regular JSON response for non-streaming requests
         deployment = find_deployment_with_retry(deployment_id)
@@ -1854,7 +2685,7 @@ def get_command_logs(command_id):
                 yield f"data: {json.dumps({'status': command.get('status', 'running')})}\n\n"
 
                 # Return if command is already completed
-                if command.get("status") in ["success", "failed"]:
+                if command.get("status") in TERMINAL_STATUSES:
                     return
                 
                 # Otherwise, keep the connection open for new logs
@@ -1871,7 +2702,7 @@ def get_command_logs(command_id):
                     
                     # Check if command status has changed
                     status = deployments[command_id].get("status")
-                    if status in ["success", "failed"]:
+                    if status in TERMINAL_STATUSES and not jobs.is_active(command_id):
                         yield f"data: {json.dumps({'status': status})}\n\n"
                         break
                     
@@ -1879,7 +2710,7 @@ def get_command_logs(command_id):
             else:
                 yield f"data: {json.dumps({'error': 'Command not found'})}\n\n"
 
-        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+        return Response(stream_with_context(count_sse_connection('command', generate())), mimetype='text/event-stream')
     else:
         # Return regular JSON response for non-streaming requests
         if command_id in deployments:
@@ -1890,6 +2721,89 @@ def get_command_logs(command_id):
         else:
             return jsonify({"error": "Command not found"}), 404
 
+# API to cancel a running deployment
+@app.route('/api/deploy/<deployment_id>/cancel', methods=['POST'])
+def cancel_deployment(deployment_id):
+    # Get current authenticated user
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"error": "Authentication required"}), 401
+
+    if deployment_id not in deployments:
+        return jsonify({"error": "Deployment not found"}), 404
+
+    status = deployments[deployment_id].get("status")
+    if status in TERMINAL_STATUSES:
+        return jsonify({"error": f"Deployment already finished with status {status}"}), 409
+
+    reason = f"cancelled by {current_user['username']}"
+    if not jobs.cancel(deployment_id, reason):
+        return jsonify({"error": "Deployment has no running job"}), 409
+
+    log_message(deployment_id, f"Cancellation requested by {current_user['username']}")
+    logger.info(f"Cancellation of deployment {deployment_id} requested by {current_user['username']}")
+    return jsonify({"deploymentId": deployment_id, "status": "cancelling"})
+
+# API to get the per-host progress of a multi-host job without transferring its logs
+@app.route('/api/deploy/<deployment_id>/progress', methods=['GET'])
+def get_deployment_progress(deployment_id):
+    if deployment_id not in deployments:
+        return jsonify({"error": "Deployment not found"}), 404
+
+    deployment = deployments[deployment_id]
+    # Pollers pass the last version they saw; if nothing moved only the counters are returned
+    since = request.args.get('since', type=int)
+    unchanged = since is not None and since == deployment.get("host_states_version", 0)
+    include_hosts = not unchanged and request.args.get('hosts', 'true').lower() != 'false'
+    return jsonify(summarize_progress(deployment, include_hosts=include_hosts))
+
+# API to filter a deployment's log lines by host, level, source, text and time (epoch ms), paged by seq
+@app.route('/api/deploy/<deployment_id>/logs/query', methods=['GET'])
+def query_deployment_logs(deployment_id):
+    if deployment_id not in deployments:
+        return jsonify({"error": "Deployment not found"}), 404
+
+    level = request.args.get('level')
+    if level and level not in LOG_LEVELS:
+        return jsonify({"error": f"Invalid level. Must be one of: {', '.join(LOG_LEVELS)}"}), 400
+    pattern = None
+    if request.args.get('grep'):
+        try:
+            pattern = re.compile(request.args['grep'], re.IGNORECASE)
+        except re.error as e:
+            return jsonify({"error": f"Invalid grep pattern: {str(e)}"}), 400
+    limit = min(max(request.args.get('limit', 500, type=int), 1), LOG_QUERY_MAX_LIMIT)
+
+    try:
+        deployment = deployments[deployment_id]
+        entries, more = log_indexes.query(
+            deployment_id, deployment,
+            host=request.args.get('host'),
+            level=level,
+            source=request.args.get('source'),
+            pattern=pattern,
+            since=request.args.get('since', type=int),
+            until=request.args.get('until', type=int),
+            after=request.args.get('after', -1, type=int),
+            limit=limit
+        )
+        return jsonify({
+            "deploymentId": deployment_id,
+            "status": deployment.get("status"),
+            "entries": entries,
+            "more": more,
+            "next": entries[-1]['seq'] if entries else None,
+            "total_lines": len(deployment.get("logs", []))
+        })
+    except Exception as e:
+        logger.error(f"Error querying logs for deployment {deployment_id}: {str(e)}")
+        return jsonify({"error": "Failed to query deployment logs"}), 500
+
+# API to list running jobs with their elapsed time and deadline
+@app.route('/api/deploy/jobs', methods=['GET'])
+def list_active_jobs():
+    return jsonify(jobs.active_jobs())
+
 # Add a rollback endpoint
 @app.route('/api/deploy/<deployment_id>/rollback', methods=['POST'])
 def rollback_deployment(deployment_id):
@@ -1935,7 +2849,7 @@ def rollback_deployment(deployment_id):
     save_deployment_history()
     
     # Start rollback in a separate thread
-    threading.Thread(target=process_rollback, args=(rollback_id,)).start()
+    jobs.start(rollback_id, 'rollback', process_rollback, (rollback_id,))
     
     logger.info(f"Rollback initiated with ID: {rollback_id}")
     return jsonify({"deploymentId": rollback_id})
@@ -1943,6 +2857,8 @@ def rollback_deployment(deployment_id):
     
 def process_rollback(rollback_id):
     rollback = deployments[rollback_id]
+    progress = track_hosts(rollback_id, rollback["vms"])
+    phases = PhaseTimer(rollback)
     try:
         original_id = rollback["original_deployment"]
         vms = rollback["vms"]
@@ -1964,7 +2880,7 @@ def process_rollback(rollback_id):
         for vm_name in vms:
             vm = next((v for v in inventory["vms"] if v["name"] == vm_name), None)
             if not vm:
-                log_message(rollback_id, f"ERROR: VM {vm_name} not found in inventory")
+                log_message(rollback_id, f"ERROR: VM {vm_name} not found in inventory", host=vm_name)
                 failed_vms.append(vm_name)
                 overall_success = False
                 continue
@@ -2019,14 +2935,18 @@ def process_rollback(rollback_id):
       when: not target_file_stat.stat.exists
 """)
             
+            phases.lap("render_playbook")
+
             # Generate inventory file
             inventory_file = f"/tmp/rollback_inventory_{rollback_id}_{vm_name}"
             with open(inventory_file, 'w') as f:
                 f.write(f"{vm_name} ansible_host={vm['ip']} ansible_user=infadm ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'")
             
+            phases.lap("write_inventory")
+
             # Run ansible playbook
             cmd = ["ansible-playbook", "-i", inventory_file, playbook_file, "-v"]
-            log_message(rollback_id, f"Running rollback on {vm_name}: backup and remove {target_path}")
+            log_message(rollback_id, f"Running rollback on {vm_name}: backup and remove {target_path}", host=vm_name)
             
             env_vars = os.environ.copy()
             env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
@@ -2034,18 +2954,22 @@ def process_rollback(rollback_id):
             env_vars["ANSIBLE_SSH_CONTROL_PATH"] = "/tmp/ansible-ssh/%h-%p-%r"
             env_vars["ANSIBLE_SSH_CONTROL_PATH_DIR"] = "/tmp/ansible-ssh"
             
-            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env_vars)
+            progress.begin([vm_name])
+            process = jobs.popen(rollback_id, cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=env_vars)
             
             for line in process.stdout:
-                log_message(rollback_id, line.strip())
+                log_message(rollback_id, line.strip(), host=vm_name, source='ansible')
+                progress.feed(line)
             
             process.wait()
+            progress.finish(process.returncode == 0, [vm_name])
+            phases.lap("ansible")
             
             if process.returncode == 0:
-                log_message(rollback_id, f"Rollback completed successfully on {vm_name}")
-                log_message(rollback_id, f"File backed up as: {target_path}_{timestamp}")
+                log_message(rollback_id, f"Rollback completed successfully on {vm_name}", host=vm_name)
+                log_message(rollback_id, f"File backed up as: {target_path}_{timestamp}", host=vm_name)
             else:
-                log_message(rollback_id, f"FAILED: Rollback failed on {vm_name} (exit code: {process.returncode})")
+                log_message(rollback_id, f"FAILED: Rollback failed on {vm_name} (exit code: {process.returncode})", host=vm_name)
                 failed_vms.append(vm_name)
                 overall_success = False
             
@@ -2055,6 +2979,7 @@ def process_rollback(rollback_id):
                 os.remove(inventory_file)
             except Exception as cleanup_error:
                 log_message(rollback_id, f"Warning: Could not cleanup temp files: {str(cleanup_error)}")
+            phases.lap("cleanup")
         
         # Update rollback status based on overall success
         if overall_success:
@@ -2067,11 +2992,14 @@ def process_rollback(rollback_id):
                 log_message(rollback_id, f"Rollback FAILED on VMs: {', '.join(failed_vms)} (initiated by {logged_in_user})")
             log_message(rollback_id, "Rollback operation completed with failures")
         
+        phases.skip()
         save_deployment_history()
+        phases.lap("save_history", record=False)
         
     except Exception as e:
         log_message(rollback_id, f"ERROR: Exception during rollback: {str(e)} (initiated by {logged_in_user})")
         deployments[rollback_id]["status"] = "failed"
+        progress.finish(False)
         logger.exception(f"Exception in rollback {rollback_id}: {str(e)}")
         save_deployment_history()
 
@@ -2085,63 +3013,34 @@ def clear_deployment_history():
     if days < 0:
         return jsonify({"error": "Days must be a positive number"}), 400
     
-    # Calculate cutoff timestamp
-    cutoff_time = time.time() - (days * 86400)  # 86400 seconds in a day
-    
-    # Count deployments before deletion
-    initial_count = len(deployments)
-    
-    # Filter deployments to keep only those newer than the cutoff
-    if days == 0:  # If days is 0, clear all logs
-        deployments.clear()
-    else:
-        to_delete = []
-        for deployment_id, deployment in deployments.items():
-            try:
-                # Get timestamp and convert to float if it's a string
-                timestamp = deployment.get('timestamp', 0)
-                if isinstance(timestamp, str):
-                    # Try to convert string timestamp to float
-                    try:
-                        timestamp = float(timestamp)
-                    except ValueError:
-                        # If conversion fails, treat as very old (0)
-                        timestamp = 0
-                elif timestamp is None:
-                    timestamp = 0
-                
-                # Compare with cutoff time
-                if timestamp < cutoff_time:
-                    to_delete.append(deployment_id)
-                    
-            except Exception as e:
-                logger.warning(f"Error processing timestamp for deployment {deployment_id}: {e}")
-                # If there's any error, consider it for deletion (treat as old)
-                to_delete.append(deployment_id)
-        
-        # Delete the identified deployments
-        for deployment_id in to_delete:
-            try:
-                del deployments[deployment_id]
-            except KeyError:
-                logger.warning(f"Deployment {deployment_id} was already deleted")
-    
-    # Count how many were deleted
-    deleted_count = initial_count - len(deployments)
-    
-    # Save updated deployment history
+    # Deployments with a running job are kept; the rest are removed oldest first in batches
     try:
-        save_deployment_history()
+        report = compactor.clear_older_than(days)
     except Exception as e:
-        logger.error(f"Error saving deployment history: {e}")
+        logger.error(f"Error clearing deployment history: {e}")
         return jsonify({"error": "Failed to save deployment history"}), 500
     
     return jsonify({
-        "message": f"Successfully cleared {deleted_count} deployment logs",
-        "deleted_count": deleted_count,
-        "remaining_count": len(deployments)
+        "message": f"Successfully cleared {report['deleted']} deployment logs",
+        "deleted_count": report['deleted'],
+        "remaining_count": len(deployments),
+        "reclaimed_bytes": report['reclaimed_bytes']
     })
 
+# API to show the retention policy and what the last compactor run removed
+@app.route('/api/deployments/retention', methods=['GET'])
+def get_retention_status():
+    return jsonify(compactor.status())
+
+# API to apply the retention policy now instead of waiting for the next scheduled run
+@app.route('/api/deployments/retention/run', methods=['POST'])
+def run_retention():
+    try:
+        return jsonify(compactor.run())
+    except Exception as e:
+        logger.error(f"Error applying retention policy: {e}")
+        return jsonify({"error": "Failed to apply retention policy"}), 500
+
 
 
 def get_current_timestamp():
@@ -2189,7 +3088,7 @@ def systemd_operation(operation):
     save_deployment_history()
     
     # Start systemd operation in a separate thread
-    threading.Thread(target=process_systemd_operation, args=(deployment_id, operation, service, vms)).start()
+    jobs.start(deployment_id, 'systemd', process_systemd_operation, (deployment_id, operation, service, vms))
     
     logger.info(f"Systemd {operation} initiated with ID: {deployment_id} initiated by {current_user['username']}")
     return jsonify({"deploymentId": deployment_id, "initiatedBy": current_user['username']})
@@ -2197,6 +3096,8 @@ def systemd_operation(operation):
 
 def process_systemd_operation(deployment_id, operation, service, vms):
     deployment = deployments[deployment_id]
+    progress = track_hosts(deployment_id, vms)
+    phases = PhaseTimer(deployment)
     try:
         logged_in_user = deployment["logged_in_user"]  # User who initiated
         user = deployment.get("user", "infadm")
@@ -2381,6 +3282,8 @@ def process_systemd_operation(deployment_id, operation, service, vms):
       when: service_exists
 """)
 
+        phases.lap("render_playbook")
+
         # Generate inventory file for ansible
         inventory_file = f"/tmp/inventory_{deployment_id}"
         
@@ -2392,6 +3295,8 @@ def process_systemd_operation(deployment_id, operation, service, vms):
                 if vm:
                     f.write(f"{vm_name} ansible_host={vm['ip']} ansible_user=infadm ansible_ssh_private_key_file=/home/users/infadm/.ssh/id_rsa ansible_ssh_common_args='-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null -o ControlMaster=auto -o ControlPath=/tmp/ansible-ssh/%h-%p-%r -o ControlPersist=60s'\n")
         
+        phases.lap("write_inventory")
+        
         # Run ansible playbook
         env_vars = os.environ.copy()
         env_vars["ANSIBLE_CONFIG"] = "/etc/ansible/ansible.cfg"
@@ -2404,31 +3309,25 @@ def process_systemd_operation(deployment_id, operation, service, vms):
         log_message(deployment_id, f"Executing: {' '.join(cmd)}")
         logger.info(f"Executing Ansible command: {' '.join(cmd)}")
         
-        # Use subprocess.run with capture_output=True instead of Popen
-        result = subprocess.run(cmd, capture_output=True, text=True, env=env_vars, timeout=300)
-        
-        # Log the output line by line
-        if result.stdout:
-            log_message(deployment_id, "=== ANSIBLE OUTPUT ===")
-            for line in result.stdout.splitlines():
-                if line.strip():  # Only log non-empty lines
-                    log_message(deployment_id, line.strip())
-        
-        if result.stderr:
-            log_message(deployment_id, "=== ANSIBLE STDERR ===")
-            for line in result.stderr.splitlines():
-                if line.strip():  # Only log non-empty lines
-                    log_message(deployment_id, line.strip())
+        # Stream the output so per-host progress is visible while the play runs
+        log_message(deployment_id, "=== ANSIBLE OUTPUT ===")
+        progress.begin()
+        returncode = stream_command(cmd, JobOutput(deployment_id, progress), timeout=300, env=env_vars,
+                                    stderr_prefix="STDERR: ", deployment_id=deployment_id)
+        if returncode is None:
+            raise subprocess.TimeoutExpired(cmd, 300)
+        progress.finish(returncode == 0)
+        phases.lap("ansible")
         
         # Check result and update status
-        if result.returncode == 0:
+        if returncode == 0:
             log_message(deployment_id, f"SUCCESS: Systemd {operation} operation completed successfully (initiated by {logged_in_user})")
             deployments[deployment_id]["status"] = "completed"
             logger.info(f"Systemd operation {deployment_id} completed successfully (initiated by {logged_in_user})")
         else:
-            log_message(deployment_id, f"ERROR: Systemd {operation} operation failed with return code {result.returncode} (initiated by {logged_in_user})")
+            log_message(deployment_id, f"ERROR: Systemd {operation} operation failed with return code {returncode} (initiated by {logged_in_user})")
             deployments[deployment_id]["status"] = "failed"
-            logger.error(f"Systemd operation {deployment_id} failed with return code {result.returncode} (initiated by {logged_in_user})")
+            logger.error(f"Systemd operation {deployment_id} failed with return code {returncode} (initiated by {logged_in_user})")
         
         # Clean up temporary files
         try:
@@ -2436,19 +3335,23 @@ def process_systemd_operation(deployment_id, operation, service, vms):
             os.remove(inventory_file)
         except Exception as e:
             logger.warning(f"Error cleaning up temporary files: {str(e)}")
+        phases.lap("cleanup")
         
         # Save deployment history after completion
         save_deployment_history()
+        phases.lap("save_history", record=False)
         
     except subprocess.TimeoutExpired:
         log_message(deployment_id, f"ERROR: Systemd {operation} operation timed out after 5 minutes")
         deployments[deployment_id]["status"] = "failed"
+        progress.finish(False)
         logger.error(f"Systemd operation {deployment_id} timed out")
         save_deployment_history()
         
     except Exception as e:
         log_message(deployment_id, f"ERROR: Exception during systemd operation: {str(e)}")
         deployments[deployment_id]["status"] = "failed"
+        progress.finish(False)
         logger.exception(f"Exception in systemd operation {deployment_id}: {str(e)}")
         save_deployment_history()
 
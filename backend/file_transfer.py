@@ -0,0 +1,70 @@
+import os
+import logging
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+# Files at or above this size are sent with rsync (delta + compression) instead of ansible copy
+RSYNC_THRESHOLD_BYTES = int(os.environ.get('RSYNC_THRESHOLD_BYTES', 50 * 1024 * 1024))
+
+TRANSFER_MODES = ('auto', 'copy', 'rsync')
+
+
+def select_transfer_mode(source_file, requested='auto'):
+    """Pick copy or rsync for a source file; 'auto' decides by file size"""
+    if requested in ('copy', 'rsync'):
+        return requested
+
+    size = os.path.getsize(source_file)
+    mode = 'rsync' if size >= RSYNC_THRESHOLD_BYTES else 'copy'
+    logger.debug(f"Selected {mode} transfer for {source_file} ({size} bytes, threshold {RSYNC_THRESHOLD_BYTES})")
+    return mode
+
+
+def render_transfer_tasks(transfer_mode, src, dest, owner, when, register, loop=None, label=None, become_user=None):
+    """Render the ansible tasks that move a file to the targets with the given transfer mode.
+
+    src, dest, owner, when and become_user are inserted verbatim, so they may be literal values
+    or jinja expressions such as "{{ item.item.src }}". rsync compares the file with the target
+    itself; ansible copy still checksums src on the controller for every host, so large files
+    should go through rsync (see RSYNC_THRESHOLD_BYTES).
+    """
+    loop_lines = ""
+    if loop:
+        loop_lines = f"""      loop: "{loop}"
+      loop_control:
+        label: "{label or dest}"
+"""
+    become_line = f"""      become_user: "{become_user}"
+""" if become_user else ""
+
+    if transfer_mode == 'rsync':
+        return f"""    - name: Sync file to target VMs (rsync delta transfer)
+      ansible.posix.synchronize:
+        src: "{src}"
+        dest: "{dest}"
+        mode: push
+        archive: false
+        times: true
+        compress: true
+        checksum: false
+{become_line}{loop_lines}      when: {when}
+      register: {register}
+
+    - name: Set ownership and mode on synced file
+      ansible.builtin.file:
+        path: "{dest}"
+        owner: "{owner}"
+        mode: '0644'
+{loop_lines}      when: {when}
+"""
+
+    return f"""    - name: Copy file to target VMs
+      ansible.builtin.copy:
+        src: "{src}"
+        dest: "{dest}"
+        mode: '0644'
+        owner: "{owner}"
+{become_line}{loop_lines}      when: {when}
+      register: {register}
+"""
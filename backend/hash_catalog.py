@@ -0,0 +1,93 @@
+import os
+import hashlib
+import threading
+import logging
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+# Read fix files in 1MB chunks so large artifacts are never held in memory at once
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class HashCatalog:
+    """SHA-256 catalog of fix files, recomputed only when a file's mtime or size changes"""
+
+    def __init__(self, fix_files_dir):
+        self.fts_dir = os.path.join(fix_files_dir, 'AllFts')
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _compute(self, path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get_file_hash(self, path):
+        """Return the SHA-256 of a file, using the cached value when the file is unchanged"""
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry and entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            return entry['sha256']
+
+        # Hash outside the lock so a large file does not block lookups for other files
+        sha256 = self._compute(path)
+        with self._lock:
+            self._entries[key] = {'mtime': stat.st_mtime, 'size': stat.st_size, 'sha256': sha256}
+        logger.debug(f"Computed SHA-256 for {path}: {sha256}")
+        return sha256
+
+    def get_ft_file_hash(self, ft, file_name):
+        """Return the SHA-256 of a file in AllFts/<ft>/, or None if it does not exist"""
+        path = os.path.join(self.fts_dir, ft, file_name)
+        if not os.path.isfile(path):
+            return None
+        return self.get_file_hash(path)
+
+    def get_ft_hashes(self, ft):
+        """Return a {file_name: {sha256, size}} map for every file in an FT"""
+        ft_dir = os.path.join(self.fts_dir, ft)
+        hashes = {}
+        if not os.path.isdir(ft_dir):
+            return hashes
+
+        for file_name in sorted(os.listdir(ft_dir)):
+            path = os.path.join(ft_dir, file_name)
+            if not os.path.isfile(path):
+                continue
+            try:
+                hashes[file_name] = {
+                    'sha256': self.get_file_hash(path),
+                    'size': os.path.getsize(path)
+                }
+            except OSError as e:
+                logger.warning(f"Could not hash {path}: {str(e)}")
+        return hashes
+
+    def prune(self):
+        """Drop cached entries for fix files that were deleted or changed since they were hashed"""
+        with self._lock:
+            entries = list(self._entries.items())
+
+        stale = []
+        for path, entry in entries:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stale.append(path)
+                continue
+            if entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+                stale.append(path)
+
+        with self._lock:
+            for path in stale:
+                self._entries.pop(path, None)
+
+        if stale:
+            logger.info(f"Hash catalog pruned: {len(stale)} stale entries removed")
+        return len(stale)
@@ -0,0 +1,438 @@
+import os
+import json
+import uuid
+import fcntl
+import threading
+import logging
+from collections import OrderedDict, namedtuple
+from collections.abc import MutableMapping
+
+from search_index import record_epoch
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+# Finished deployments kept in memory after being read or saved; older ones are re-read from disk
+HISTORY_CACHE_SIZE = int(os.environ.get('HISTORY_CACHE_SIZE', 256))
+# Rewrite the data file once superseded and deleted records make up this share of it...
+HISTORY_COMPACT_RATIO = float(os.environ.get('HISTORY_COMPACT_RATIO', 0.5))
+# ...and at least this many bytes
+HISTORY_COMPACT_MIN_BYTES = int(os.environ.get('HISTORY_COMPACT_MIN_BYTES', 32 * 1024 * 1024))
+
+# First line of both files; the index is only trusted when its generation matches the data file's
+HEADER_KEY = '#deployment-history'
+
+# Where a record's latest version sits in the data file, and what list views need without loading it.
+# offset is None for a record that exists only in memory so far.
+HistoryEntry = namedtuple('HistoryEntry', 'offset length type status epoch line_count log_bytes')
+
+
+def encode_record(deployment_id, record):
+    """One data file line: [id, record], or [id, null] for a deletion"""
+    return (json.dumps([deployment_id, record], default=str, separators=(',', ':')) + '\n').encode()
+
+
+def summarize(record, offset=None, length=None):
+    logs = record.get('logs') or []
+    return HistoryEntry(offset, length, record.get('type'), record.get('status'),
+                        record_epoch(record.get('timestamp')), len(logs), sum(len(str(line)) for line in logs))
+
+
+class HistoryStore(MutableMapping):
+    """Deployment history as an append-only JSON lines file plus a compact on-disk index.
+
+    Startup only reads the index (id, offsets, type, status, timestamp, log size per record),
+    so it takes the same time whether the history holds a hundred deployments or a hundred
+    thousand. A record is read from disk the first time it is looked up and kept in an LRU of
+    HISTORY_CACHE_SIZE; records of running jobs and records not yet saved always stay in memory.
+
+    save() appends only the records that changed since they were last written, and the index
+    entries pointing at them. Superseded versions are garbage until the data file is rewritten,
+    which happens when they make up HISTORY_COMPACT_RATIO of it.
+
+    It is a dict of id -> record to callers. Iterating values() or items() reads records
+    without caching them, so one pass over the history does not flush the cache.
+    """
+
+    def __init__(self, data_file, index_file, is_pinned=None):
+        self.data_file = data_file
+        self.index_file = index_file
+        self.is_pinned = is_pinned or (lambda deployment_id, record: False)
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        # id -> HistoryEntry of the latest persisted version
+        self._index = {}
+        # id -> record for every record held in memory, least recently used first
+        self._live = OrderedDict()
+        # id -> hash of the encoded line last written, to tell changed records from clean ones
+        self._written = {}
+        # Looked up (and so possibly modified) since the last save
+        self._touched = set()
+        # In memory but never written
+        self._unsaved = set()
+        self._deleted = []
+        self._garbage = 0
+        self._size = 0
+        self._generation = None
+        self._data = None
+        self._lock_file = None
+        self._load()
+
+    # Loading
+
+    def _acquire_file_lock(self):
+        """Hold an exclusive lock on the store for the life of the process.
+
+        Two writers would each append at their own idea of the end of the file and overwrite
+        each other's records, so a second HistoryStore on the same files is refused.
+        """
+        self._lock_file = open(f'{self.data_file}.lock', 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock_file.close()
+            raise RuntimeError(f"{self.data_file} is already open in another HistoryStore")
+
+    def _load(self):
+        os.makedirs(os.path.dirname(self.data_file) or '.', exist_ok=True)
+        self._acquire_file_lock()
+        if not os.path.exists(self.data_file):
+            self._create({})
+            return
+        self._data = open(self.data_file, 'r+b')
+        self._generation, data_start = self._read_header(self._data)
+        if self._generation is None:
+            raise ValueError(f"{self.data_file} is not a deployment history file")
+
+        scan_from, rewrite = data_start, False
+        if os.path.exists(self.index_file):
+            scan_from, rewrite = self._read_index(data_start)
+        else:
+            rewrite = True
+        self._size = os.fstat(self._data.fileno()).st_size
+        if scan_from > self._size:
+            logger.warning(f"{self.index_file} points past the end of {self.data_file}, rebuilding it")
+            self._index, scan_from = {}, data_start
+        if scan_from < self._size:
+            logger.info(f"Indexing {self._size - scan_from} bytes of deployment history beyond the index")
+            self._scan(scan_from)
+            rewrite = True
+        live_bytes = sum(entry.length for entry in self._index.values())
+        self._garbage = self._size - data_start - live_bytes
+        if rewrite:
+            self._write_index(self.index_file, self._generation, self._index)
+        logger.info(f"Indexed {len(self._index)} deployments from {self.data_file} ({self._size} bytes)")
+
+    def _read_header(self, f):
+        """Return (generation, offset of the first record) from a file's header line"""
+        f.seek(0)
+        line = f.readline()
+        try:
+            key, generation = json.loads(line)
+        except ValueError:
+            return None, 0
+        return (generation, len(line)) if key == HEADER_KEY else (None, 0)
+
+    def _read_index(self, data_start):
+        """Load the index file; return (data offset it covers up to, whether it needs rewriting)"""
+        covered = data_start
+        with open(self.index_file, 'rb') as f:
+            generation, _ = self._read_header(f)
+            if generation != self._generation:
+                logger.warning(f"{self.index_file} does not match {self.data_file}, rebuilding it")
+                self._index = {}
+                return data_start, True
+            for line in f:
+                try:
+                    deployment_id, fields = json.loads(line)
+                except ValueError:
+                    # A save interrupted mid-line; what follows is recovered from the data file
+                    return covered, True
+                if fields[0] is None:
+                    # A deletion: [null, data offset after its tombstone line]
+                    self._index.pop(deployment_id, None)
+                    covered = max(covered, fields[1])
+                else:
+                    entry = HistoryEntry(*fields)
+                    self._index[deployment_id] = entry
+                    covered = max(covered, entry.offset + entry.length)
+        return covered, False
+
+    def _scan(self, offset):
+        """Index data file lines from `offset`, cutting off a partly written last line"""
+        self._data.seek(offset)
+        for line in self._data:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                deployment_id, record = json.loads(line)
+            except ValueError:
+                break
+            if record is None:
+                self._index.pop(deployment_id, None)
+            else:
+                self._index[deployment_id] = summarize(record, offset, len(line))
+            offset += len(line)
+        if offset < os.fstat(self._data.fileno()).st_size:
+            logger.warning(f"Discarding {os.fstat(self._data.fileno()).st_size - offset} unreadable bytes "
+                           f"at the end of {self.data_file}")
+            self._data.truncate(offset)
+        self._size = offset
+
+    def _create(self, records):
+        """Start a new data file and index holding `records`"""
+        self._generation = uuid.uuid4().hex
+        self._index = self._write_data(self.data_file, self._generation,
+                                       ((deployment_id, encode_record(deployment_id, record), record)
+                                        for deployment_id, record in records.items()))
+        self._write_index(self.index_file, self._generation, self._index)
+        self._data = open(self.data_file, 'r+b')
+        self._size = os.fstat(self._data.fileno()).st_size
+        self._garbage = 0
+
+    def _write_data(self, path, generation, lines):
+        """Write a data file from (id, encoded line, record or entry) through a temporary file; return its index"""
+        index = {}
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(encode_record(HEADER_KEY, generation))
+            for deployment_id, line, source in lines:
+                offset = f.tell()
+                f.write(line)
+                if isinstance(source, HistoryEntry):
+                    index[deployment_id] = source._replace(offset=offset)
+                else:
+                    index[deployment_id] = summarize(source, offset, len(line))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return index
+
+    def _write_index(self, path, generation, index):
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(encode_record(HEADER_KEY, generation))
+            f.writelines(encode_record(deployment_id, list(entry)) for deployment_id, entry in index.items())
+        os.replace(tmp_path, path)
+
+    def import_records(self, records):
+        """Replace the whole history with `records`, e.g. when migrating from the old JSON file"""
+        with self._save_lock, self._lock:
+            self._data.close()
+            self._create(records)
+            self._live.clear()
+            self._written.clear()
+            self._touched.clear()
+            self._unsaved.clear()
+            self._deleted = []
+
+    # Mapping interface
+
+    def _read(self, entry):
+        return json.loads(os.pread(self._data.fileno(), entry.length, entry.offset))[1]
+
+    def __getitem__(self, deployment_id):
+        with self._lock:
+            record = self._live.get(deployment_id)
+            if record is None:
+                entry = self._index.get(deployment_id)
+                if entry is None:
+                    raise KeyError(deployment_id)
+                line = os.pread(self._data.fileno(), entry.length, entry.offset)
+                record = json.loads(line)[1]
+                self._live[deployment_id] = record
+                self._written[deployment_id] = hash(line)
+                self._evict()
+            else:
+                self._live.move_to_end(deployment_id)
+            self._touched.add(deployment_id)
+            return record
+
+    def __setitem__(self, deployment_id, record):
+        with self._lock:
+            self._live[deployment_id] = record
+            self._live.move_to_end(deployment_id)
+            self._touched.add(deployment_id)
+            if deployment_id not in self._index:
+                self._unsaved.add(deployment_id)
+
+    def __delitem__(self, deployment_id):
+        if not self.discard([deployment_id]):
+            raise KeyError(deployment_id)
+
+    def __contains__(self, deployment_id):
+        return deployment_id in self._live or deployment_id in self._index
+
+    def __iter__(self):
+        with self._lock:
+            keys = list(self._index)
+            keys.extend(deployment_id for deployment_id in self._live if deployment_id in self._unsaved)
+        return iter(keys)
+
+    def __len__(self):
+        return len(self._index) + len(self._unsaved)
+
+    def peek(self, deployment_id):
+        """Return a record without caching it, or None"""
+        with self._lock:
+            record = self._live.get(deployment_id)
+            if record is not None:
+                return record
+            entry = self._index.get(deployment_id)
+            return self._read(entry) if entry else None
+
+    def values(self):
+        for deployment_id in list(self):
+            record = self.peek(deployment_id)
+            if record is not None:
+                yield record
+
+    def items(self):
+        for deployment_id in list(self):
+            record = self.peek(deployment_id)
+            if record is not None:
+                yield deployment_id, record
+
+    def clear(self):
+        self.discard(list(self))
+
+    def summary(self, deployment_id):
+        """HistoryEntry for a deployment without reading its record, or None"""
+        with self._lock:
+            if deployment_id in self._unsaved:
+                return summarize(self._live[deployment_id])
+            return self._index.get(deployment_id)
+
+    def summaries(self):
+        """{id: HistoryEntry} for every deployment, as of the last save for records in memory"""
+        with self._lock:
+            result = dict(self._index)
+            for deployment_id in self._unsaved:
+                result[deployment_id] = summarize(self._live[deployment_id])
+        return result
+
+    def discard(self, deployment_ids):
+        """Delete deployments; return {id: bytes the record took} for those that existed"""
+        removed = {}
+        with self._lock:
+            for deployment_id in deployment_ids:
+                record = self._live.pop(deployment_id, None)
+                self._written.pop(deployment_id, None)
+                self._touched.discard(deployment_id)
+                entry = self._index.pop(deployment_id, None)
+                if entry is not None:
+                    removed[deployment_id] = entry.length
+                    self._garbage += entry.length
+                    self._deleted.append(deployment_id)
+                elif record is not None:
+                    self._unsaved.discard(deployment_id)
+                    removed[deployment_id] = len(encode_record(deployment_id, record))
+        return removed
+
+    # Saving
+
+    @property
+    def data_size(self):
+        return self._size
+
+    def save(self):
+        """Append changed records and deletions to the data file and index; return bytes written"""
+        with self._save_lock:
+            with self._lock:
+                candidates = [(deployment_id, record) for deployment_id, record in self._live.items()
+                              if deployment_id in self._touched or deployment_id in self._unsaved
+                              or self.is_pinned(deployment_id, record)]
+                self._touched.clear()
+                deleted, self._deleted = self._deleted, []
+
+            # Encoding happens outside the lock so lookups are not held up by large records
+            changed = []
+            for deployment_id, record in candidates:
+                line = encode_record(deployment_id, record)
+                if self._written.get(deployment_id) != hash(line):
+                    changed.append((deployment_id, line, record))
+            if not changed and not deleted:
+                return 0
+
+            with self._lock:
+                offset = self._size
+                data_lines, index_lines = [], []
+                for deployment_id in deleted:
+                    line = encode_record(deployment_id, None)
+                    data_lines.append(line)
+                    offset += len(line)
+                    index_lines.append(encode_record(deployment_id, [None, offset]))
+                    self._garbage += len(line)
+                for deployment_id, line, record in changed:
+                    if deployment_id not in self._live:
+                        # Deleted while it was being encoded
+                        continue
+                    entry = summarize(record, offset, len(line))
+                    previous = self._index.get(deployment_id)
+                    if previous is not None:
+                        self._garbage += previous.length
+                    self._index[deployment_id] = entry
+                    self._written[deployment_id] = hash(line)
+                    self._unsaved.discard(deployment_id)
+                    data_lines.append(line)
+                    index_lines.append(encode_record(deployment_id, list(entry)))
+                    offset += len(line)
+
+                self._data.seek(self._size)
+                self._data.writelines(data_lines)
+                self._data.flush()
+                with open(self.index_file, 'ab') as f:
+                    f.writelines(index_lines)
+                written = offset - self._size
+                self._size = offset
+                self._evict()
+
+            if self._garbage >= HISTORY_COMPACT_MIN_BYTES and self._garbage >= self._size * HISTORY_COMPACT_RATIO:
+                self._compact()
+            return written
+
+    def _evict(self):
+        """Drop the least recently used clean records beyond HISTORY_CACHE_SIZE (lock held)"""
+        excess = len(self._live) - HISTORY_CACHE_SIZE
+        if excess <= 0:
+            return
+        for deployment_id, record in list(self._live.items()):
+            if excess <= 0:
+                break
+            if deployment_id in self._unsaved or self.is_pinned(deployment_id, record):
+                continue
+            if deployment_id in self._touched:
+                # Looked up since the last save: only dropped if it was not modified
+                if self._written.get(deployment_id) != hash(encode_record(deployment_id, record)):
+                    continue
+                self._touched.discard(deployment_id)
+            del self._live[deployment_id]
+            self._written.pop(deployment_id, None)
+            excess -= 1
+
+    def _compact(self):
+        """Rewrite the data file with only the latest version of each record (save lock held)"""
+        with self._lock:
+            snapshot = dict(self._index)
+            source = self._data
+            previous_size = self._size
+        generation = uuid.uuid4().hex
+        # Copies raw lines, so nothing is decoded; lookups keep reading the old file meanwhile
+        lines = ((deployment_id, os.pread(source.fileno(), entry.length, entry.offset), entry)
+                 for deployment_id, entry in snapshot.items())
+        index = self._write_data(f'{self.data_file}.compact', generation, lines)
+        with self._lock:
+            # Keep only entries that were not deleted while copying (saves wait on the save lock)
+            index = {deployment_id: entry for deployment_id, entry in index.items()
+                     if self._index.get(deployment_id) is snapshot[deployment_id]}
+            self._write_index(self.index_file, generation, index)
+            os.replace(f'{self.data_file}.compact', self.data_file)
+            self._data = open(self.data_file, 'r+b')
+            self._generation = generation
+            self._index = index
+            self._size = os.fstat(self._data.fileno()).st_size
+            self._garbage = 0
+            # Deletions during the copy are already left out, so no tombstones are needed for them
+            self._deleted = []
+            source.close()
+        logger.info(f"Compacted deployment history from {previous_size} to {self._size} bytes")
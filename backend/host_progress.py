@@ -0,0 +1,179 @@
+import re
+import time
+import threading
+import logging
+
+from relay_distribution import RECAP_PATTERN
+from metrics import HOST_DURATION
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+HOST_STATES = ('pending', 'running', 'ok', 'failed')
+
+TASK_PATTERN = re.compile(r'^TASK \[(.*)\]')
+# e.g. "ok: [vm1]", "changed: [vm1 -> vm2] => (item=...)", "fatal: [vm1]: UNREACHABLE! => {...}"
+HOST_EVENT_PATTERN = re.compile(r'^(ok|changed|skipping|failed|fatal):\s*\[([^\]\s]+)[^\]]*\](:?\s*.*)$')
+IGNORED_FAILURE_LINE = '...ignoring'
+
+# Longest error message kept per host; the full text stays in the deployment log
+HOST_ERROR_MAX_CHARS = 300
+
+
+class HostProgress:
+    """Per-host state table for a multi-host job, kept on the deployment record.
+
+    The table lives in record['host_states'] as {host: {state, started, finished, duration,
+    changed, tasks, task, error}} and is updated from ansible's per-host task results and
+    PLAY RECAP lines as they stream in. record['host_states_version'] increases on every
+    change so pollers can tell when nothing moved.
+    """
+
+    def __init__(self, record, hosts):
+        self.record = record
+        self.task = None
+        self._last_failed = None
+        self._lock = threading.Lock()
+        record['host_states'] = {
+            host: {
+                'state': 'pending',
+                'started': None,
+                'finished': None,
+                'duration': None,
+                'changed': False,
+                'tasks': 0,
+                'task': None,
+                'error': None
+            } for host in hosts
+        }
+        record['host_states_version'] = 0
+
+    def _touch(self):
+        self.record['host_states_version'] = self.record.get('host_states_version', 0) + 1
+
+    def _close(self, entry, state, error=None):
+        now = time.time()
+        settled = entry['state'] in ('ok', 'failed')
+        entry['state'] = state
+        entry['finished'] = now
+        entry['started'] = entry['started'] or now
+        entry['duration'] = round(now - entry['started'], 3)
+        if error:
+            entry['error'] = error[:HOST_ERROR_MAX_CHARS]
+        if not settled:
+            HOST_DURATION.observe(entry['duration'], state=state)
+
+    def begin(self, hosts=None):
+        """Mark hosts (default: every pending host) as running"""
+        now = time.time()
+        with self._lock:
+            for host in hosts or list(self.record['host_states']):
+                entry = self.record['host_states'].get(host)
+                if entry and entry['state'] == 'pending':
+                    entry['state'] = 'running'
+                    entry['started'] = now
+            self._touch()
+
+    def feed(self, line, settle=True):
+        """Update the table from one line of ansible output.
+
+        With settle, a clean PLAY RECAP line marks its host ok; runs that are only one stage
+        of a host's work (e.g. relay staging) pass settle=False and only record failures.
+        """
+        line = line.strip()
+        task = TASK_PATTERN.match(line)
+        if task:
+            self.task = task.group(1)
+            self._last_failed = None
+            return
+
+        if line == IGNORED_FAILURE_LINE and self._last_failed:
+            # ignore_errors: the task failed but the host carries on
+            with self._lock:
+                entry = self.record['host_states'][self._last_failed]
+                entry.update({'state': 'running', 'finished': None, 'duration': None})
+                self._last_failed = None
+                self._touch()
+            return
+
+        event = HOST_EVENT_PATTERN.match(line)
+        if event:
+            outcome, host, detail = event.groups()
+            entry = self.record['host_states'].get(host)
+            if not entry:
+                return
+            with self._lock:
+                entry['task'] = self.task
+                entry['tasks'] += 1
+                if outcome == 'changed':
+                    entry['changed'] = True
+                if outcome in ('failed', 'fatal'):
+                    self._close(entry, 'failed', f"{self.task}: {detail.lstrip(': ')}" if self.task else detail)
+                    self._last_failed = host
+                elif entry['state'] == 'pending':
+                    entry['state'] = 'running'
+                    entry['started'] = time.time()
+                self._touch()
+            return
+
+        recap = RECAP_PATTERN.match(line)
+        if recap:
+            host, _ok, changed, unreachable, failed = recap.groups()
+            entry = self.record['host_states'].get(host)
+            if not entry:
+                return
+            with self._lock:
+                entry['changed'] = entry['changed'] or changed != '0'
+                if entry['state'] != 'failed':
+                    if unreachable != '0' or failed != '0':
+                        self._close(entry, 'failed', 'unreachable' if unreachable != '0' else None)
+                    elif settle:
+                        self._close(entry, 'ok')
+                self._touch()
+
+    def complete(self, host, succeeded, error=None):
+        """Record the final outcome for one host"""
+        entry = self.record['host_states'].get(host)
+        if not entry:
+            return
+        with self._lock:
+            if succeeded and entry['state'] != 'failed':
+                self._close(entry, 'ok')
+            elif not succeeded:
+                self._close(entry, 'failed', error)
+            self._touch()
+
+    def finish(self, succeeded, hosts=None):
+        """Settle hosts that are still pending or running once their ansible run has ended"""
+        with self._lock:
+            for host in hosts or list(self.record['host_states']):
+                entry = self.record['host_states'].get(host)
+                if entry and entry['state'] in ('pending', 'running'):
+                    self._close(entry, 'ok' if succeeded else 'failed')
+            self._touch()
+
+
+def summarize_progress(record, include_hosts=True):
+    """Compact progress view of a deployment record: counts per state plus the host table"""
+    host_states = dict(record.get('host_states') or {})
+    counts = {state: 0 for state in HOST_STATES}
+    changed = 0
+    for entry in host_states.values():
+        counts[entry['state']] = counts.get(entry['state'], 0) + 1
+        changed += bool(entry.get('changed'))
+
+    summary = {
+        'id': record.get('id'),
+        'status': record.get('status'),
+        'version': record.get('host_states_version', 0),
+        'total': len(host_states),
+        'done': counts['ok'] + counts['failed'],
+        'counts': counts,
+        'changed': changed
+    }
+    if include_hosts:
+        summary['hosts'] = {
+            host: {key: value for key, value in entry.items() if value not in (None, False, 0)}
+            for host, entry in host_states.items()
+        }
+    return summary
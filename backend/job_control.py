@@ -0,0 +1,260 @@
+import os
+import time
+import signal
+import subprocess
+import threading
+import logging
+from contextlib import contextmanager
+
+from metrics import DEPLOYMENTS_STARTED, JOB_DURATION
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+# Statuses after which a deployment will not change again
+TERMINAL_STATUSES = ("success", "failed", "completed", "cancelled")
+
+# Seconds between SIGTERM and SIGKILL when a job's processes are stopped
+JOB_CANCEL_GRACE_SECONDS = int(os.environ.get('JOB_CANCEL_GRACE_SECONDS', 10))
+# How often the watchdog checks running jobs against their deadline
+JOB_WATCHDOG_INTERVAL_SECONDS = int(os.environ.get('JOB_WATCHDOG_INTERVAL_SECONDS', 5))
+# How often a job's reaper checks which of its subprocesses have exited
+JOB_REAPER_INTERVAL_SECONDS = 0.5
+
+# Longest a job of each type may run before the watchdog cancels it; JOB_DEADLINE_<TYPE> overrides
+DEFAULT_JOB_DEADLINES = {
+    'file': 3600,
+    'file_batch': 3600,
+    'sql': 7200,
+    'sql_batch': 7200,
+    'sql_fanout': 7200,
+    'command': 1800,
+    'rollback': 1800,
+    'systemd': 600,
+    'template': 14400,
+}
+
+
+def job_deadline(job_type):
+    """Deadline in seconds for a job type (0 disables the watchdog for it)"""
+    return int(os.environ.get(f'JOB_DEADLINE_{job_type.upper()}', DEFAULT_JOB_DEADLINES.get(job_type, 3600)))
+
+
+class JobHandle:
+    """A running job's view of its own cancellation state, passed to code that cannot see the registry"""
+
+    def __init__(self, registry, deployment_id):
+        self.registry = registry
+        self.deployment_id = deployment_id
+
+    @property
+    def cancelled(self):
+        return self.registry.is_cancelled(self.deployment_id)
+
+    @contextmanager
+    def cancel_callback(self, callback):
+        """Call callback if the job is cancelled while the block runs (e.g. to cancel a SQL query)"""
+        self.registry.add_cancel_callback(self.deployment_id, callback)
+        try:
+            yield
+        finally:
+            self.registry.remove_cancel_callback(self.deployment_id, callback)
+
+
+class JobRegistry:
+    """Tracks deployment worker threads and their subprocesses so jobs can be cancelled.
+
+    Every subprocess is started in its own session, so cancelling a job signals the whole
+    process group (ansible forks, ssh, psql) rather than only the direct child. A watchdog
+    thread cancels jobs that run past the deadline for their type.
+    """
+
+    def __init__(self, on_cancelled=None, on_finished=None):
+        self.on_cancelled = on_cancelled or (lambda deployment_id, reason: None)
+        self.on_finished = on_finished or (lambda deployment_id, job_type: None)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._watchdog = None
+
+    def start(self, deployment_id, job_type, target, args=()):
+        """Run target(*args) in a tracked worker thread"""
+        job = {
+            'type': job_type,
+            'started': time.time(),
+            'deadline': job_deadline(job_type),
+            'processes': set(),
+            'callbacks': [],
+            'cancel_reason': None,
+            'reaper': None,
+            'thread': None
+        }
+        with self._lock:
+            self._jobs[deployment_id] = job
+        self._ensure_watchdog()
+        DEPLOYMENTS_STARTED.inc(type=job_type)
+
+        def run():
+            try:
+                target(*args)
+            except Exception as e:
+                logger.exception(f"Unhandled error in {job_type} job {deployment_id}: {str(e)}")
+            finally:
+                # Record the cancellation before the job disappears, so a job that is no longer
+                # active always has its final status
+                if job['cancel_reason']:
+                    self.on_cancelled(deployment_id, job['cancel_reason'])
+                JOB_DURATION.observe(time.time() - job['started'], type=job_type)
+                self.on_finished(deployment_id, job_type)
+                with self._lock:
+                    self._jobs.pop(deployment_id, None)
+
+        job['thread'] = threading.Thread(target=run, name=f"{job_type}-{deployment_id[:8]}", daemon=True)
+        job['thread'].start()
+        return job['thread']
+
+    def handle(self, deployment_id):
+        return JobHandle(self, deployment_id)
+
+    def is_active(self, deployment_id):
+        return deployment_id in self._jobs
+
+    def is_cancelled(self, deployment_id):
+        job = self._jobs.get(deployment_id)
+        return bool(job and job['cancel_reason'])
+
+    def active_jobs(self):
+        """Return {deployment_id: {type, elapsed, deadline, processes, cancelling}}"""
+        now = time.time()
+        with self._lock:
+            return {
+                deployment_id: {
+                    'type': job['type'],
+                    'elapsed': round(now - job['started'], 1),
+                    'deadline': job['deadline'],
+                    'processes': len(job['processes']),
+                    'cancelling': bool(job['cancel_reason'])
+                } for deployment_id, job in self._jobs.items()
+            }
+
+    def job_counts(self):
+        """Return {job_type: running jobs} without taking the registry lock (used by metrics scrapes)"""
+        counts = {}
+        for job in list(self._jobs.values()):
+            counts[job['type']] = counts.get(job['type'], 0) + 1
+        return counts
+
+    def process_count(self):
+        """Number of tracked subprocesses still running, read without the registry lock"""
+        return sum(len(job['processes']) for job in list(self._jobs.values()))
+
+    def popen(self, deployment_id, cmd, **kwargs):
+        """Start a subprocess for a job in its own process group and track it until it exits"""
+        job = self._jobs.get(deployment_id)
+        if job and job['cancel_reason']:
+            raise RuntimeError(f"Job {deployment_id} was cancelled: {job['cancel_reason']}")
+
+        process = subprocess.Popen(cmd, start_new_session=True, **kwargs)
+        if job:
+            with self._lock:
+                job['processes'].add(process)
+                # A cancel that landed after the check above found no process to signal
+                cancel_reason = job['cancel_reason']
+                if job['reaper'] is None:
+                    job['reaper'] = threading.Thread(target=self._reap, args=(job,), daemon=True,
+                                                     name=f"reaper-{deployment_id[:8]}")
+                    job['reaper'].start()
+            if cancel_reason:
+                logger.warning(f"Job {deployment_id} was cancelled while process {process.pid} started; stopping it")
+                self._terminate(deployment_id, [process])
+        return process
+
+    def _reap(self, job):
+        """Drop a job's subprocesses from tracking as they exit; one thread per job, ending when none are left"""
+        while True:
+            time.sleep(JOB_REAPER_INTERVAL_SECONDS)
+            with self._lock:
+                job['processes'] = {process for process in job['processes'] if process.poll() is None}
+                if not job['processes']:
+                    job['reaper'] = None
+                    return
+
+    def add_cancel_callback(self, deployment_id, callback):
+        job = self._jobs.get(deployment_id)
+        if job:
+            with self._lock:
+                job['callbacks'].append(callback)
+
+    def remove_cancel_callback(self, deployment_id, callback):
+        job = self._jobs.get(deployment_id)
+        if job:
+            with self._lock:
+                if callback in job['callbacks']:
+                    job['callbacks'].remove(callback)
+
+    def cancel(self, deployment_id, reason):
+        """Stop a running job: SIGTERM its process groups, then SIGKILL whatever is left after the grace period.
+
+        Returns False if the job is not running.
+        """
+        with self._lock:
+            job = self._jobs.get(deployment_id)
+            if not job:
+                return False
+            if job['cancel_reason']:
+                return True
+            job['cancel_reason'] = reason
+            processes = list(job['processes'])
+            callbacks = list(job['callbacks'])
+
+        logger.warning(f"Cancelling {job['type']} job {deployment_id}: {reason}")
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cancel callback for {deployment_id} failed: {str(e)}")
+
+        self._terminate(deployment_id, processes)
+        return True
+
+    def _terminate(self, deployment_id, processes):
+        """SIGTERM the processes' groups, then SIGKILL those still running after the grace period"""
+        for process in processes:
+            self._signal_group(process, signal.SIGTERM)
+
+        def escalate():
+            for process in processes:
+                if process.poll() is None:
+                    logger.warning(f"Process {process.pid} of job {deployment_id} ignored SIGTERM; sending SIGKILL")
+                    self._signal_group(process, signal.SIGKILL)
+
+        if processes:
+            timer = threading.Timer(JOB_CANCEL_GRACE_SECONDS, escalate)
+            timer.daemon = True
+            timer.start()
+
+    def _signal_group(self, process, sig):
+        try:
+            os.killpg(process.pid, sig)
+        except ProcessLookupError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not signal process group {process.pid}: {str(e)}")
+
+    def _ensure_watchdog(self):
+        with self._lock:
+            if self._watchdog and self._watchdog.is_alive():
+                return
+            self._watchdog = threading.Thread(target=self._watch, name='job-watchdog', daemon=True)
+            self._watchdog.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(JOB_WATCHDOG_INTERVAL_SECONDS)
+            now = time.time()
+            with self._lock:
+                overdue = [
+                    (deployment_id, job['deadline']) for deployment_id, job in self._jobs.items()
+                    if job['deadline'] and not job['cancel_reason'] and now - job['started'] > job['deadline']
+                ]
+            for deployment_id, deadline in overdue:
+                self.cancel(deployment_id, f"exceeded the {deadline}s deadline")
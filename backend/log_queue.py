@@ -0,0 +1,118 @@
+import queue
+import atexit
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+
+class BatchWriteMixin:
+    """Lets a stream handler write a list of records with a single write and flush"""
+
+    def emit_batch(self, records):
+        records = [record for record in records if record.levelno >= self.level and self.filter(record)]
+        if not records:
+            return
+        try:
+            text = ''.join(self.format(record) + self.terminator for record in records)
+            self.acquire()
+            try:
+                self._write_batch(text)
+            finally:
+                self.release()
+        except Exception:
+            self.handleError(records[0])
+
+    def _write_batch(self, text):
+        self.stream.write(text)
+        self.flush()
+
+
+class BatchStreamHandler(BatchWriteMixin, logging.StreamHandler):
+    pass
+
+
+class BatchRotatingFileHandler(BatchWriteMixin, RotatingFileHandler):
+    """RotatingFileHandler that checks for rollover once per batch instead of once per line"""
+
+    def _write_batch(self, text):
+        if self.stream is None:
+            self.stream = self._open()
+        if self.maxBytes > 0:
+            position = self.stream.tell()
+            if position and position + len(text) >= self.maxBytes:
+                self.doRollover()
+        super()._write_batch(text)
+
+
+class BatchingQueueListener(QueueListener):
+    """QueueListener that drains up to batch_size records per wakeup and hands them to
+    handlers together, so a burst of job output costs one write per handler.
+    """
+
+    def __init__(self, log_queue, *handlers, batch_size=500):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+
+    def _next_batch(self):
+        """Block for one record, then take whatever else is queued; return (batch, stopping)"""
+        record = self.dequeue(True)
+        if record is self._sentinel:
+            return [], True
+        batch = [record]
+        while len(batch) < self.batch_size:
+            try:
+                record = self.dequeue(False)
+            except queue.Empty:
+                break
+            if record is self._sentinel:
+                return batch, True
+            batch.append(record)
+        return batch, False
+
+    def handle_batch(self, batch):
+        for handler in self.handlers:
+            if hasattr(handler, 'emit_batch'):
+                handler.emit_batch(batch)
+                continue
+            for record in batch:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def stop(self):
+        # Safe to call twice, e.g. explicitly and again from atexit
+        if self._thread is not None:
+            super().stop()
+
+    def _monitor(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = self._next_batch()
+            if batch:
+                self.handle_batch(batch)
+
+
+def start_queue_logging(target_logger, handlers, batch_size=500):
+    """Route target_logger through a queue to `handlers`, written by a background thread.
+
+    The calling thread only enqueues; the listener is stopped (and the queue drained) at exit.
+    If target_logger is already routed through a queue, the given handlers are closed unused
+    and the running listener is returned, so a second call never writes every line twice.
+    """
+    for handler in target_logger.handlers:
+        if isinstance(handler, QueueHandler) and hasattr(handler, 'listener'):
+            for unused in handlers:
+                unused.close()
+            return handler.listener
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setLevel(logging.DEBUG)
+    target_logger.addHandler(queue_handler)
+    # The queue handlers replace propagation, which would otherwise write every record
+    # again, synchronously, through any root handlers
+    target_logger.propagate = False
+
+    listener = BatchingQueueListener(log_queue, *handlers, batch_size=batch_size)
+    listener.start()
+    queue_handler.listener = listener
+    atexit.register(listener.stop)
+    return listener
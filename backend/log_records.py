@@ -0,0 +1,189 @@
+import os
+import re
+import time
+import bisect
+import heapq
+import threading
+from collections import OrderedDict
+
+from host_progress import HOST_EVENT_PATTERN
+from relay_distribution import RECAP_PATTERN
+
+# Deployments whose log index is kept in memory between queries
+LOG_INDEX_CACHE_SIZE = int(os.environ.get('LOG_INDEX_CACHE_SIZE', 64))
+# Most entries one log query returns
+LOG_QUERY_MAX_LIMIT = int(os.environ.get('LOG_QUERY_MAX_LIMIT', 5000))
+
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+
+# Checked in order against the line with any "[step n] " / "[database] " tag removed
+LEVEL_PATTERNS = (
+    ('error', re.compile(r'^(ERROR|FAILED|FATAL)\b|^(fatal|failed):|UNREACHABLE!', re.IGNORECASE)),
+    ('warning', re.compile(r'^(\[?WARNING\]?|WARN)\b', re.IGNORECASE)),
+    ('debug', re.compile(r'^DEBUG:')),
+)
+LINE_TAG_PATTERN = re.compile(r'^(\[[^\]]*\]\s+)+')
+
+# log_meta entries are "seq|epoch ms|level|source|host" strings, one per line written by append_log;
+# as strings they stay one line each in the indented history file. Lines appended to record['logs']
+# directly (older records, older code paths) have no entry and are classified from their text.
+
+# Striped locks keep seq and the logs/log_meta pair consistent when several threads log to one job
+_append_locks = [threading.Lock() for _ in range(32)]
+
+
+def infer_level(text):
+    """Severity of a log line from its wording"""
+    bare = LINE_TAG_PATTERN.sub('', text)
+    for level, pattern in LEVEL_PATTERNS:
+        if pattern.search(bare):
+            return level
+    return 'info'
+
+
+def infer_host(text):
+    """Host named by an ansible task result or recap line, if any"""
+    match = HOST_EVENT_PATTERN.match(text)
+    if match:
+        return match.group(2)
+    match = RECAP_PATTERN.match(text)
+    if match:
+        return match.group(1)
+    return None
+
+
+def format_meta(seq, ts, level, source, host):
+    return f"{seq}|{ts}|{level}|{source}|{host or ''}"
+
+
+def parse_meta(entry):
+    """Return (seq, ts, level, source, host) from a log_meta entry"""
+    seq, ts, level, source, host = entry.split('|', 4)
+    return int(seq), int(ts), level, source, host or None
+
+
+def append_log(record, message, level=None, host=None, source='system'):
+    """Append a line to record['logs'] and its structured entry to record['log_meta']"""
+    lock = _append_locks[hash(record.get('id')) % len(_append_locks)]
+    with lock:
+        logs = record.setdefault('logs', [])
+        meta = record.setdefault('log_meta', [])
+        ts = int(time.time() * 1000)
+        if meta:
+            # Keep timestamps monotonic so time ranges can be found by bisection
+            ts = max(ts, parse_meta(meta[-1])[1])
+        # The entry goes in before the line, so a reader that sees line n also finds its entry
+        meta.append(format_meta(len(logs), ts, level or infer_level(message), source, host or infer_host(message)))
+        logs.append(message)
+
+
+class LogIndex:
+    """Per-deployment index of log lines by host, level and time, extended as lines arrive"""
+
+    def __init__(self):
+        self.count = 0
+        self._meta_pos = 0
+        self._lock = threading.Lock()
+        # Filled forward over lines without a timestamp so the list stays sorted for bisection
+        self.timestamps = []
+        self.entry_timestamps = []
+        self.levels = []
+        self.hosts = []
+        self.sources = []
+        self.by_host = {}
+        self.by_level = {level: [] for level in LOG_LEVELS}
+
+    def update(self, record):
+        """Index lines added since the last update"""
+        logs = record.get('logs') or []
+        meta = record.get('log_meta') or []
+        last_ts = self.timestamps[-1] if self.timestamps else 0
+        pending = parse_meta(meta[self._meta_pos]) if self._meta_pos < len(meta) else None
+        for seq in range(self.count, len(logs)):
+            while pending and pending[0] < seq:
+                self._meta_pos += 1
+                pending = parse_meta(meta[self._meta_pos]) if self._meta_pos < len(meta) else None
+            if pending and pending[0] == seq:
+                _, ts, level, source, host = pending
+                self._meta_pos += 1
+                pending = parse_meta(meta[self._meta_pos]) if self._meta_pos < len(meta) else None
+            else:
+                text = str(logs[seq])
+                ts, level, host, source = None, infer_level(text), infer_host(text), None
+            last_ts = max(last_ts, ts or 0)
+            self.timestamps.append(last_ts)
+            self.entry_timestamps.append(ts)
+            self.levels.append(level)
+            self.hosts.append(host)
+            self.sources.append(source)
+            self.by_level.setdefault(level, []).append(seq)
+            if host:
+                self.by_host.setdefault(host, []).append(seq)
+        self.count = len(logs)
+
+    def _candidates(self, host, level):
+        """Sorted seqs matching the host and minimum level filters, or None for every line"""
+        candidates = None
+        if level:
+            wanted = LOG_LEVELS[LOG_LEVELS.index(level):]
+            candidates = list(heapq.merge(*(self.by_level.get(name, []) for name in wanted)))
+        if host:
+            host_seqs = self.by_host.get(host, [])
+            if candidates is None:
+                candidates = host_seqs
+            else:
+                keep = set(host_seqs)
+                candidates = [seq for seq in candidates if seq in keep]
+        return candidates
+
+    def query(self, logs, host=None, level=None, source=None, pattern=None, since=None, until=None,
+              after=-1, limit=500):
+        """Return (entries, more) for lines matching every given filter, oldest first, after seq `after`"""
+        start = max(after + 1, bisect.bisect_left(self.timestamps, since) if since is not None else 0)
+        end = bisect.bisect_right(self.timestamps, until) if until is not None else self.count
+        candidates = self._candidates(host, level)
+        if candidates is None:
+            seqs = range(start, end)
+        else:
+            seqs = candidates[bisect.bisect_left(candidates, start):bisect.bisect_left(candidates, end)]
+
+        entries = []
+        for seq in seqs:
+            if source and self.sources[seq] != source:
+                continue
+            text = logs[seq]
+            if pattern and not pattern.search(text):
+                continue
+            if len(entries) == limit:
+                return entries, True
+            entries.append({
+                'seq': seq,
+                'ts': self.entry_timestamps[seq],
+                'level': self.levels[seq],
+                'host': self.hosts[seq],
+                'source': self.sources[seq],
+                'text': text
+            })
+        return entries, False
+
+
+class LogIndexCache:
+    """Most recently queried deployments' log indexes"""
+
+    def __init__(self, max_entries=LOG_INDEX_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def query(self, deployment_id, record, **filters):
+        with self._lock:
+            index = self._indexes.pop(deployment_id, None)
+            if index is None or index.count > len(record.get('logs') or []):
+                # First query, or the logs were replaced (e.g. reloaded from history)
+                index = LogIndex()
+            self._indexes[deployment_id] = index
+            while len(self._indexes) > self.max_entries:
+                self._indexes.popitem(last=False)
+        with index._lock:
+            index.update(record)
+            return index.query(record.get('logs') or [], **filters)
@@ -0,0 +1,204 @@
+import math
+import threading
+import logging
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+# Bucket bounds in seconds for work measured in seconds to hours (steps, hosts, jobs)
+DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200)
+# Bucket bounds in seconds for in-process operations such as writing the history file
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """Base for metrics rendered in the Prometheus text exposition format.
+
+    Every metric guards its samples with its own lock, so recording and scraping never
+    wait on the locks that protect deployment state.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Return [(suffix, label values, extra labels, value)]"""
+        with self._lock:
+            return [('', key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Gauge that is either set directly or, with a callback, read at scrape time.
+
+    callback() returns a number for an unlabelled gauge or {label values tuple: number}.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if not self.callback:
+            return super().samples()
+        try:
+            values = self.callback()
+        except Exception as e:
+            logger.warning(f"Could not collect metric {self.name}: {str(e)}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [('', tuple(str(v) for v in key), (), value) for key, value in values.items()]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(key, list(series['buckets']), series['sum'], series['count'])
+                        for key, series in self._values.items()]
+        samples = []
+        for key, buckets, total, count in snapshot:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, buckets):
+                cumulative += bucket_count
+                samples.append(('_bucket', key, (('le', _format_value(bound)),), cumulative))
+            samples.append(('_sum', key, (), total))
+            samples.append(('_count', key, (), count))
+        return samples
+
+
+class MetricsRegistry:
+    """Ordered set of metrics rendered together by the /metrics endpoint"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        """Add a metric; registering a name again replaces the earlier metric in place.
+
+        A name must appear once per scrape: Prometheus rejects a page with a duplicate TYPE line.
+        """
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), callback=None):
+        return self.register(Gauge(name, documentation, labelnames, callback))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DURATION_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+DEPLOYMENTS_STARTED = REGISTRY.counter(
+    'fdo_deployments_started_total', 'Deployment jobs started, by job type', ['type'])
+DEPLOYMENTS_FINISHED = REGISTRY.counter(
+    'fdo_deployments_finished_total', 'Deployment jobs finished, by job type and final status', ['type', 'status'])
+JOB_DURATION = REGISTRY.histogram(
+    'fdo_job_duration_seconds', 'Wall time of deployment jobs, by job type', ['type'])
+TEMPLATE_STEP_DURATION = REGISTRY.histogram(
+    'fdo_template_step_duration_seconds', 'Duration of template steps, by step type and status', ['step_type', 'status'])
+PHASE_DURATION = REGISTRY.histogram(
+    'fdo_job_phase_duration_seconds', 'Duration of the phases of deployment jobs, by job type and phase',
+    ['type', 'phase'], buckets=(0.01, 0.05, 0.1) + DURATION_BUCKETS)
+HOST_DURATION = REGISTRY.histogram(
+    'fdo_host_duration_seconds', 'Time from a host starting to its final state in multi-host jobs', ['state'])
+HISTORY_SAVE_DURATION = REGISTRY.histogram(
+    'fdo_history_save_duration_seconds', 'Latency of save_deployment_history', buckets=LATENCY_BUCKETS)
+HISTORY_BYTES_WRITTEN = REGISTRY.counter(
+    'fdo_history_bytes_written_total', 'Bytes written to the deployment history file')
+HISTORY_SIZE = REGISTRY.gauge(
+    'fdo_history_size_bytes', 'Size of the deployment history file after the last save')
+SSE_CONNECTIONS = REGISTRY.gauge(
+    'fdo_sse_connections', 'Open server-sent event log streams', ['stream'])
+INVENTORY_RELOADS = REGISTRY.counter(
+    'fdo_inventory_reloads_total', 'Times the VM inventory file was loaded')
+RETENTION_DELETED = REGISTRY.counter(
+    'fdo_retention_deleted_total', 'Deployment records deleted by retention, by reason', ['reason'])
+RETENTION_RECLAIMED_BYTES = REGISTRY.counter(
+    'fdo_retention_reclaimed_bytes_total', 'Serialized bytes of deployment records deleted by retention')
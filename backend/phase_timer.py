@@ -0,0 +1,97 @@
+import time
+import math
+import threading
+import logging
+from contextlib import contextmanager
+
+from metrics import PHASE_DURATION
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+PHASE_PERCENTILES = (50, 90, 99)
+
+
+class PhaseTimer:
+    """Lightweight span recorder for the phases of one job, kept in record['phases'].
+
+    lap(name) charges the time since the previous lap (or since the timer was created)
+    to a phase, which suits the straight-line process_* functions; phase(name) times a
+    block and is safe from concurrent threads. A phase that runs more than once (e.g. per
+    VM in a rollback) accumulates.
+    """
+
+    def __init__(self, record):
+        self.record = record
+        self.job_type = record.get('type', 'unknown')
+        self._mark = time.perf_counter()
+        self._lock = threading.Lock()
+        record['phases'] = {}
+
+    def add(self, name, seconds, record=True):
+        """Charge a duration measured elsewhere (e.g. a template step) to a phase.
+
+        With record=False the duration only goes to the phase metric, for phases that end after
+        the record's last save and so could never be persisted in it.
+        """
+        if record:
+            with self._lock:
+                phases = self.record['phases']
+                phases[name] = round(phases.get(name, 0) + seconds, 4)
+        PHASE_DURATION.observe(seconds, type=self.job_type, phase=name)
+
+    def lap(self, name, record=True):
+        """Charge the time since the last lap to `name`"""
+        now = time.perf_counter()
+        self.add(name, now - self._mark, record)
+        self._mark = now
+
+    def skip(self):
+        """Start the next lap now without charging the elapsed time to any phase"""
+        self._mark = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - started)
+
+
+def _percentile(sorted_values, percentile):
+    # Nearest-rank percentile
+    rank = max(1, math.ceil(percentile / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def phase_percentiles(records, percentiles=PHASE_PERCENTILES):
+    """Aggregate the phase maps of many deployment records.
+
+    Returns {type: {'count': records, 'phases': {phase: {count, mean, max, p50, p90, p99}}}}.
+    """
+    samples = {}
+    counts = {}
+    for record in records:
+        phases = record.get('phases')
+        if not phases:
+            continue
+        job_type = record.get('type', 'unknown')
+        counts[job_type] = counts.get(job_type, 0) + 1
+        for name, seconds in phases.items():
+            samples.setdefault(job_type, {}).setdefault(name, []).append(seconds)
+
+    summary = {}
+    for job_type, phases in samples.items():
+        summary[job_type] = {'count': counts[job_type], 'phases': {}}
+        for name, values in phases.items():
+            values.sort()
+            stats = {
+                'count': len(values),
+                'mean': round(sum(values) / len(values), 4),
+                'max': values[-1]
+            }
+            for percentile in percentiles:
+                stats[f'p{percentile}'] = _percentile(values, percentile)
+            summary[job_type]['phases'][name] = stats
+    return summary
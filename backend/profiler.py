@@ -0,0 +1,137 @@
+import os
+import re
+import sys
+import time
+import threading
+import logging
+import traceback
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+# Longest profile an admin may request, in seconds
+PROFILER_MAX_SECONDS = int(os.environ.get('PROFILER_MAX_SECONDS', 60))
+# Default gap between stack samples, in milliseconds
+PROFILER_DEFAULT_INTERVAL_MS = int(os.environ.get('PROFILER_DEFAULT_INTERVAL_MS', 10))
+
+PROFILE_MODES = ('wall', 'cpu')
+
+# Job threads are named <type>-<first 8 chars of the deployment id>, waitress workers waitress-<n>
+THREAD_INSTANCE_SUFFIX = re.compile(r'-([0-9a-f]{8}|\d+)$')
+
+
+def _thread_cpu_time(thread):
+    """CPU seconds used by a thread so far, or None where per-thread clocks are unavailable"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+    except (AttributeError, OSError, TypeError):
+        return None
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    name = getattr(code, 'co_qualname', code.co_name)
+    return f"{os.path.basename(code.co_filename)}:{name}".replace(';', ':')
+
+
+def _collapse(frame):
+    """Return the stack as root-first frame labels"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+
+def thread_group(name):
+    """Thread name without its per-instance suffix, so stacks of one kind of thread merge"""
+    return THREAD_INSTANCE_SUFFIX.sub('', name)
+
+
+class SamplingProfiler:
+    """Statistical profiler that samples the stacks of every thread via sys._current_frames().
+
+    In wall mode every sample of every thread counts, which shows where threads wait
+    (subprocess pipes, sleeps in SSE loops, locks). In cpu mode a thread's sample only
+    counts if the thread used CPU since the previous sample, which shows where Python time
+    actually goes. Results are in the collapsed-stack format read by flamegraph.pl and
+    speedscope. Only one profile runs at a time.
+    """
+
+    def __init__(self):
+        self._running = threading.Lock()
+
+    def profile(self, seconds, mode='wall', interval_ms=PROFILER_DEFAULT_INTERVAL_MS, group_threads=True):
+        """Sample for `seconds` and return {'mode', 'samples', 'duration', 'stacks': {collapsed: count}}.
+
+        Raises RuntimeError if another profile is already running.
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"mode must be one of: {', '.join(PROFILE_MODES)}")
+        seconds = max(0.1, min(float(seconds), PROFILER_MAX_SECONDS))
+        interval = max(1, int(interval_ms)) / 1000
+
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            return self._sample(seconds, mode, interval, group_threads)
+        finally:
+            self._running.release()
+
+    def _sample(self, seconds, mode, interval, group_threads):
+        own_ident = threading.get_ident()
+        stacks = {}
+        cpu_seen = {}
+        samples = 0
+        started = time.monotonic()
+        deadline = started + seconds
+
+        while time.monotonic() < deadline:
+            threads = {thread.ident: thread for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                thread = threads.get(ident)
+                if mode == 'cpu':
+                    cpu = _thread_cpu_time(thread) if thread else None
+                    previous = cpu_seen.get(ident)
+                    cpu_seen[ident] = cpu
+                    if cpu is None or previous is None or cpu <= previous:
+                        continue
+                name = thread.name if thread else f"thread-{ident}"
+                root = thread_group(name) if group_threads else name
+                key = ';'.join([root] + _collapse(frame))
+                stacks[key] = stacks.get(key, 0) + 1
+            samples += 1
+            time.sleep(interval)
+
+        duration = round(time.monotonic() - started, 3)
+        logger.info(f"Profiled {samples} samples over {duration}s in {mode} mode")
+        return {'mode': mode, 'samples': samples, 'duration': duration, 'stacks': stacks}
+
+
+def collapsed_text(stacks):
+    """Render {collapsed stack: count} as 'frame;frame;frame count' lines"""
+    return ''.join(f"{stack} {count}\n" for stack, count in sorted(stacks.items(), key=lambda item: -item[1]))
+
+
+def thread_dump():
+    """Return every thread with its current stack, innermost frame last"""
+    frames = sys._current_frames()
+    dump = []
+    for thread in threading.enumerate():
+        frame = frames.get(thread.ident)
+        cpu = _thread_cpu_time(thread)
+        dump.append({
+            'name': thread.name,
+            'ident': thread.ident,
+            'native_id': getattr(thread, 'native_id', None),
+            'daemon': thread.daemon,
+            'cpu_seconds': round(cpu, 3) if cpu is not None else None,
+            'stack': [line.rstrip('\n') for line in traceback.format_stack(frame)] if frame else []
+        })
+    return dump
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,208 @@
+import os
+import re
+import logging
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+# Number of new peers each VM that already holds the artifact serves per tier
+RELAY_FANOUT = int(os.environ.get('RELAY_FANOUT', 3))
+# Number of VMs per inventory type that receive the artifact straight from the orchestrator
+RELAY_SEEDS_PER_TYPE = int(os.environ.get('RELAY_SEEDS_PER_TYPE', 1))
+# In 'auto' distribution mode, relay is used once a deployment targets at least this many VMs
+RELAY_MIN_VMS = int(os.environ.get('RELAY_MIN_VMS', 10))
+
+DISTRIBUTION_MODES = ('direct', 'relay', 'auto')
+
+RECAP_PATTERN = re.compile(r'^(\S+)\s*:\s*ok=(\d+)\s+changed=(\d+)\s+unreachable=(\d+)\s+failed=(\d+)')
+
+
+def use_relay(distribution, vm_count):
+    """Decide whether a deployment to vm_count VMs should use relay distribution"""
+    if distribution == 'relay':
+        return True
+    if distribution == 'auto':
+        return vm_count >= RELAY_MIN_VMS
+    return False
+
+
+def plan_next_tier(holders, pending, vm_types, fanout=RELAY_FANOUT, seeds_per_type=RELAY_SEEDS_PER_TYPE):
+    """Plan the next relay tier as a list of {vm, source} assignments.
+
+    Peers only relay to VMs of the same inventory type, which keeps transfers inside one
+    network segment. A type with no holder yet is seeded from the orchestrator (source None).
+    Every holder serves up to `fanout` new VMs, assigned round-robin so the load is spread
+    over all holders, and the holder set grows geometrically.
+    """
+    tier = []
+    for vm_type in sorted({vm_types.get(vm) for vm in pending}, key=str):
+        pending_of_type = [vm for vm in pending if vm_types.get(vm) == vm_type]
+        holders_of_type = [vm for vm in holders if vm_types.get(vm) == vm_type]
+
+        if not holders_of_type:
+            for vm in pending_of_type[:seeds_per_type]:
+                tier.append({"vm": vm, "source": None})
+            continue
+
+        capacity = len(holders_of_type) * fanout
+        for index, vm in enumerate(pending_of_type[:capacity]):
+            tier.append({"vm": vm, "source": holders_of_type[index % len(holders_of_type)]})
+    return tier
+
+
+def plan_relay_tiers(vm_names, vm_types, fanout=RELAY_FANOUT, seeds_per_type=RELAY_SEEDS_PER_TYPE):
+    """Plan every tier up front, assuming each transfer succeeds"""
+    holders = []
+    pending = list(vm_names)
+    tiers = []
+    while pending:
+        tier = plan_next_tier(holders, pending, vm_types, fanout, seeds_per_type)
+        tiers.append(tier)
+        assigned = {a["vm"] for a in tier}
+        holders.extend(a["vm"] for a in tier)
+        pending = [vm for vm in pending if vm not in assigned]
+    return tiers
+
+
+def parse_recap(output_lines):
+    """Return {host: succeeded} from the PLAY RECAP lines of an ansible run"""
+    results = {}
+    for line in output_lines:
+        match = RECAP_PATTERN.match(line.strip())
+        if match:
+            host, _ok, _changed, unreachable, failed = match.groups()
+            results[host] = unreachable == '0' and failed == '0'
+    return results
+
+
+def render_tier_playbook(source_file, staging_file, seed_tier, final_target_path, source_sha256,
+                         skip_identical=True, transfer_mode='copy'):
+    """Render the playbook that stages the artifact on one tier of VMs.
+
+    Seeded VMs receive the file from the orchestrator (with ansible copy or rsync, per
+    transfer_mode); the others pull it from the peer named in their relay_source host variable,
+    with rsync running on that peer. With skip_identical, a VM whose target already matches
+    source_sha256 stages its own copy of the target instead, so nothing crosses the network
+    and it can still relay to the next tier.
+    """
+    staging_dir = os.path.dirname(staging_file)
+    if not seed_tier:
+        transfer = f"""    - name: Pull staged file from peer
+      ansible.posix.synchronize:
+        src: "{staging_file}"
+        dest: "{staging_file}"
+        mode: push
+        compress: true
+        archive: false
+        times: true
+      delegate_to: "{{{{ relay_source }}}}"
+      when: not (target_identical | bool)
+"""
+    elif transfer_mode == 'rsync':
+        transfer = f"""    - name: Stage file from orchestrator (rsync)
+      ansible.posix.synchronize:
+        src: "{source_file}"
+        dest: "{staging_file}"
+        mode: push
+        compress: true
+        archive: false
+        times: true
+      when: not (target_identical | bool)
+"""
+    else:
+        transfer = f"""    - name: Stage file from orchestrator
+      ansible.builtin.copy:
+        src: "{source_file}"
+        dest: "{staging_file}"
+        mode: '0644'
+      when: not (target_identical | bool)
+"""
+
+    return f"""---
+- name: Relay artifact to tier
+  hosts: relay_tier
+  gather_facts: false
+  tasks:
+    - name: Create staging directory
+      ansible.builtin.file:
+        path: "{staging_dir}"
+        state: directory
+        mode: '0755'
+
+    - name: Stat target file
+      ansible.builtin.stat:
+        path: "{final_target_path}"
+        get_checksum: {str(skip_identical).lower()}
+        checksum_algorithm: sha256
+      register: target_stat
+
+    - name: Check if target already matches source
+      ansible.builtin.set_fact:
+        target_identical: "{{{{ {str(skip_identical).lower()} and target_stat.stat.exists and (target_stat.stat.checksum | default('')) == '{source_sha256}' }}}}"
+
+    - name: Stage file from identical target
+      ansible.builtin.copy:
+        src: "{final_target_path}"
+        dest: "{staging_file}"
+        remote_src: yes
+        mode: '0644'
+      when: target_identical | bool
+
+{transfer}"""
+
+
+def render_install_playbook(staging_file, final_target_path, target_dir, user, sudo, create_backup, skip_identical=True):
+    """Render the playbook that installs the staged artifact on every VM and removes the staging copy.
+
+    Targets that already match the staged file are left alone unless skip_identical is false.
+    """
+    return f"""---
+- name: Install relayed artifact
+  hosts: relay_tier
+  gather_facts: false
+  become: {"true" if sudo else "false"}
+  become_method: sudo
+  become_user: {user}
+  tasks:
+    - name: Create target directory structure if it does not exist
+      ansible.builtin.file:
+        path: "{target_dir}"
+        state: directory
+        mode: '0755'
+
+    - name: Stat staged and target files
+      ansible.builtin.stat:
+        path: "{{{{ item }}}}"
+        get_checksum: true
+        checksum_algorithm: sha256
+      loop:
+        - "{staging_file}"
+        - "{final_target_path}"
+      register: relay_stats
+
+    - name: Check if target already matches staged file
+      ansible.builtin.set_fact:
+        target_identical: "{{{{ {str(skip_identical).lower()} and relay_stats.results[1].stat.exists and relay_stats.results[1].stat.checksum == relay_stats.results[0].stat.checksum }}}}"
+
+    - name: Create backup of existing file if it is replaced
+      ansible.builtin.copy:
+        src: "{final_target_path}"
+        dest: "{final_target_path}.bak.{{{{ lookup('pipe', 'date +%s') }}}}"
+        remote_src: yes
+      when: {str(create_backup).lower()} and relay_stats.results[1].stat.exists and not (target_identical | bool)
+
+    - name: Install staged file
+      ansible.builtin.copy:
+        src: "{staging_file}"
+        dest: "{final_target_path}"
+        remote_src: yes
+        mode: '0644'
+        owner: "{user}"
+      when: not (target_identical | bool)
+
+    - name: Remove staging directory
+      ansible.builtin.file:
+        path: "{os.path.dirname(staging_file)}"
+        state: absent
+      become: false
+"""
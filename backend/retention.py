@@ -0,0 +1,231 @@
+import os
+import time
+import bisect
+import threading
+import logging
+
+from metrics import RETENTION_DELETED, RETENTION_RECLAIMED_BYTES
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+# Delete finished deployments older than this many days (0 = keep regardless of age)
+RETENTION_MAX_AGE_DAYS = float(os.environ.get('RETENTION_MAX_AGE_DAYS', 0))
+# Per-type overrides of the age limit, e.g. "command=7,systemd=14"
+RETENTION_TYPE_MAX_AGE_DAYS = os.environ.get('RETENTION_TYPE_MAX_AGE_DAYS', '')
+# Keep at most this many deployments, oldest deleted first (0 = no limit)
+RETENTION_MAX_RECORDS = int(os.environ.get('RETENTION_MAX_RECORDS', 0))
+# Keep the deployments' log lines under this many bytes in total, oldest deleted first (0 = no limit)
+RETENTION_MAX_LOG_BYTES = int(os.environ.get('RETENTION_MAX_LOG_BYTES', 0))
+# Seconds between compactor runs
+RETENTION_INTERVAL = float(os.environ.get('RETENTION_INTERVAL', 300))
+# Records deleted per batch, and the pause between batches so request threads get the lock
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 500))
+RETENTION_BATCH_PAUSE = float(os.environ.get('RETENTION_BATCH_PAUSE', 0.05))
+
+
+def parse_type_ages(spec):
+    """Parse "type=days,type=days" into {type: days}"""
+    ages = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        job_type, days = item.split('=', 1)
+        try:
+            ages[job_type.strip()] = float(days)
+        except ValueError:
+            logger.error(f"Ignoring invalid retention age for {job_type.strip()}: {days}")
+    return ages
+
+
+class RetentionPolicy:
+    """Limits the compactor enforces; a limit of 0 is off"""
+
+    def __init__(self, max_age_days=RETENTION_MAX_AGE_DAYS, type_max_age_days=None,
+                 max_records=RETENTION_MAX_RECORDS, max_log_bytes=RETENTION_MAX_LOG_BYTES):
+        self.max_age_days = max_age_days
+        self.type_max_age_days = parse_type_ages(RETENTION_TYPE_MAX_AGE_DAYS) \
+            if type_max_age_days is None else type_max_age_days
+        self.max_records = max_records
+        self.max_log_bytes = max_log_bytes
+
+    @property
+    def enabled(self):
+        return bool(self.max_age_days or self.type_max_age_days or self.max_records or self.max_log_bytes)
+
+    def to_dict(self):
+        return {
+            'max_age_days': self.max_age_days,
+            'type_max_age_days': self.type_max_age_days,
+            'max_records': self.max_records,
+            'max_log_bytes': self.max_log_bytes
+        }
+
+
+class HistoryCompactor:
+    """Background retention over a time-ordered index of the deployment history.
+
+    The index holds (epoch, id) pairs sorted by age plus each record's type and log size,
+    taken from the history store's summaries so no record is read from disk, and finds
+    what to delete by walking from the oldest end. Deletions happen in batches of
+    RETENTION_BATCH_SIZE, pausing between batches, and the history is saved once at
+    the end. Deployments with a running job are never deleted.
+    """
+
+    def __init__(self, store, save, is_active, on_deleted=None, policy=None):
+        self.store = store
+        self.save = save
+        self.is_active = is_active
+        self.on_deleted = on_deleted
+        self.policy = policy or RetentionPolicy()
+        self.last_run = None
+        self.totals = {'runs': 0, 'deleted': 0, 'reclaimed_bytes': 0}
+        self._order = []
+        self._entries = {}
+        self._run_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Run the policy every RETENTION_INTERVAL seconds in a daemon thread"""
+        if not self.policy.enabled:
+            logger.info("No retention policy configured; history is only cleared on request")
+            return
+        logger.info(f"Starting history compactor every {RETENTION_INTERVAL}s with policy {self.policy.to_dict()}")
+        self._thread = threading.Thread(target=self._loop, name='history-compactor', daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while True:
+            time.sleep(RETENTION_INTERVAL)
+            try:
+                self.run()
+            except Exception as e:
+                logger.error(f"History compaction failed: {str(e)}")
+
+    def _refresh(self):
+        """Bring the index up to date with the history store"""
+        current = self.store.summaries()
+        gone = self._entries.keys() - current.keys()
+        if gone:
+            for deployment_id in gone:
+                del self._entries[deployment_id]
+            self._order = [pair for pair in self._order if pair[1] not in gone]
+        added = []
+        for deployment_id, summary in current.items():
+            entry = self._entries.get(deployment_id)
+            if entry is None:
+                # Unparseable timestamps count as oldest, as clear_deployment_history always did
+                epoch = summary.epoch or 0
+                entry = self._entries[deployment_id] = {'epoch': epoch, 'type': summary.type, 'log_bytes': None}
+                added.append((epoch, deployment_id))
+            if entry['log_bytes'] is None and not self.is_active(deployment_id):
+                # Logs of a finished job no longer grow, so their size is taken once
+                entry['log_bytes'] = summary.log_bytes
+        if added:
+            # Sorting the concatenation of two sorted runs is close to a linear merge
+            self._order = sorted(self._order + sorted(added))
+
+    def _select(self, now):
+        """Return [(id, reason)] to delete, oldest first"""
+        policy = self.policy
+        victims = {}
+        type_cutoffs = {job_type: now - days * 86400 for job_type, days in policy.type_max_age_days.items() if days}
+        default_cutoff = now - policy.max_age_days * 86400 if policy.max_age_days else None
+        cutoffs = list(type_cutoffs.values()) + ([default_cutoff] if default_cutoff is not None else [])
+        if cutoffs:
+            newest_cutoff = max(cutoffs)
+            for epoch, deployment_id in self._order[:bisect.bisect_left(self._order, (newest_cutoff, ''))]:
+                cutoff = type_cutoffs.get(self._entries[deployment_id]['type'], default_cutoff)
+                if cutoff is not None and epoch < cutoff:
+                    victims[deployment_id] = 'age'
+
+        if policy.max_records and len(self._order) - len(victims) > policy.max_records:
+            excess = len(self._order) - len(victims) - policy.max_records
+            for _, deployment_id in self._order:
+                if excess <= 0:
+                    break
+                if deployment_id not in victims and not self.is_active(deployment_id):
+                    victims[deployment_id] = 'count'
+                    excess -= 1
+
+        if policy.max_log_bytes:
+            kept_bytes = sum(entry['log_bytes'] or 0 for deployment_id, entry in self._entries.items()
+                             if deployment_id not in victims)
+            for _, deployment_id in self._order:
+                if kept_bytes <= policy.max_log_bytes:
+                    break
+                if deployment_id not in victims and not self.is_active(deployment_id):
+                    victims[deployment_id] = 'log_bytes'
+                    kept_bytes -= self._entries[deployment_id]['log_bytes'] or 0
+
+        return sorted(((deployment_id, reason) for deployment_id, reason in victims.items()
+                       if not self.is_active(deployment_id)),
+                      key=lambda victim: self._entries[victim[0]]['epoch'])
+
+    def _delete(self, victims):
+        """Remove victims in bounded batches; return (deleted, reclaimed bytes, counts by reason)"""
+        deleted, reclaimed, by_reason = [], 0, {}
+        for start in range(0, len(victims), RETENTION_BATCH_SIZE):
+            batch = victims[start:start + RETENTION_BATCH_SIZE]
+            sizes = self.store.discard([deployment_id for deployment_id, _ in batch])
+            removed = [(deployment_id, reason, sizes[deployment_id]) for deployment_id, reason in batch
+                       if deployment_id in sizes]
+            for deployment_id, reason, size in removed:
+                reclaimed += size
+                by_reason[reason] = by_reason.get(reason, 0) + 1
+                RETENTION_DELETED.inc(reason=reason)
+                RETENTION_RECLAIMED_BYTES.inc(size)
+                deleted.append(deployment_id)
+            if self.on_deleted and removed:
+                self.on_deleted([deployment_id for deployment_id, _, _ in removed])
+            if start + RETENTION_BATCH_SIZE < len(victims):
+                time.sleep(RETENTION_BATCH_PAUSE)
+        return deleted, reclaimed, by_reason
+
+    def _run(self, select):
+        started = time.time()
+        with self._run_lock:
+            self._refresh()
+            victims = select(started)
+            deleted, reclaimed, by_reason = self._delete(victims)
+            if deleted:
+                self._refresh()
+                self.save()
+        report = {
+            'started': started,
+            'duration': round(time.time() - started, 3),
+            'deleted': len(deleted),
+            'reclaimed_bytes': reclaimed,
+            'by_reason': by_reason,
+            'remaining': len(self._order)
+        }
+        self.last_run = report
+        self.totals['runs'] += 1
+        self.totals['deleted'] += len(deleted)
+        self.totals['reclaimed_bytes'] += reclaimed
+        if deleted:
+            logger.info(f"Retention removed {len(deleted)} deployments ({reclaimed} bytes) in {report['duration']}s: {by_reason}")
+        return report
+
+    def run(self):
+        """Apply the retention policy now; return the run report"""
+        return self._run(self._select)
+
+    def clear_older_than(self, days):
+        """Delete every deployment older than `days` (all of them for 0) that has no running job"""
+        def select(now):
+            cutoff = now - days * 86400 if days else float('inf')
+            end = bisect.bisect_left(self._order, (cutoff, '')) if days else len(self._order)
+            return [(deployment_id, 'manual') for _, deployment_id in self._order[:end]
+                    if not self.is_active(deployment_id)]
+        return self._run(select)
+
+    def status(self):
+        return {
+            'enabled': self.policy.enabled,
+            'interval': RETENTION_INTERVAL,
+            'batch_size': RETENTION_BATCH_SIZE,
+            'policy': self.policy.to_dict(),
+            'last_run': self.last_run,
+            'totals': self.totals
+        }
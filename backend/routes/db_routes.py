@@ -4,8 +4,10 @@ import os
 import subprocess
 import time
 import uuid
-import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from sql_engine import SQL_STATEMENT_TIMEOUT_SECONDS, SQL_PSQL_TIMEOUT_SECONDS, default_mode, parse_statement_timeout
+from phase_timer import PhaseTimer
 
 # Get logger
 logger = logging.getLogger('fix_deployment_orchestrator')
@@ -53,7 +55,7 @@ def get_db_users():
 @db_routes.route('/api/deploy/sql', methods=['POST'])
 def deploy_sql():
     # Import here to avoid circular imports and ensure we get the shared instance
-    from app import deployments, save_deployment_history
+    from app import deployments, save_deployment_history, jobs
     
     data = request.json
     ft = data.get('ft')
@@ -69,6 +71,11 @@ def deploy_sql():
     if not all([ft, file_name, hostname, port, db_name, user]):
         logger.error("Missing required parameters for SQL deployment")
         return jsonify({"error": "Missing required parameters"}), 400
+
+    try:
+        statement_timeout = get_statement_timeout(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     # Generate a unique deployment ID
     deployment_id = str(uuid.uuid4())
@@ -83,6 +90,9 @@ def deploy_sql():
         "port": port,
         "db_name": db_name,
         "user": user,
+        "statement_timeout": statement_timeout,
+        # Run the whole file in one transaction instead of committing each statement as psql -f does
+        "atomic": bool(data.get('atomic', False)),
         "status": "running",
         "timestamp": time.time(),
         "logs": []
@@ -92,14 +102,37 @@ def deploy_sql():
     save_deployment_history()
     
     # Start deployment in a separate thread
-    threading.Thread(target=process_sql_deployment, args=(deployment_id, password)).start()
+    jobs.start(deployment_id, 'sql', process_sql_deployment, (deployment_id, password))
     
     logger.info(f"SQL deployment initiated with ID: {deployment_id}")
     return jsonify({"deploymentId": deployment_id})
 
+def get_statement_timeout(data):
+    """Read the optional per-statement timeout in seconds from a request body (0 means no limit)"""
+    return parse_statement_timeout(data.get('statementTimeout', SQL_STATEMENT_TIMEOUT_SECONDS))
+
+class PsqlOutputSink:
+    """Forwards psql output lines to the deployment log as they arrive, noting errors and warnings"""
+
+    def __init__(self, deployment_id):
+        self.deployment_id = deployment_id
+        self.has_errors = False
+        self.has_warnings = False
+
+    def append(self, line):
+        from app import log_message
+
+        line_stripped = line.strip()
+        # Check for SQL errors in the output
+        if "ERROR:" in line_stripped.upper():
+            self.has_errors = True
+        elif "WARNING:" in line_stripped.upper():
+            self.has_warnings = True
+        log_message(self.deployment_id, line_stripped, source='psql')
+
 def process_sql_deployment(deployment_id, password):
     # Import here to ensure we get the shared instances
-    from app import log_message, deployments, save_deployment_history
+    from app import log_message, deployments, save_deployment_history, sql_engine, sql_parse_cache, stream_command, jobs
     
     try:
         # Check if deployment exists
@@ -108,6 +141,7 @@ def process_sql_deployment(deployment_id, password):
             return
         
         deployment = deployments[deployment_id]
+        phases = PhaseTimer(deployment)
         
         ft = deployment["ft"]
         file_name = deployment["file"]
@@ -131,7 +165,48 @@ def process_sql_deployment(deployment_id, password):
             return
         
         log_message(deployment_id, f"Starting SQL deployment for {file_name} on {hostname}:{port}/{db_name}")
-        
+
+        with open(source_file, 'r') as f:
+            sql_text = f.read()
+
+        statement_timeout = deployment.get("statement_timeout", SQL_STATEMENT_TIMEOUT_SECONDS)
+        phases.lap("prepare")
+
+        # Run in-process over a pooled connection; psql is only needed for meta-commands
+        if sql_engine.can_execute(sql_text):
+            statements = sql_parse_cache.parse(sql_text)['statements']
+            mode = default_mode(statements, deployment.get("atomic", False))
+            log_message(deployment_id, f"Using pooled connection to {hostname}:{port}/{db_name} as {user} ({mode} mode)")
+            phases.lap("parse")
+
+            def on_statement(event, _file_name, entry):
+                # Expose the running statement so a slow one can be spotted while it runs
+                deployment["current_statement"] = dict(entry, started_at=time.time()) if event == 'started' else None
+
+            result = sql_engine.execute_batch(
+                hostname, port, db_name, user, password, [{"file": file_name, "statements": statements}], mode,
+                lambda line: log_message(deployment_id, line, source='psql'),
+                statement_timeout=statement_timeout, on_statement=on_statement, job=jobs.handle(deployment_id))
+            deployment["statements"] = result["files"][0]["statements"]
+            phases.lap("execute")
+
+            if not result['success']:
+                log_message(deployment_id, "FAILED: SQL execution completed with errors")
+                deployments[deployment_id]["status"] = "failed"
+                logger.error(f"SQL deployment {deployment_id} failed")
+            elif result['warnings']:
+                log_message(deployment_id, "WARNING: SQL execution completed with warnings")
+                deployments[deployment_id]["status"] = "success"  # Still success but with warnings
+                logger.warning(f"SQL deployment {deployment_id} completed with warnings")
+            else:
+                log_message(deployment_id, "SUCCESS: SQL execution completed successfully")
+                deployments[deployment_id]["status"] = "success"
+                logger.info(f"SQL deployment {deployment_id} completed successfully in {result['files'][0]['duration']}s")
+
+            save_deployment_history()
+            phases.lap("save_history", record=False)
+            return
+
         # Check if psql is available
         psql_check = subprocess.run(["which", "psql"], capture_output=True, text=True)
         if psql_check.returncode != 0:
@@ -153,48 +228,26 @@ def process_sql_deployment(deployment_id, password):
         # Set password in environment if provided
         if password:
             env["PGPASSWORD"] = password
+
+        # Long migrations are bounded per statement, and the whole file by SQL_PSQL_TIMEOUT_SECONDS
+        if statement_timeout:
+            env["PGOPTIONS"] = f"-c statement_timeout={int(statement_timeout * 1000)}"
         
         log_message(deployment_id, f"Executing: psql -h {hostname} -p {port} -d {db_name} -U {user} -f {file_name}")
         
         try:
-            # Use subprocess.run for better control and to capture both stdout and stderr
-            result = subprocess.run(
-                cmd, 
-                capture_output=True, 
-                text=True, 
-                env=env,
-                timeout=300  # 5 minute timeout
-            )
-            
-            has_errors = False
-            has_warnings = False
-            
-            # Process and log all output (stdout and stderr combined)
-            all_output = ""
-            if result.stdout:
-                all_output += result.stdout
-            if result.stderr:
-                all_output += result.stderr
-            
-            if all_output:
-                for line in all_output.strip().split('\n'):
-                    line_stripped = line.strip()
-                    if line_stripped:
-                        # Check for SQL errors in the output
-                        if "ERROR:" in line_stripped.upper():
-                            has_errors = True
-                            log_message(deployment_id, line_stripped)
-                            logger.debug(f"[{deployment_id}] {line_stripped}")
-                        elif "WARNING:" in line_stripped.upper():
-                            has_warnings = True
-                            log_message(deployment_id, line_stripped)
-                            logger.debug(f"[{deployment_id}] {line_stripped}")
-                        else:
-                            log_message(deployment_id, line_stripped)
-                            logger.debug(f"[{deployment_id}] {line_stripped}")
+            # Stream stdout and stderr into the deployment log as psql produces them
+            output = PsqlOutputSink(deployment_id)
+            returncode = stream_command(cmd, output, timeout=SQL_PSQL_TIMEOUT_SECONDS or None, env=env,
+                                        deployment_id=deployment_id)
+            if returncode is None:
+                log_message(deployment_id, f"ERROR: psql did not finish within {SQL_PSQL_TIMEOUT_SECONDS}s and was stopped")
+            has_errors = output.has_errors
+            has_warnings = output.has_warnings
+            phases.lap("psql")
             
             # Determine final status based on errors found in output, not just return code
-            if has_errors or result.returncode != 0:
+            if has_errors or returncode != 0:
                 log_message(deployment_id, "FAILED: SQL execution completed with errors")
                 if deployment_id in deployments:
                     deployments[deployment_id]["status"] = "failed"
@@ -210,13 +263,6 @@ def process_sql_deployment(deployment_id, password):
                     deployments[deployment_id]["status"] = "success"
                 logger.info(f"SQL deployment {deployment_id} completed successfully")
             
-        except subprocess.TimeoutExpired:
-            error_msg = "SQL execution timed out after 5 minutes"
-            log_message(deployment_id, f"ERROR: {error_msg}")
-            if deployment_id in deployments:
-                deployments[deployment_id]["status"] = "failed"
-            logger.error(f"SQL deployment {deployment_id} timed out")
-            
         except subprocess.SubprocessError as e:
             error_msg = f"Subprocess error during SQL execution: {str(e)}"
             log_message(deployment_id, f"ERROR: {error_msg}")
@@ -225,7 +271,9 @@ def process_sql_deployment(deployment_id, password):
             logger.error(error_msg)
         
         # Always save deployment history after processing
+        phases.skip()
         save_deployment_history()
+        phases.lap("save_history", record=False)
         
     except FileNotFoundError as e:
         # Handle case where psql command is not found
@@ -260,6 +308,319 @@ def process_sql_deployment(deployment_id, password):
             save_deployment_history()
 
 
+def load_sql_scripts(ft, files, mode):
+    """Read and parse SQL files from AllFts/<ft>/ for a batch run.
+
+    Every file is checked up front so a missing or unsupported file fails before anything
+    runs. Returns (scripts, None) or (None, (error message, http status)).
+    """
+    from app import sql_engine, sql_parse_cache, FIX_FILES_DIR
+    from sql_engine import transaction_allowed
+
+    scripts = []
+    for file_name in files:
+        source_file = os.path.join(FIX_FILES_DIR, 'AllFts', ft, file_name)
+        if not os.path.isfile(source_file):
+            return None, (f"Source file not found: {file_name}", 404)
+
+        with open(source_file, 'r') as f:
+            sql_text = f.read()
+
+        if not sql_engine.can_execute(sql_text):
+            return None, (f"{file_name} uses psql meta-commands or psycopg2 is unavailable; deploy it on its own", 400)
+
+        statements = sql_parse_cache.parse(sql_text)['statements']
+        if mode != 'autocommit' and not all(transaction_allowed(st['sql']) for st in statements):
+            return None, (f"{file_name} contains transaction control statements or statements that cannot run "
+                          f"in a transaction block, which are only allowed in autocommit mode", 400)
+
+        scripts.append({"file": file_name, "statements": statements})
+    return scripts, None
+
+@db_routes.route('/api/deploy/sql/batch', methods=['POST'])
+def deploy_sql_batch():
+    """Run an ordered list of SQL files from one FT over a single connection"""
+    from app import deployments, save_deployment_history, jobs
+    from sql_engine import SQL_BATCH_MODES
+
+    data = request.json
+    ft = data.get('ft')
+    files = data.get('files', [])
+    hostname = data.get('hostname')
+    port = data.get('port')
+    db_name = data.get('dbName')
+    user = data.get('user')
+    password = data.get('password', '')
+    mode = data.get('mode', 'transaction')
+
+    logger.info(f"SQL batch deployment request received: {len(files)} files from FT {ft} on {hostname}:{port} ({mode})")
+
+    if not all([ft, files, hostname, port, db_name, user]):
+        logger.error("Missing required parameters for SQL batch deployment")
+        return jsonify({"error": "Missing required parameters"}), 400
+
+    if mode not in SQL_BATCH_MODES:
+        return jsonify({"error": f"Invalid mode '{mode}'. Must be one of: {', '.join(SQL_BATCH_MODES)}"}), 400
+
+    try:
+        statement_timeout = get_statement_timeout(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    scripts, error = load_sql_scripts(ft, files, mode)
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    deployment_id = str(uuid.uuid4())
+
+    deployments[deployment_id] = {
+        "id": deployment_id,
+        "type": "sql_batch",
+        "ft": ft,
+        "files": files,
+        "hostname": hostname,
+        "port": port,
+        "db_name": db_name,
+        "user": user,
+        "mode": mode,
+        "statement_timeout": statement_timeout,
+        "status": "running",
+        "timestamp": time.time(),
+        "logs": []
+    }
+
+    save_deployment_history()
+
+    jobs.start(deployment_id, 'sql_batch', process_sql_batch_deployment, (deployment_id, password, scripts))
+
+    logger.info(f"SQL batch deployment initiated with ID: {deployment_id}")
+    return jsonify({"deploymentId": deployment_id})
+
+def process_sql_batch_deployment(deployment_id, password, scripts):
+    from app import log_message, deployments, save_deployment_history, sql_engine, jobs
+
+    deployment = deployments[deployment_id]
+    phases = PhaseTimer(deployment)
+    try:
+        def on_statement(event, file_name, entry):
+            deployment["current_statement"] = dict(entry, file=file_name, started_at=time.time()) if event == 'started' else None
+
+        log_message(deployment_id, f"Starting SQL batch of {len(scripts)} files on {deployment['hostname']}:{deployment['port']}/{deployment['db_name']} in {deployment['mode']} mode")
+
+        result = sql_engine.execute_batch(
+            deployment["hostname"], deployment["port"], deployment["db_name"], deployment["user"], password,
+            scripts, deployment["mode"], lambda line: log_message(deployment_id, line, source='psql'),
+            statement_timeout=deployment["statement_timeout"], on_statement=on_statement, job=jobs.handle(deployment_id))
+
+        deployment["file_results"] = result["files"]
+        phases.lap("execute")
+        deployment["status"] = "success" if result["success"] else "failed"
+        log_message(deployment_id, f"{'SUCCESS' if result['success'] else 'FAILED'}: SQL batch completed")
+        logger.info(f"SQL batch deployment {deployment_id} finished with status {deployment['status']}")
+
+    except Exception as e:
+        log_message(deployment_id, f"ERROR: Unexpected error during SQL batch deployment: {str(e)}")
+        logger.exception(f"Exception in SQL batch deployment {deployment_id}: {str(e)}")
+        deployment["status"] = "failed"
+
+    phases.skip()
+    save_deployment_history()
+    phases.lap("save_history", record=False)
+
+@db_routes.route('/api/deploy/sql/fanout', methods=['POST'])
+def deploy_sql_fanout():
+    """Run the same SQL files against several inventory database connections concurrently"""
+    from app import deployments, save_deployment_history, load_inventory, get_db_connection_details, jobs
+    from sql_engine import SQL_BATCH_MODES, SQL_FANOUT_MAX_PARALLEL
+
+    data = request.json
+    ft = data.get('ft')
+    files = data.get('files', [])
+    db_connections = data.get('dbConnections', [])
+    user = data.get('user')
+    password = data.get('password', '')
+    # Optional per-connection passwords, falling back to the shared one
+    passwords = data.get('passwords', {})
+    mode = data.get('mode', 'transaction')
+    max_parallel = data.get('maxParallel', SQL_FANOUT_MAX_PARALLEL)
+
+    logger.info(f"SQL fan-out request received: {len(files)} files from FT {ft} to {len(db_connections)} databases")
+
+    if not all([ft, files, db_connections, user]):
+        logger.error("Missing required parameters for SQL fan-out deployment")
+        return jsonify({"error": "Missing required parameters"}), 400
+
+    if mode not in SQL_BATCH_MODES:
+        return jsonify({"error": f"Invalid mode '{mode}'. Must be one of: {', '.join(SQL_BATCH_MODES)}"}), 400
+
+    try:
+        statement_timeout = get_statement_timeout(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        max_parallel = max(1, int(max_parallel))
+    except (TypeError, ValueError):
+        return jsonify({"error": "maxParallel must be a positive integer"}), 400
+
+    _, db_inventory = load_inventory()
+    if not db_inventory:
+        return jsonify({"error": "Failed to load database inventory"}), 500
+
+    targets = {}
+    for db_connection in db_connections:
+        details = get_db_connection_details(db_connection, db_inventory)
+        if not details:
+            return jsonify({"error": f"Database connection {db_connection} not found in inventory"}), 404
+        targets[db_connection] = details
+
+    scripts, error = load_sql_scripts(ft, files, mode)
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    deployment_id = str(uuid.uuid4())
+
+    deployments[deployment_id] = {
+        "id": deployment_id,
+        "type": "sql_fanout",
+        "ft": ft,
+        "files": files,
+        "user": user,
+        "mode": mode,
+        "statement_timeout": statement_timeout,
+        "max_parallel": max_parallel,
+        "databases": {
+            name: {
+                "hostname": details["hostname"],
+                "port": details["port"],
+                "db_name": details["db_name"],
+                "status": "pending"
+            } for name, details in targets.items()
+        },
+        "status": "running",
+        "timestamp": time.time(),
+        "logs": []
+    }
+
+    save_deployment_history()
+
+    credentials = {name: passwords.get(name, password) for name in targets}
+    jobs.start(deployment_id, 'sql_fanout', process_sql_fanout_deployment, (deployment_id, credentials, scripts))
+
+    logger.info(f"SQL fan-out deployment initiated with ID: {deployment_id}")
+    return jsonify({"deploymentId": deployment_id})
+
+def process_sql_fanout_deployment(deployment_id, credentials, scripts):
+    from app import log_message, deployments, save_deployment_history, sql_engine, jobs
+
+    deployment = deployments[deployment_id]
+    phases = PhaseTimer(deployment)
+
+    def run_on_database(name):
+        database = deployment["databases"][name]
+        database["status"] = "running"
+        start = time.time()
+        try:
+            result = sql_engine.execute_batch(
+                database["hostname"], database["port"], database["db_name"], deployment["user"], credentials[name],
+                scripts, deployment["mode"], lambda line: log_message(deployment_id, f"[{name}] {line}", host=name, source='psql'),
+                statement_timeout=deployment["statement_timeout"], job=jobs.handle(deployment_id))
+            database["file_results"] = result["files"]
+            database["status"] = "success" if result["success"] else "failed"
+        except Exception as e:
+            log_message(deployment_id, f"[{name}] ERROR: {str(e)}", host=name)
+            logger.exception(f"Exception in SQL fan-out {deployment_id} for {name}: {str(e)}")
+            database["status"] = "failed"
+        database["duration"] = round(time.time() - start, 3)
+        phases.add(f"database:{name}", database["duration"])
+        log_message(deployment_id, f"[{name}] {database['status'].upper()} in {database['duration']}s", host=name)
+
+    try:
+        log_message(deployment_id, f"Starting SQL fan-out of {len(scripts)} files to {len(deployment['databases'])} databases (max {deployment['max_parallel']} at a time, {deployment['mode']} mode)")
+
+        # Databases are independent, so the run takes about as long as the slowest one
+        with ThreadPoolExecutor(max_workers=deployment["max_parallel"], thread_name_prefix='sql-fanout') as pool:
+            list(pool.map(run_on_database, list(deployment["databases"])))
+        phases.lap("execute")
+
+        failed = [name for name, database in deployment["databases"].items() if database["status"] != "success"]
+        deployment["status"] = "failed" if failed else "success"
+        if failed:
+            log_message(deployment_id, f"FAILED: SQL fan-out failed on {', '.join(failed)}")
+        else:
+            log_message(deployment_id, "SUCCESS: SQL fan-out completed on all databases")
+        logger.info(f"SQL fan-out deployment {deployment_id} finished with status {deployment['status']}")
+
+    except Exception as e:
+        log_message(deployment_id, f"ERROR: Unexpected error during SQL fan-out deployment: {str(e)}")
+        logger.exception(f"Exception in SQL fan-out deployment {deployment_id}: {str(e)}")
+        deployment["status"] = "failed"
+
+    phases.skip()
+    save_deployment_history()
+    phases.lap("save_history", record=False)
+
+@db_routes.route('/api/deploy/sql/plan', methods=['POST'])
+def plan_sql():
+    """Dry-run planner: list the statements of FT SQL files, flag heavy locks and optionally EXPLAIN DML"""
+    from app import sql_engine, sql_parse_cache, FIX_FILES_DIR
+    from sql_engine import PSYCOPG2_AVAILABLE
+
+    data = request.json
+    ft = data.get('ft')
+    files = data.get('files') or ([data['file']] if data.get('file') else [])
+    explain = data.get('explain', False)
+
+    if not ft or not files:
+        return jsonify({"error": "Missing required parameters"}), 400
+
+    connection = [data.get('hostname'), data.get('port'), data.get('dbName'), data.get('user')]
+    if explain:
+        if not all(connection):
+            return jsonify({"error": "hostname, port, dbName and user are required for explain"}), 400
+        if not PSYCOPG2_AVAILABLE:
+            return jsonify({"error": "explain requires psycopg2"}), 400
+
+    try:
+        plan = []
+        for file_name in files:
+            source_file = os.path.join(FIX_FILES_DIR, 'AllFts', ft, file_name)
+            if not os.path.isfile(source_file):
+                return jsonify({"error": f"Source file not found: {file_name}"}), 404
+
+            with open(source_file, 'r') as f:
+                parsed = sql_parse_cache.parse(f.read())
+
+            statements = [{
+                "index": index,
+                "line": statement["line"],
+                "sql": statement["sql"],
+                **statement["analysis"]
+            } for index, statement in enumerate(parsed["statements"], 1)]
+
+            explain_log = []
+            if explain:
+                plans = sql_engine.explain_statements(
+                    *connection, data.get('password', ''), parsed["statements"], explain_log.append)
+                for index, explained in plans.items():
+                    statements[index - 1]["explain"] = explained
+
+            plan.append({
+                "file": file_name,
+                "sha256": parsed["sha256"],
+                "statement_count": len(statements),
+                "heavy_lock_count": sum(1 for st in statements if st["heavy_lock"]),
+                "warning_count": sum(len(st["warnings"]) for st in statements),
+                "statements": statements,
+                "notices": explain_log
+            })
+
+        return jsonify({"ft": ft, "files": plan})
+
+    except Exception as e:
+        logger.error(f"Error planning SQL for FT {ft}: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 # Add routes to get deployment logs (matching frontend expectations)
 #@db_routes.route('/api/deployment/<deployment_id>/logs', methods=['GET'])
 # @db_routes.route('/api/deploy/<deployment_id>/logs', methods=['GET'])  # Alternative endpoint for frontend compatibility
@@ -0,0 +1,85 @@
+from flask import Blueprint, Response, jsonify, request
+import logging
+
+from routes.auth_routes import get_current_user
+from profiler import profiler, collapsed_text, thread_dump, PROFILE_MODES, PROFILER_MAX_SECONDS
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+profiler_bp = Blueprint('profiler', __name__)
+
+
+def require_admin():
+    """Return an error response unless the caller is an admin"""
+    current_user = get_current_user()
+    if not current_user:
+        return jsonify({"error": "Authentication required"}), 401
+    if current_user['role'] != 'admin':
+        return jsonify({"error": "Admin access required"}), 403
+    return None
+
+
+@profiler_bp.route('/api/admin/profile', methods=['POST'])
+def run_profile():
+    """Sample all threads for a few seconds and return collapsed stacks for a flamegraph"""
+    denied = require_admin()
+    if denied:
+        return denied
+
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', request.args.get('mode', 'wall'))
+    seconds = data.get('seconds', request.args.get('seconds', 10, type=float))
+    interval_ms = data.get('intervalMs', request.args.get('intervalMs', 10, type=int))
+    group_threads = data.get('groupThreads', request.args.get('groupThreads', 'true').lower() != 'false')
+    output = data.get('format', request.args.get('format', 'collapsed'))
+
+    if mode not in PROFILE_MODES:
+        return jsonify({"error": f"Invalid mode. Must be one of: {', '.join(PROFILE_MODES)}"}), 400
+    try:
+        seconds = float(seconds)
+        interval_ms = int(interval_ms)
+    except (TypeError, ValueError):
+        return jsonify({"error": "seconds and intervalMs must be numbers"}), 400
+    if seconds <= 0 or seconds > PROFILER_MAX_SECONDS:
+        return jsonify({"error": f"seconds must be between 0 and {PROFILER_MAX_SECONDS}"}), 400
+
+    logger.info(f"Starting {seconds}s {mode} profile requested by {get_current_user()['username']}")
+    try:
+        result = profiler.profile(seconds, mode=mode, interval_ms=interval_ms, group_threads=group_threads)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 409
+    except Exception as e:
+        logger.error(f"Profiling failed: {str(e)}")
+        return jsonify({"error": "Profiling failed"}), 500
+
+    if output == 'json':
+        return jsonify(result)
+    return Response(collapsed_text(result['stacks']), mimetype='text/plain', headers={
+        'X-Profile-Mode': result['mode'],
+        'X-Profile-Samples': str(result['samples']),
+        'X-Profile-Duration': str(result['duration'])
+    })
+
+
+@profiler_bp.route('/api/admin/threads', methods=['GET'])
+def dump_threads():
+    """Current stack of every thread, e.g. to see which process_* or SSE thread is stuck"""
+    denied = require_admin()
+    if denied:
+        return denied
+
+    try:
+        dump = thread_dump()
+    except Exception as e:
+        logger.error(f"Thread dump failed: {str(e)}")
+        return jsonify({"error": "Thread dump failed"}), 500
+
+    if request.args.get('format') == 'text':
+        text = ''
+        for thread in dump:
+            text += f"Thread {thread['name']} (ident {thread['ident']}, native {thread['native_id']}, " \
+                    f"daemon={thread['daemon']}, cpu={thread['cpu_seconds']}s)\n"
+            text += '\n'.join(thread['stack']) + '\n\n'
+        return Response(text, mimetype='text/plain')
+    return jsonify({"threads": dump, "count": len(dump)})
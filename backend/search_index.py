@@ -0,0 +1,288 @@
+import os
+import re
+import time
+import hashlib
+import sqlite3
+import threading
+import logging
+from datetime import datetime
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+# Seconds between passes of the background indexer over deployments with new log lines
+SEARCH_INDEX_INTERVAL = float(os.environ.get('SEARCH_INDEX_INTERVAL', 1))
+# Most log lines stored in one full-text row
+SEARCH_CHUNK_LINES = int(os.environ.get('SEARCH_CHUNK_LINES', 200))
+# Most results one search page returns
+SEARCH_MAX_PER_PAGE = int(os.environ.get('SEARCH_MAX_PER_PAGE', 100))
+
+# Record fields that describe what a deployment touched, searchable alongside its logs
+SEARCH_METADATA_FIELDS = (
+    'id', 'type', 'logged_in_user', 'user', 'ft', 'ft_number', 'file', 'files', 'entries', 'target_path',
+    'vms', 'command', 'service', 'operation', 'template_name', 'hostname', 'db_name', 'databases',
+    'original_deployment'
+)
+
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(deployment_id UNINDEXED, first_seq UNINDEXED, metadata, body);
+CREATE TABLE IF NOT EXISTS docs (
+    deployment_id TEXT PRIMARY KEY,
+    type TEXT,
+    status TEXT,
+    timestamp REAL,
+    logged_in_user TEXT,
+    line_count INTEGER NOT NULL,
+    metadata_hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS doc_rows (row INTEGER PRIMARY KEY, deployment_id TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS doc_rows_deployment ON doc_rows (deployment_id);
+CREATE INDEX IF NOT EXISTS docs_timestamp ON docs (timestamp);
+"""
+
+# Metadata matches weigh twice as much as log matches (deployment_id and first_seq are unindexed)
+RANK_FUNCTION = 'bm25(0, 0, 2.0, 1.0)'
+
+
+def record_epoch(value):
+    """Epoch seconds from the timestamp formats found in deployment records, or None"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+        except ValueError:
+            return None
+    return None
+
+
+def metadata_text(record):
+    """Flatten the searchable metadata fields of a record into one string"""
+    parts = []
+
+    def add(value):
+        if isinstance(value, dict):
+            for key, item in value.items():
+                parts.append(str(key))
+                add(item)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                add(item)
+        elif value not in (None, ''):
+            parts.append(str(value))
+
+    for field in SEARCH_METADATA_FIELDS:
+        add(record.get(field))
+    return ' '.join(parts)
+
+
+def build_match(query):
+    """Turn free text into an FTS5 query: every word must match, 'word*' matches a prefix.
+
+    Words are quoted, so paths such as /opt/app/foo.jar match as phrases instead of being
+    read as query syntax.
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*')
+        if not re.search(r'\w', word):
+            continue
+        terms.append('"' + word.replace('"', '""') + '"' + ('*' if prefix else ''))
+    return ' AND '.join(terms)
+
+
+class SearchIndex:
+    """SQLite FTS5 index over deployment metadata and logs.
+
+    Each deployment is stored as full-text rows of up to SEARCH_CHUNK_LINES log lines, each
+    carrying the deployment's metadata, so a query can match a path in the logs and a VM
+    name in the metadata at once. log_message only marks a deployment dirty; a background
+    thread appends the new lines every SEARCH_INDEX_INTERVAL seconds in one transaction, so
+    job threads never wait on SQLite. The database persists, so a restart only indexes what
+    changed.
+    """
+
+    def __init__(self, path, get_record):
+        self.path = path
+        self.get_record = get_record
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._local = threading.local()
+        self._thread = None
+        self._stopping = False
+        with sqlite3.connect(self.path) as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(SCHEMA)
+            db.execute("INSERT INTO search(search, rank) VALUES ('rank', ?)", (RANK_FUNCTION,))
+
+    def _connection(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            self._local.db = db
+        return db
+
+    def mark(self, deployment_id):
+        """Queue a deployment for (re)indexing on the next pass"""
+        with self._dirty_lock:
+            self._dirty.add(deployment_id)
+
+    def mark_many(self, deployment_ids):
+        with self._dirty_lock:
+            self._dirty.update(deployment_ids)
+
+    def start(self, summaries=None):
+        """Start the indexer thread, first catching up on the loaded deployments.
+
+        summaries maps each deployment id to an entry with its status and line_count; only
+        deployments whose entry differs from what was indexed are read again. Deployments
+        indexed earlier but no longer present are dropped on the first pass.
+        """
+        summaries = summaries or {}
+        with sqlite3.connect(self.path) as db:
+            indexed = {row[0]: (row[1], row[2]) for row in
+                       db.execute('SELECT deployment_id, status, line_count FROM docs')}
+        self.mark_many(indexed.keys() - summaries.keys())
+        self.mark_many(deployment_id for deployment_id, summary in summaries.items()
+                       if indexed.get(deployment_id) != (summary.status, summary.line_count))
+        self._thread = threading.Thread(target=self._run, name='search-indexer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping = True
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stopping:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Search indexer pass failed: {str(e)}")
+            self._wake.wait(SEARCH_INDEX_INTERVAL)
+        self.flush()
+
+    def flush(self):
+        """Index every dirty deployment now; return how many were processed"""
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        if not dirty:
+            return 0
+        started = time.perf_counter()
+        db = self._connection()
+        with db:
+            for deployment_id in dirty:
+                known = db.execute('SELECT line_count, metadata_hash FROM docs WHERE deployment_id = ?',
+                                   (deployment_id,)).fetchone()
+                self._index(db, deployment_id, known)
+        logger.debug(f"Search index updated for {len(dirty)} deployments in {time.perf_counter() - started:.3f}s")
+        return len(dirty)
+
+    def _delete(self, db, deployment_id):
+        db.execute('DELETE FROM search WHERE rowid IN (SELECT row FROM doc_rows WHERE deployment_id = ?)',
+                   (deployment_id,))
+        db.execute('DELETE FROM doc_rows WHERE deployment_id = ?', (deployment_id,))
+        db.execute('DELETE FROM docs WHERE deployment_id = ?', (deployment_id,))
+
+    def _index(self, db, deployment_id, known):
+        record = self.get_record(deployment_id)
+        if record is None:
+            if known:
+                self._delete(db, deployment_id)
+            return
+
+        logs = list(record.get('logs') or [])
+        metadata = metadata_text(record)
+        metadata_hash = hashlib.sha1(metadata.encode()).hexdigest()
+        indexed = 0
+        if known:
+            line_count, known_hash = known
+            if known_hash != metadata_hash or line_count > len(logs):
+                # Metadata is copied into every row, and shrinking logs means the record was replaced
+                self._delete(db, deployment_id)
+            else:
+                indexed = line_count
+
+        if indexed == 0 or indexed < len(logs):
+            rows = [(indexed + offset, '\n'.join(str(line) for line in logs[indexed + offset:
+                                                                             indexed + offset + SEARCH_CHUNK_LINES]))
+                    for offset in range(0, len(logs) - indexed, SEARCH_CHUNK_LINES)]
+            if indexed == 0 and not rows:
+                rows = [(0, '')]
+            for first_seq, body in rows:
+                cursor = db.execute('INSERT INTO search (deployment_id, first_seq, metadata, body) VALUES (?, ?, ?, ?)',
+                                    (deployment_id, first_seq, metadata, body))
+                db.execute('INSERT INTO doc_rows (row, deployment_id) VALUES (?, ?)', (cursor.lastrowid, deployment_id))
+
+        db.execute(
+            'INSERT OR REPLACE INTO docs (deployment_id, type, status, timestamp, logged_in_user, line_count, metadata_hash) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (deployment_id, record.get('type'), record.get('status'), record_epoch(record.get('timestamp')),
+             record.get('logged_in_user'), len(logs), metadata_hash))
+
+    def search(self, query, job_type=None, status=None, since=None, until=None, sort='relevance',
+               page=1, per_page=20):
+        """Return (total, results) for deployments matching every word of `query`, best first.
+
+        Each result is {'id', 'type', 'status', 'timestamp', 'logged_in_user', 'score', 'seq', 'snippet'},
+        where seq is the first log line of the best matching chunk.
+        """
+        match = build_match(query)
+        if not match:
+            return 0, []
+        filters, params = [], [match]
+        for column, value in (('type', job_type), ('status', status)):
+            if value:
+                filters.append(f'd.{column} = ?')
+                params.append(value)
+        if since is not None:
+            filters.append('d.timestamp >= ?')
+            params.append(since)
+        if until is not None:
+            filters.append('d.timestamp <= ?')
+            params.append(until)
+        where = ('WHERE ' + ' AND '.join(filters)) if filters else ''
+        order = 'd.timestamp DESC' if sort == 'newest' else 'score, d.timestamp DESC'
+
+        db = self._connection()
+        rows = db.execute(f"""
+            WITH hits AS MATERIALIZED (
+                SELECT rowid AS row, deployment_id, first_seq, rank AS score FROM search WHERE search MATCH ?
+            ), best AS (
+                SELECT deployment_id, MIN(score) AS score, row, first_seq FROM hits GROUP BY deployment_id
+            )
+            SELECT b.deployment_id, b.score, b.row, b.first_seq, d.type, d.status, d.timestamp, d.logged_in_user,
+                   COUNT(*) OVER () AS total
+            FROM best b JOIN docs d ON d.deployment_id = b.deployment_id
+            {where}
+            ORDER BY {order}
+            LIMIT ? OFFSET ?
+        """, params + [per_page, (page - 1) * per_page]).fetchall()
+
+        results = []
+        for deployment_id, score, row, first_seq, job_type, status, timestamp, user, _total in rows:
+            snippet = db.execute(
+                "SELECT snippet(search, -1, '[', ']', '...', 16) FROM search WHERE search MATCH ? AND rowid = ?",
+                (match, row)).fetchone()
+            results.append({
+                'id': deployment_id,
+                'type': job_type,
+                'status': status,
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp)) if timestamp else None,
+                'logged_in_user': user,
+                'score': round(-score, 4),
+                'seq': first_seq,
+                'snippet': snippet[0] if snippet else ''
+            })
+        total = rows[0][-1] if rows else 0
+        if not rows and page > 1:
+            # Past the last page: still report how many matched
+            total = self.search(query, job_type, status, since, until, sort, 1, 1)[0]
+        return total, results
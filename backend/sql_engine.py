@@ -0,0 +1,374 @@
+import os
+import re
+import math
+import time
+import hashlib
+import threading
+import logging
+from contextlib import contextmanager, nullcontext
+
+from sql_parser import is_transaction_control, requires_autocommit
+
+try:
+    import psycopg2
+    import psycopg2.pool
+    import psycopg2.extensions
+    PSYCOPG2_AVAILABLE = True
+except ImportError:
+    psycopg2 = None
+    PSYCOPG2_AVAILABLE = False
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+# Maximum open connections per (host, port, db, user) pool
+SQL_POOL_MAX_CONNECTIONS = int(os.environ.get('SQL_POOL_MAX_CONNECTIONS', 5))
+# Pooled connections idle for longer than this are pinged before reuse
+SQL_POOL_PING_AFTER_SECONDS = int(os.environ.get('SQL_POOL_PING_AFTER_SECONDS', 60))
+SQL_CONNECT_TIMEOUT_SECONDS = int(os.environ.get('SQL_CONNECT_TIMEOUT_SECONDS', 10))
+# How long a job waits for a free connection when SQL_POOL_MAX_CONNECTIONS are in use on one database
+SQL_POOL_WAIT_SECONDS = int(os.environ.get('SQL_POOL_WAIT_SECONDS', 300))
+# Default per-statement timeout for SQL deployments; 0 means statements may run for as long as they need
+SQL_STATEMENT_TIMEOUT_SECONDS = int(os.environ.get('SQL_STATEMENT_TIMEOUT_SECONDS', 0))
+# Wall-clock limit for a whole file run through the psql fallback (0 means no limit)
+SQL_PSQL_TIMEOUT_SECONDS = int(os.environ.get('SQL_PSQL_TIMEOUT_SECONDS', 3600))
+# Planning a statement for /api/deploy/sql/plan should be quick; give up rather than hold a connection
+SQL_EXPLAIN_TIMEOUT_SECONDS = int(os.environ.get('SQL_EXPLAIN_TIMEOUT_SECONDS', 10))
+# Default number of databases a SQL fan-out deployment runs against at the same time
+SQL_FANOUT_MAX_PARALLEL = int(os.environ.get('SQL_FANOUT_MAX_PARALLEL', 4))
+
+# psql meta-commands (\i, \set, \copy ...) only work through the psql client
+PSQL_META_COMMAND_PATTERN = re.compile(r'^\s*\\', re.MULTILINE)
+
+# transaction: all files commit or roll back together
+# savepoint: one transaction, each file is rolled back on its own if it fails
+# autocommit: every statement commits immediately and the batch stops at the first error
+SQL_BATCH_MODES = ('transaction', 'savepoint', 'autocommit')
+
+
+def parse_statement_timeout(value):
+    """Validate a per-statement timeout in seconds: a finite number >= 0, where 0 means no limit"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value) or value < 0:
+        raise ValueError(f"statementTimeout must be a number of seconds >= 0, got {value!r}")
+    return float(value)
+
+
+def default_mode(statements, atomic=False):
+    """Mode for a single script: autocommit, as `psql -f` runs it, unless atomic execution is asked for.
+
+    Scripts that manage their own transactions, or contain statements that cannot run in a
+    transaction block (CREATE INDEX CONCURRENTLY, VACUUM ...), run in autocommit regardless.
+    """
+    if not atomic or any(not transaction_allowed(statement['sql']) for statement in statements):
+        return 'autocommit'
+    return 'transaction'
+
+
+def transaction_allowed(statement_sql):
+    """Return True if the statement can run inside a batch transaction"""
+    return not (is_transaction_control(statement_sql) or requires_autocommit(statement_sql))
+
+
+def statement_preview(statement_sql, length=80):
+    """One-line, truncated form of a statement for progress logs"""
+    preview = ' '.join(statement_sql.split())
+    return preview if len(preview) <= length else preview[:length - 3] + '...'
+
+
+class NoticeSink:
+    """Receives server NOTICE/WARNING messages from psycopg2 and forwards them to a log callback"""
+
+    def __init__(self, log):
+        self.log = log
+        self.warnings = 0
+
+    def append(self, notice):
+        line = notice.strip()
+        if line.upper().startswith('WARNING:'):
+            self.warnings += 1
+        self.log(line)
+
+
+class SqlEngine:
+    """In-process SQL execution over connection pools keyed by (host, port, db, user).
+
+    Reusing connections avoids a psql process start plus a fresh TLS/auth handshake per file.
+    Sessions are reset with DISCARD ALL before a connection goes back to its pool, so one
+    script's SET or temp tables never leak into the next.
+    """
+
+    def __init__(self, max_connections=SQL_POOL_MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self._pools = {}
+        self._key_locks = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def can_execute(self, sql_text):
+        """Return True if the script can run in-process instead of through psql"""
+        return PSYCOPG2_AVAILABLE and not PSQL_META_COMMAND_PATTERN.search(sql_text)
+
+    def _checkout(self, hostname, port, db_name, user, password):
+        """Return the pool entry for a database, counted as borrowed until _checkin.
+
+        A new pool opens its first connection, which can take SQL_CONNECT_TIMEOUT_SECONDS, so it is
+        created under a lock for that database only: other databases are not held up meanwhile.
+        """
+        key = (hostname, str(port), db_name, user)
+        password_digest = hashlib.sha256((password or '').encode()).hexdigest()
+
+        with self._lock:
+            entry = self._pools.get(key)
+            if entry and entry['password_digest'] == password_digest:
+                entry['borrowed'] += 1
+                return entry
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._pools.get(key)
+                if entry and entry['password_digest'] == password_digest:
+                    entry['borrowed'] += 1
+                    return entry
+            pool = psycopg2.pool.ThreadedConnectionPool(
+                1, self.max_connections,
+                host=hostname, port=port, dbname=db_name, user=user, password=password,
+                connect_timeout=SQL_CONNECT_TIMEOUT_SECONDS,
+                application_name='fix_deployment_orchestrator'
+            )
+            entry = {'pool': pool, 'password_digest': password_digest, 'borrowed': 1, 'retired': False,
+                     'slots': threading.BoundedSemaphore(self.max_connections)}
+            with self._lock:
+                previous = self._pools.get(key)
+                self._pools[key] = entry
+                # A different password never reuses connections authenticated with the old one
+                if previous:
+                    previous['retired'] = True
+                    self._close_if_idle(previous)
+            logger.info(f"Created SQL connection pool for {user}@{hostname}:{port}/{db_name}")
+            return entry
+
+    def _checkin(self, entry):
+        with self._lock:
+            entry['borrowed'] -= 1
+            self._close_if_idle(entry)
+
+    def _close_if_idle(self, entry):
+        """Close a retired pool once no job is using it (self._lock held)"""
+        if entry['retired'] and entry['borrowed'] == 0 and not entry['pool'].closed:
+            entry['pool'].closeall()
+
+    def _is_alive(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        # Connections that were just opened, or used recently, are assumed healthy
+        if last_used is None or time.time() - last_used < SQL_POOL_PING_AFTER_SECONDS:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            return True
+        except psycopg2.Error:
+            return False
+
+    @contextmanager
+    def connection(self, hostname, port, db_name, user, password, log=None):
+        """Borrow a pooled autocommit connection, streaming server notices to log(line).
+
+        When SQL_POOL_MAX_CONNECTIONS connections to the database are in use, waits up to
+        SQL_POOL_WAIT_SECONDS for one to be returned instead of failing straight away.
+        """
+        entry = self._checkout(hostname, port, db_name, user, password)
+        try:
+            if not entry['slots'].acquire(timeout=SQL_POOL_WAIT_SECONDS):
+                raise psycopg2.pool.PoolError(
+                    f"No free connection to {hostname}:{port}/{db_name} after waiting {SQL_POOL_WAIT_SECONDS}s")
+            try:
+                pool = entry['pool']
+                conn = pool.getconn()
+                if not self._is_alive(conn):
+                    logger.debug(f"Discarding stale pooled connection to {hostname}:{port}/{db_name}")
+                    pool.putconn(conn, close=True)
+                    conn = pool.getconn()
+
+                conn.autocommit = True
+                sink = NoticeSink(log or (lambda line: None))
+                conn.notices = sink
+                try:
+                    yield conn, sink
+                finally:
+                    conn.notices = []
+                    self._release(entry, conn)
+            finally:
+                entry['slots'].release()
+        finally:
+            self._checkin(entry)
+
+    def _release(self, entry, conn):
+        pool = entry['pool']
+        if entry['retired']:
+            # Authenticated with a password that has since changed
+            self._last_used.pop(id(conn), None)
+            pool.putconn(conn, close=True)
+            return
+        try:
+            if not conn.closed:
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute('DISCARD ALL')
+                self._last_used[id(conn)] = time.time()
+                pool.putconn(conn)
+                return
+        except psycopg2.Error as e:
+            logger.warning(f"Closing pooled SQL connection that could not be reset: {str(e)}")
+        self._last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+
+    def _execute_statement(self, cursor, file_name, index, total, statement, log, on_statement):
+        """Run one parsed statement, reporting its start and result as they happen.
+
+        Returns the statement's timing entry, with status 'failed' on error.
+        """
+        label = f"{file_name} [{index}/{total}] line {statement['line']}"
+        entry = {'index': index, 'line': statement['line'], 'status': 'running'}
+        log(f"{label}: {statement_preview(statement['sql'])}")
+        on_statement('started', file_name, entry)
+
+        start = time.time()
+        try:
+            cursor.execute(statement['sql'])
+            entry.update({
+                'status': 'success',
+                'status_message': cursor.statusmessage,
+                'rowcount': cursor.rowcount
+            })
+        except psycopg2.Error as e:
+            entry['status'] = 'failed'
+            entry['error'] = (e.pgerror or str(e)).strip()
+            entry['timed_out'] = isinstance(e, psycopg2.extensions.QueryCanceledError)
+            for line in (e.pgerror or f"ERROR: {str(e)}").strip().splitlines():
+                log(line.rstrip())
+        entry['duration'] = round(time.time() - start, 4)
+
+        if entry['status'] == 'success':
+            rows = f", {entry['rowcount']} rows" if entry['rowcount'] >= 0 else ""
+            log(f"{label}: {entry['status_message']} in {entry['duration']}s{rows}")
+        else:
+            reason = "timed out" if entry['timed_out'] else "failed"
+            log(f"{label}: {reason} after {entry['duration']}s")
+        on_statement('finished', file_name, entry)
+        return entry
+
+    def execute_batch(self, hostname, port, db_name, user, password, scripts, mode, log,
+                      statement_timeout=SQL_STATEMENT_TIMEOUT_SECONDS, on_statement=None, job=None):
+        """Run an ordered list of parsed scripts over a single pooled connection.
+
+        scripts is [{'file': name, 'statements': [...]}] from sql_parser.split_statements.
+        Statements run one at a time so progress is logged live, and each is limited to
+        statement_timeout seconds (0 for no limit). on_statement(event, file, entry) is called
+        when a statement starts and finishes. If the job (a job_control.JobHandle) is cancelled,
+        the running statement is cancelled on the server, no further statements start and any
+        uncommitted work is rolled back. Returns {success, cancelled, warnings, files: [{file,
+        status, duration, statements: [...]}]} with per-statement timing and row counts.
+        """
+        file_results = [{'file': script['file'], 'status': 'not_run', 'statements': []} for script in scripts]
+        on_statement = on_statement or (lambda event, file_name, entry: None)
+        success = True
+        cancelled = False
+        warnings = 0
+
+        try:
+            with self.connection(hostname, port, db_name, user, password, log) as (conn, sink):
+                if statement_timeout:
+                    # Session setting; DISCARD ALL resets it before the connection is reused
+                    with conn.cursor() as cursor:
+                        cursor.execute('SET statement_timeout = %s', (int(statement_timeout * 1000),))
+                conn.autocommit = mode == 'autocommit'
+                with conn.cursor() as cursor, (job.cancel_callback(conn.cancel) if job else nullcontext()):
+                    for number, (script, file_result) in enumerate(zip(scripts, file_results)):
+                        if job and job.cancelled:
+                            cancelled = True
+                            success = False
+                            break
+                        log(f"Executing {script['file']} ({len(script['statements'])} statements)")
+                        start = time.time()
+                        if mode == 'savepoint':
+                            cursor.execute(f"SAVEPOINT batch_file_{number}")
+                        file_result['status'] = 'success'
+                        total = len(script['statements'])
+                        for index, statement in enumerate(script['statements'], 1):
+                            entry = self._execute_statement(cursor, script['file'], index, total, statement, log, on_statement)
+                            file_result['statements'].append(entry)
+                            if entry['status'] == 'failed':
+                                file_result['status'] = 'failed'
+                                success = False
+                                cancelled = bool(job and job.cancelled)
+                                break
+                        if mode == 'savepoint' and file_result['status'] == 'success':
+                            cursor.execute(f"RELEASE SAVEPOINT batch_file_{number}")
+                        file_result['duration'] = round(time.time() - start, 3)
+                        log(f"{script['file']} {file_result['status']} in {file_result['duration']}s")
+
+                        if file_result['status'] == 'failed':
+                            if mode == 'savepoint' and not cancelled:
+                                # Undo only this file and carry on with the rest of the batch
+                                cursor.execute(f"ROLLBACK TO SAVEPOINT batch_file_{number}")
+                                file_result['status'] = 'rolled_back'
+                                log(f"Rolled back {script['file']} to its savepoint")
+                                continue
+                            break
+
+                    if mode != 'autocommit' and (cancelled or (mode == 'transaction' and not success)):
+                        conn.rollback()
+                        for file_result in file_results:
+                            if file_result['status'] == 'success':
+                                file_result['status'] = 'rolled_back'
+                        log("Rolled back the whole batch")
+                    elif mode != 'autocommit':
+                        conn.commit()
+                        log("Committed batch")
+                warnings = sink.warnings
+        except psycopg2.Error as e:
+            # Connection, savepoint or commit failure; nothing uncommitted survives it
+            log(f"ERROR: {str(e).strip()}")
+            success = False
+            if mode != 'autocommit':
+                for file_result in file_results:
+                    if file_result['status'] == 'success':
+                        file_result['status'] = 'rolled_back'
+
+        return {'success': success, 'cancelled': cancelled, 'warnings': warnings, 'files': file_results}
+
+    def explain_statements(self, hostname, port, db_name, user, password, statements, log):
+        """EXPLAIN (without ANALYZE) every DML statement, never executing anything.
+
+        Each EXPLAIN runs inside a transaction that is rolled back, under SQL_EXPLAIN_TIMEOUT_SECONDS.
+        Statements that depend on objects created earlier in the script cannot be planned yet and
+        report an explain_error instead. Returns {statement index: plan summary}.
+        """
+        plans = {}
+        with self.connection(hostname, port, db_name, user, password, log) as (conn, sink):
+            conn.autocommit = False
+            with conn.cursor() as cursor:
+                for index, statement in enumerate(statements, 1):
+                    if not statement['analysis']['dml']:
+                        continue
+                    try:
+                        cursor.execute('SET LOCAL statement_timeout = %s', (SQL_EXPLAIN_TIMEOUT_SECONDS * 1000,))
+                        cursor.execute(f"EXPLAIN (FORMAT JSON) {statement['sql']}")
+                        plan = cursor.fetchone()[0][0]['Plan']
+                        plans[index] = {
+                            'node_type': plan.get('Node Type'),
+                            'relation': plan.get('Relation Name'),
+                            'total_cost': plan.get('Total Cost'),
+                            'plan_rows': plan.get('Plan Rows'),
+                            'plan': plan
+                        }
+                    except psycopg2.Error as e:
+                        plans[index] = {'explain_error': (e.pgerror or str(e)).strip()}
+                    finally:
+                        conn.rollback()
+        return plans
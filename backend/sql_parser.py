@@ -0,0 +1,257 @@
+import re
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+# Get logger
+logger = logging.getLogger('fix_deployment_orchestrator')
+
+DOLLAR_QUOTE_PATTERN = re.compile(r'\$([A-Za-z_][A-Za-z0-9_]*)?\$')
+IDENTIFIER_PATTERN = re.compile(r'[^\W\d][\w$]*')
+TRANSACTION_CONTROL_PATTERN = re.compile(
+    r'^(BEGIN|START\s+TRANSACTION|COMMIT|END|ROLLBACK|ABORT|SAVEPOINT|RELEASE)\b(?!\s+ATOMIC)', re.IGNORECASE)
+# Statements PostgreSQL refuses to run inside a transaction block (or, for ADD VALUE, whose result
+# cannot be used before a commit)
+NON_TRANSACTIONAL_PATTERN = re.compile(
+    r'^(VACUUM|CREATE\s+(UNIQUE\s+)?INDEX\s+CONCURRENTLY|DROP\s+INDEX\s+CONCURRENTLY|REINDEX\b.*\bCONCURRENTLY'
+    r'|ALTER\s+TYPE\b.*\bADD\s+VALUE|(CREATE|DROP)\s+(DATABASE|TABLESPACE)|ALTER\s+SYSTEM)\b',
+    re.IGNORECASE | re.DOTALL)
+
+
+def _is_identifier_char(char):
+    return char.isalnum() or char in '_$'
+
+
+def _is_routine_definition(words):
+    """Return True if a statement's leading words are CREATE [OR REPLACE] FUNCTION|PROCEDURE"""
+    if words[:3] == ['create', 'or', 'replace']:
+        words = ['create'] + words[3:]
+    return words[:1] == ['create'] and words[1:2] in (['function'], ['procedure'])
+
+
+def split_statements(sql_text):
+    """Split a SQL script into statements on top-level semicolons.
+
+    Semicolons inside single-quoted (including E'' escape) strings, quoted identifiers,
+    dollar-quoted bodies, -- or nested /* */ comments and the BEGIN ATOMIC ... END body of
+    a SQL-standard function or procedure do not end a statement. Returns
+    [{'sql': text, 'line': line the statement starts on}], skipping comment-only fragments.
+    """
+    statements = []
+    length = len(sql_text)
+    start = 0
+    content_line = None
+    line = 1
+    i = 0
+    # Leading words, parenthesis depth and BEGIN/CASE ... END nesting of the current statement,
+    # tracked the way psql does to find the end of a CREATE FUNCTION ... BEGIN ATOMIC body
+    words = []
+    paren_depth = 0
+    begin_depth = 0
+
+    def flush(end):
+        if content_line is not None:
+            statements.append({'sql': sql_text[start:end].strip(), 'line': content_line})
+
+    while i < length:
+        char = sql_text[i]
+        nxt = sql_text[i + 1] if i + 1 < length else ''
+
+        if char == '\n':
+            line += 1
+            i += 1
+        elif char.isspace():
+            i += 1
+        elif char == '-' and nxt == '-':
+            end = sql_text.find('\n', i)
+            i = length if end == -1 else end
+        elif char == '/' and nxt == '*':
+            depth = 1
+            i += 2
+            while i < length and depth:
+                if sql_text.startswith('/*', i):
+                    depth += 1
+                    i += 2
+                elif sql_text.startswith('*/', i):
+                    depth -= 1
+                    i += 2
+                else:
+                    line += sql_text[i] == '\n'
+                    i += 1
+        elif char == ';' and not begin_depth:
+            flush(i)
+            content_line = None
+            i += 1
+        else:
+            if content_line is None:
+                # Comments before the first token are not part of the statement
+                start = i
+                content_line = line
+                words = []
+                paren_depth = 0
+                begin_depth = 0
+
+            if char == "'":
+                # E'...' strings allow backslash escapes
+                escapes = i > 0 and sql_text[i - 1] in 'eE' and (i < 2 or not _is_identifier_char(sql_text[i - 2]))
+                i += 1
+                while i < length:
+                    if escapes and sql_text[i] == '\\':
+                        i += 2
+                        continue
+                    if sql_text[i] == "'":
+                        if sql_text.startswith("''", i):
+                            i += 2
+                            continue
+                        i += 1
+                        break
+                    line += sql_text[i] == '\n'
+                    i += 1
+            elif char == '"':
+                end = i + 1
+                while True:
+                    end = sql_text.find('"', end)
+                    if end == -1 or not sql_text.startswith('""', end):
+                        break
+                    end += 2
+                end = length if end == -1 else end + 1
+                line += sql_text.count('\n', i, end)
+                i = end
+            elif char == '$' and (i == 0 or not _is_identifier_char(sql_text[i - 1])):
+                match = DOLLAR_QUOTE_PATTERN.match(sql_text, i)
+                if match:
+                    close = sql_text.find(match.group(0), match.end())
+                    end = length if close == -1 else close + len(match.group(0))
+                    line += sql_text.count('\n', i, end)
+                    i = end
+                else:
+                    i += 1
+            elif IDENTIFIER_PATTERN.match(char) and (i == 0 or not _is_identifier_char(sql_text[i - 1])):
+                end = IDENTIFIER_PATTERN.match(sql_text, i).end()
+                word = sql_text[i:end].lower()
+                if len(words) < 4:
+                    words.append(word)
+                if paren_depth == 0 and _is_routine_definition(words):
+                    if word == 'begin':
+                        begin_depth += 1
+                    elif word == 'case' and begin_depth:
+                        # CASE ... END inside the body closes with END as well
+                        begin_depth += 1
+                    elif word == 'end' and begin_depth:
+                        begin_depth -= 1
+                i = end
+            elif char == '(':
+                paren_depth += 1
+                i += 1
+            elif char == ')':
+                paren_depth = max(paren_depth - 1, 0)
+                i += 1
+            else:
+                i += 1
+
+    flush(length)
+    return statements
+
+
+def is_transaction_control(statement_sql):
+    """Return True for BEGIN/COMMIT/ROLLBACK style statements"""
+    return bool(TRANSACTION_CONTROL_PATTERN.match(statement_sql.lstrip()))
+
+
+def requires_autocommit(statement_sql):
+    """Return True for statements that cannot run inside a transaction block, e.g. CREATE INDEX CONCURRENTLY"""
+    return bool(NON_TRANSACTIONAL_PATTERN.match(_strip_comments(statement_sql)))
+
+
+# Statements that take locks which block reads or writes on busy tables, with the reason
+HEAVY_LOCK_RULES = [
+    (re.compile(r'^ALTER\s+TABLE\b.*\bALTER\s+(COLUMN\s+)?\S+\s+(SET\s+DATA\s+)?TYPE\b', re.IGNORECASE | re.DOTALL),
+     'ACCESS EXCLUSIVE', 'changing a column type rewrites the table while holding an ACCESS EXCLUSIVE lock'),
+    (re.compile(r'^ALTER\s+TABLE\b.*\bSET\s+NOT\s+NULL\b', re.IGNORECASE | re.DOTALL),
+     'ACCESS EXCLUSIVE', 'SET NOT NULL scans the whole table while holding an ACCESS EXCLUSIVE lock'),
+    (re.compile(r'^ALTER\s+TABLE\b.*\bADD\s+(CONSTRAINT\s+\S+\s+)?(FOREIGN\s+KEY|CHECK)\b(?!.*\bNOT\s+VALID\b)', re.IGNORECASE | re.DOTALL),
+     'SHARE ROW EXCLUSIVE', 'adding a constraint without NOT VALID validates every row while blocking writes'),
+    (re.compile(r'^ALTER\s+TABLE\b', re.IGNORECASE),
+     'ACCESS EXCLUSIVE', 'ALTER TABLE takes an ACCESS EXCLUSIVE lock that queues behind and blocks all queries'),
+    (re.compile(r'^CREATE\s+(UNIQUE\s+)?INDEX\b(?!\s+CONCURRENTLY)', re.IGNORECASE),
+     'SHARE', 'CREATE INDEX without CONCURRENTLY blocks writes for the whole build'),
+    (re.compile(r'^DROP\s+INDEX\b(?!\s+CONCURRENTLY)', re.IGNORECASE),
+     'ACCESS EXCLUSIVE', 'DROP INDEX without CONCURRENTLY locks the table'),
+    (re.compile(r'^REINDEX\b(?!.*\bCONCURRENTLY\b)', re.IGNORECASE | re.DOTALL),
+     'ACCESS EXCLUSIVE', 'REINDEX without CONCURRENTLY blocks writes and index use'),
+    (re.compile(r'^REFRESH\s+MATERIALIZED\s+VIEW\b(?!\s+CONCURRENTLY)', re.IGNORECASE),
+     'ACCESS EXCLUSIVE', 'REFRESH MATERIALIZED VIEW without CONCURRENTLY blocks readers'),
+    (re.compile(r'^(DROP\s+TABLE|TRUNCATE|CLUSTER|VACUUM\s+FULL|LOCK\b)', re.IGNORECASE),
+     'ACCESS EXCLUSIVE', 'takes an ACCESS EXCLUSIVE lock on the table'),
+]
+
+COMMAND_MODIFIERS = {'UNIQUE', 'OR', 'REPLACE', 'TEMP', 'TEMPORARY', 'UNLOGGED', 'MATERIALIZED', 'GLOBAL', 'LOCAL'}
+DML_PATTERN = re.compile(r'^(SELECT|INSERT|UPDATE|DELETE|MERGE|WITH|VALUES|TABLE)\b', re.IGNORECASE)
+UNFILTERED_WRITE_PATTERN = re.compile(r'^(UPDATE|DELETE)\b(?!.*\bWHERE\b)', re.IGNORECASE | re.DOTALL)
+
+# Number of parsed script versions kept in memory
+SQL_PARSE_CACHE_SIZE = 256
+
+
+def _strip_comments(statement_sql):
+    return re.sub(r'/\*.*?\*/|--[^\n]*', ' ', statement_sql, flags=re.DOTALL).strip()
+
+
+def analyze_statement(statement_sql):
+    """Classify a statement and flag locks or writes that deserve a second look before running it"""
+    text = _strip_comments(statement_sql)
+    words = text.upper().split()
+    command = words[0] if words else ''
+    if command in ('CREATE', 'ALTER', 'DROP', 'REFRESH'):
+        # e.g. CREATE UNIQUE INDEX -> CREATE INDEX, CREATE OR REPLACE FUNCTION -> CREATE FUNCTION
+        obj = next((word for word in words[1:] if word not in COMMAND_MODIFIERS), '')
+        command = f"{command} {obj}".strip()
+    analysis = {'command': command, 'dml': bool(DML_PATTERN.match(text)), 'heavy_lock': False, 'lock': None, 'warnings': []}
+
+    for pattern, lock, reason in HEAVY_LOCK_RULES:
+        if pattern.match(text):
+            analysis.update({'heavy_lock': True, 'lock': lock})
+            analysis['warnings'].append(reason)
+            break
+
+    if UNFILTERED_WRITE_PATTERN.match(text):
+        analysis['warnings'].append('UPDATE/DELETE without a WHERE clause affects every row')
+    if is_transaction_control(text):
+        analysis['warnings'].append('transaction control statement; only allowed in autocommit mode')
+    if NON_TRANSACTIONAL_PATTERN.match(text):
+        analysis['warnings'].append('cannot run inside a transaction block; only allowed in autocommit mode')
+    return analysis
+
+
+class ScriptParseCache:
+    """Parsed and analyzed statements per script version, keyed by the script's SHA-256.
+
+    A file is split and analyzed once per content change, however many times it is planned or run.
+    """
+
+    def __init__(self, max_entries=SQL_PARSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def parse(self, sql_text):
+        """Return {'sha256', 'statements': [{sql, line, analysis}]} for a script"""
+        key = hashlib.sha256(sql_text.encode()).hexdigest()
+        with self._lock:
+            parsed = self._entries.get(key)
+            if parsed:
+                self._entries.move_to_end(key)
+                return parsed
+
+        statements = split_statements(sql_text)
+        for statement in statements:
+            statement['analysis'] = analyze_statement(statement['sql'])
+        parsed = {'sha256': key, 'statements': statements}
+
+        with self._lock:
+            self._entries[key] = parsed
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        logger.debug(f"Parsed SQL script {key[:12]} into {len(statements)} statements")
+        return parsed
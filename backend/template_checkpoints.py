@@ -0,0 +1,85 @@
+import os
+import json
+import hashlib
+import threading
+import logging
+from datetime import datetime, timezone
+
+# Get logger
+logger = logging.getLogger('deploy_template')
+
+DEPLOYMENT_LOGS_DIR = os.environ.get('DEPLOYMENT_LOGS_DIR', '/app/logs')
+CHECKPOINT_DIR = os.path.join(DEPLOYMENT_LOGS_DIR, 'template_checkpoints')
+
+
+def step_fingerprint(step, inventory, db_inventory, source_hash):
+    """Fingerprint everything a template step reads, so a resume only skips unchanged work.
+
+    This covers the step definition itself, the inventory entries it resolves (VM IPs, DB
+    connection, playbook, helm command) and the SHA-256 of each source file it deploys.
+    source_hash(step, file_name) returns the file's hash or None if it is missing.
+    """
+    vms_by_name = {vm.get('name'): vm.get('ip') for vm in (inventory or {}).get('vms', [])}
+    resolved = {
+        'target_vms': {name: vms_by_name.get(name) for name in step.get('targetVMs', [])},
+        'db_connection': next((conn for conn in (db_inventory or {}).get('db_connections', [])
+                               if conn.get('db_connection') == step.get('dbConnection')), None),
+        'playbook': next((pb for pb in (inventory or {}).get('playbooks', [])
+                          if pb.get('name') == step.get('playbook')), None),
+        'helm': next((helm.get('command') for helm in (inventory or {}).get('helm_upgrades', [])
+                      if helm.get('pod_name') == step.get('helmDeploymentType')), None),
+        'files': {file_name: source_hash(step, file_name) for file_name in step.get('files', [])}
+    }
+    # The description is free text and does not change what the step does
+    definition = {key: value for key, value in step.items() if key != 'description'}
+    payload = json.dumps({'step': definition, 'resolved': resolved}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class CheckpointLog:
+    """Append-only, fsynced JSON-lines log of template step outcomes for one deployment"""
+
+    def __init__(self, deployment_id):
+        self.deployment_id = deployment_id
+        self.path = os.path.join(CHECKPOINT_DIR, f'{deployment_id}.jsonl')
+        self._lock = threading.Lock()
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+
+    def record(self, order, status, fingerprint, **details):
+        entry = {
+            'order': order,
+            'status': status,
+            'fingerprint': fingerprint,
+            'recorded_at': datetime.now(timezone.utc).isoformat()
+        }
+        entry.update(details)
+        line = json.dumps(entry, default=str) + '\n'
+        # Steps finish concurrently; one writer at a time keeps lines intact
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def load(self):
+        """Return {order: latest checkpoint entry} for this deployment"""
+        checkpoints = {}
+        if not os.path.exists(self.path):
+            return checkpoints
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write can leave a torn last line; everything before it is valid
+                    logger.warning(f"Skipping unreadable checkpoint line for {self.deployment_id}")
+                    continue
+                checkpoints[entry['order']] = entry
+        return checkpoints
+
+    def completed_steps(self, fingerprints):
+        """Return the step orders that succeeded with the same fingerprint they have now"""
+        return {
+            order for order, entry in self.load().items()
+            if entry.get('status') == 'success' and fingerprints.get(order) == entry.get('fingerprint')
+        }
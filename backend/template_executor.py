@@ -0,0 +1,151 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime, timezone
+
+# Get logger
+logger = logging.getLogger('deploy_template')
+
+# Default number of template steps allowed to run at the same time
+TEMPLATE_MAX_PARALLEL = int(os.environ.get('TEMPLATE_MAX_PARALLEL', 4))
+
+
+def build_dependency_graph(steps, dependencies):
+    """Return {order: set(orders it depends on)} for the template steps.
+
+    Templates without a dependencies section keep the old behaviour of running strictly in
+    order, so each step depends on the one before it. Concurrency is derived from depends_on
+    only; the per-entry 'parallel' flag written by the template generator is informational.
+    """
+    orders = [step.get('order') for step in steps]
+    if len(set(orders)) != len(orders):
+        raise ValueError("Template steps must have unique 'order' values")
+
+    if not dependencies:
+        sorted_orders = sorted(orders)
+        return {order: ({sorted_orders[i - 1]} if i > 0 else set()) for i, order in enumerate(sorted_orders)}
+
+    graph = {order: set() for order in orders}
+    for dependency in dependencies:
+        step_order = dependency.get('step')
+        if step_order not in graph:
+            raise ValueError(f"Dependency refers to unknown step {step_order}")
+        for parent in dependency.get('depends_on', []) or []:
+            if parent not in graph:
+                raise ValueError(f"Step {step_order} depends on unknown step {parent}")
+            graph[step_order].add(parent)
+
+    # Kahn's algorithm to reject cycles before anything runs
+    remaining = {order: set(parents) for order, parents in graph.items()}
+    ready = [order for order, parents in remaining.items() if not parents]
+    visited = 0
+    while ready:
+        current = ready.pop()
+        visited += 1
+        for order, parents in remaining.items():
+            if current in parents:
+                parents.discard(current)
+                if not parents:
+                    ready.append(order)
+    if visited != len(graph):
+        raise ValueError("Template dependencies contain a cycle")
+
+    return graph
+
+
+class TemplateExecutor:
+    """Run template steps as a DAG, starting every step whose dependencies have succeeded.
+
+    run_step(step) must return (success, logs). on_step_event(event, order, result) is called
+    when a step starts, finishes, is skipped or is cancelled so the caller can update the
+    deployment record. Orders in skip_orders count as already succeeded (used by resume).
+    Once should_stop() returns True no further steps are started.
+    """
+
+    def __init__(self, steps, dependencies, run_step, on_step_event=None, max_parallel=TEMPLATE_MAX_PARALLEL,
+                 skip_orders=None, should_stop=None):
+        self.steps = {step.get('order'): step for step in steps}
+        self.graph = build_dependency_graph(steps, dependencies)
+        self.run_step = run_step
+        self.on_step_event = on_step_event or (lambda event, order, result: None)
+        self.max_parallel = max(1, int(max_parallel))
+        self.skip_orders = set(skip_orders or [])
+        self.should_stop = should_stop or (lambda: False)
+        self.results = {order: {'status': 'pending'} for order in self.steps}
+
+    def _children(self, order):
+        return [child for child, parents in self.graph.items() if order in parents]
+
+    def _cancel_dependents(self, order):
+        stack = self._children(order)
+        while stack:
+            child = stack.pop()
+            if self.results[child]['status'] == 'pending':
+                self.results[child] = {'status': 'cancelled', 'reason': f"dependency step {order} did not succeed"}
+                self.on_step_event('cancelled', child, self.results[child])
+                stack.extend(self._children(child))
+
+    def _cancel_pending(self, reason):
+        for order, result in self.results.items():
+            if result['status'] == 'pending':
+                self.results[order] = {'status': 'cancelled', 'reason': reason}
+                self.on_step_event('cancelled', order, self.results[order])
+
+    def _timed_run(self, order):
+        start = time.time()
+        self.results[order] = {
+            'status': 'running',
+            'start_time': datetime.now(timezone.utc).isoformat()
+        }
+        self.on_step_event('started', order, self.results[order])
+        try:
+            success, logs = self.run_step(self.steps[order])
+        except Exception as e:
+            logger.exception(f"Unhandled error in template step {order}")
+            success, logs = False, [f"Error executing step {order}: {str(e)}"]
+        self.results[order].update({
+            'status': 'success' if success else 'failed',
+            'end_time': datetime.now(timezone.utc).isoformat(),
+            'duration': round(time.time() - start, 3)
+        })
+        return success, logs
+
+    def _ready(self):
+        return sorted(
+            order for order, parents in self.graph.items()
+            if self.results[order]['status'] == 'pending'
+            and all(self.results[parent]['status'] == 'success' for parent in parents)
+        )
+
+    def run(self):
+        """Execute the whole DAG and return True if every step succeeded"""
+        for order in sorted(self.skip_orders & set(self.steps)):
+            self.results[order] = {'status': 'success', 'skipped': True}
+            self.on_step_event('skipped', order, self.results[order])
+
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_parallel, thread_name_prefix='template-step') as pool:
+            while True:
+                if self.should_stop():
+                    self._cancel_pending("deployment was cancelled")
+
+                for order in self._ready():
+                    if len(running) >= self.max_parallel:
+                        break
+                    # Mark as queued so the next scan does not submit it twice
+                    self.results[order] = {'status': 'queued'}
+                    running[pool.submit(self._timed_run, order)] = order
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    order = running.pop(future)
+                    success, logs = future.result()
+                    self.on_step_event('finished', order, dict(self.results[order], logs=logs))
+                    if not success:
+                        self._cancel_dependents(order)
+
+        return all(result['status'] == 'success' for result in self.results.values())
@@ -0,0 +1,37 @@
+from sql_parser import is_transaction_control, split_statements
+
+
+def _sql(sql_text):
+    return [statement['sql'] for statement in split_statements(sql_text)]
+
+
+def test_splits_on_top_level_semicolons():
+    assert _sql("select 1;\nselect 'a;b'; -- c;\nselect $x$;$x$;") == ["select 1", "select 'a;b'", "select $x$;$x$"]
+
+
+def test_begin_atomic_body_is_one_statement():
+    sql_text = "CREATE FUNCTION f() RETURNS int LANGUAGE sql BEGIN ATOMIC SELECT 1; SELECT 2; END; select 3;"
+    assert _sql(sql_text) == [
+        "CREATE FUNCTION f() RETURNS int LANGUAGE sql BEGIN ATOMIC SELECT 1; SELECT 2; END",
+        "select 3",
+    ]
+    assert not any(is_transaction_control(statement) for statement in _sql(sql_text))
+
+
+def test_case_end_inside_begin_atomic_body():
+    sql_text = (
+        "create or replace procedure p(a int) language sql\n"
+        "begin atomic\n"
+        "  insert into t values (case when a > 0 then 1 else 2 end);\n"
+        "  select case when a = 0 then 'zero' end;\n"
+        "end;\n"
+        "BEGIN; COMMIT;"
+    )
+    statements = split_statements(sql_text)
+    assert [statement['line'] for statement in statements] == [1, 6, 6]
+    assert statements[0]['sql'].endswith("end")
+    assert [statement['sql'] for statement in statements[1:]] == ["BEGIN", "COMMIT"]
+
+
+def test_begin_outside_routine_definition_is_transaction_control():
+    assert _sql("BEGIN; update t set a = 1; END;") == ["BEGIN", "update t set a = 1", "END"]
@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""Benchmark the orchestrator's own overhead through its HTTP API.
+
+The backend is started in a scratch workspace with fake ansible-playbook, ssh and psql
+binaries (scripts/benchmarks/fakes) first on PATH, so every run measures the Flask app,
+job threads and history persistence rather than real hosts. Fake behaviour is set with
+--fake-lines, --fake-line-rate, --fake-sleep and --fake-fail-rate.
+
+Scenarios:
+  submit   POST /api/command/shell from concurrent clients (request latency)
+  burst    many jobs submitted at once (submit latency, time to completion, jobs/s)
+  sse      many clients streaming one job's log (time to first event, line delivery lag)
+  history  GET /api/deployments/history with 10k-100k records (startup time, latency)
+
+Results are printed as throughput and latency percentiles; --json writes them to a file
+and --baseline compares p90 latencies against an earlier --json file.
+
+Example:
+  python scripts/benchmarks/bench.py --scenarios submit,burst --vms 20 --json run.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import math
+import shutil
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+import urllib.request
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+
+from history_gen import write_history
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..', '..', 'backend'))
+FAKES_DIR = os.path.join(BENCH_DIR, 'fakes')
+
+SCENARIOS = ('submit', 'burst', 'sse', 'history')
+TERMINAL_STATUSES = ('success', 'failed', 'completed', 'cancelled')
+LAG_PATTERN = re.compile(r'ts=(\d+\.\d+)')
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(name, latencies, errors=0, elapsed=None, unit='ms', **extra):
+    """Latencies in seconds -> {name, count, errors, throughput, p50, p90, p99, max} in `unit`"""
+    scale = 1000 if unit == 'ms' else 1
+    values = sorted(latencies)
+    result = {'name': name, 'count': len(values), 'errors': errors, 'unit': unit}
+    if elapsed:
+        result['throughput'] = round(len(values) / elapsed, 2)
+    for pct in (50, 90, 99):
+        value = percentile(values, pct)
+        result[f'p{pct}'] = round(value * scale, 2) if value is not None else None
+    result['max'] = round(values[-1] * scale, 2) if values else None
+    result.update(extra)
+    return result
+
+
+class Workspace:
+    """Scratch directories, inventory and fix files for one benchmark run"""
+
+    def __init__(self, vms, keep=False):
+        self.root = tempfile.mkdtemp(prefix='fdo-bench-')
+        self.keep = keep
+        self.logs_dir = os.path.join(self.root, 'logs')
+        self.fix_dir = os.path.join(self.root, 'fixfiles')
+        self.inventory_file = os.path.join(self.root, 'inventory', 'inventory.json')
+        self.history_file = os.path.join(self.logs_dir, 'deployment_history.json')
+        self.vms = [f"bench-vm{index:03d}" for index in range(vms)]
+
+        os.makedirs(self.logs_dir)
+        os.makedirs(os.path.join(self.fix_dir, 'AllFts', 'ft-bench'))
+        os.makedirs(os.path.dirname(self.inventory_file))
+        with open(os.path.join(self.fix_dir, 'AllFts', 'ft-bench', 'bench.sql'), 'w') as f:
+            f.write("CREATE TABLE bench (id int);\nINSERT INTO bench VALUES (1);\n")
+        with open(self.inventory_file, 'w') as f:
+            json.dump({
+                "vms": [{"name": name, "type": "bench", "ip": f"10.99.{index // 250}.{index % 250 + 1}"}
+                        for index, name in enumerate(self.vms)],
+                "users": ["infadm"],
+                "systemd_services": ["bench.service"]
+            }, f)
+
+    def reset_history(self):
+        # The old JSON file and its backups, the history store and its index, and the search index built from them
+        for path in [os.path.join(self.logs_dir, n) for n in os.listdir(self.logs_dir)
+                     if n.startswith(('deployment_history', 'search_index.db'))]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def cleanup(self):
+        if not self.keep:
+            shutil.rmtree(self.root, ignore_errors=True)
+
+
+class Server:
+    """The backend running in a subprocess against a workspace"""
+
+    def __init__(self, workspace, args):
+        self.workspace = workspace
+        self.args = args
+        self.port = args.port or self._free_port()
+        self.process = None
+        self.startup_seconds = None
+        self.last_response_bytes = 0
+        self.secret = 'fdo-benchmark-secret-not-for-production'
+        self.token = self._token()
+
+    @staticmethod
+    def _free_port():
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            return sock.getsockname()[1]
+
+    def _token(self):
+        os.environ['JWT_SECRET_KEY'] = self.secret
+        sys.path.insert(0, BACKEND_DIR)
+        from routes.auth_routes import generate_token
+        return generate_token('bench', 'admin')
+
+    def env(self):
+        env = os.environ.copy()
+        env.update({
+            'PATH': FAKES_DIR + os.pathsep + env.get('PATH', ''),
+            'DEPLOYMENT_LOGS_DIR': self.workspace.logs_dir,
+            'INVENTORY_FILE': self.workspace.inventory_file,
+            'FIX_FILES_DIR': self.workspace.fix_dir,
+            'JWT_SECRET_KEY': self.secret,
+            'FAKE_LINES': str(self.args.fake_lines),
+            'FAKE_LINE_RATE': str(self.args.fake_line_rate),
+            'FAKE_SLEEP': str(self.args.fake_sleep),
+            'FAKE_FAIL_RATE': str(self.args.fake_fail_rate),
+        })
+        return env
+
+    def start(self):
+        log = open(os.path.join(self.workspace.root, 'server.log'), 'ab')
+        started = time.time()
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(BENCH_DIR, 'serve.py'), '--port', str(self.port),
+             '--threads', str(self.args.server_threads)],
+            env=self.env(), stdout=log, stderr=subprocess.STDOUT)
+        deadline = started + self.args.startup_timeout
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited with {self.process.returncode}; see {log.name}")
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{self.port}/metrics", timeout=1).read()
+                self.startup_seconds = time.time() - started
+                return self
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                time.sleep(0.05)
+        raise RuntimeError(f"Server did not start within {self.args.startup_timeout}s; see {log.name}")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+    def memory_mb(self):
+        """Return (current RSS, peak RSS) of the server in MB, or (None, None) where /proc is unavailable"""
+        values = {}
+        try:
+            with open(f"/proc/{self.process.pid}/status") as f:
+                for line in f:
+                    key, _, rest = line.partition(':')
+                    if key in ('VmRSS', 'VmHWM'):
+                        values[key] = round(int(rest.split()[0]) / 1024, 1)
+        except (OSError, AttributeError):
+            pass
+        return values.get('VmRSS'), values.get('VmHWM')
+
+    def request(self, method, path, body=None, timeout=60):
+        """Return (status, parsed JSON or text, seconds)"""
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(f"http://127.0.0.1:{self.port}{path}", data=data, method=method, headers={
+            'Authorization': f'Bearer {self.token}',
+            'Content-Type': 'application/json'
+        })
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                payload = resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            payload = e.read()
+            status = e.code
+        elapsed = time.perf_counter() - started
+        self.last_response_bytes = len(payload)
+        try:
+            return status, json.loads(payload), elapsed
+        except ValueError:
+            return status, payload.decode(errors='replace'), elapsed
+
+    def submit_command(self, vms):
+        return self.request('POST', '/api/command/shell', {'command': 'echo bench', 'vms': vms})
+
+    def wait_for_jobs(self, job_ids, timeout):
+        """Poll the job registry until the given jobs have finished; return {id: finish time}"""
+        pending = set(job_ids)
+        finished = {}
+        deadline = time.time() + timeout
+        while pending and time.time() < deadline:
+            _, active, _ = self.request('GET', '/api/deploy/jobs')
+            now = time.time()
+            for job_id in list(pending):
+                if job_id not in active:
+                    finished[job_id] = now
+                    pending.discard(job_id)
+            time.sleep(0.02)
+        return finished
+
+
+def run_submit(server, workspace, args):
+    """Concurrent submits of small shell commands"""
+    latencies, errors, job_ids = [], 0, []
+    lock = threading.Lock()
+
+    def submit(_):
+        nonlocal errors
+        status, body, elapsed = server.submit_command(workspace.vms[:args.hosts_per_job])
+        with lock:
+            if status == 200:
+                latencies.append(elapsed)
+                job_ids.append(body['deploymentId'])
+            else:
+                errors += 1
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(submit, range(args.requests)))
+    elapsed = time.time() - started
+    server.wait_for_jobs(job_ids, args.job_timeout)
+    return [summarize('submit: POST /api/command/shell', latencies, errors, elapsed)]
+
+
+def run_burst(server, workspace, args):
+    """Submit a burst of jobs at once and time each one to completion"""
+    submitted = {}
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def submit(_):
+        nonlocal errors
+        sent = time.time()
+        status, body, elapsed = server.submit_command(workspace.vms[:args.hosts_per_job])
+        with lock:
+            if status == 200:
+                latencies.append(elapsed)
+                submitted[body['deploymentId']] = sent
+            else:
+                errors += 1
+
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=args.burst) as pool:
+        list(pool.map(submit, range(args.burst)))
+    finished = server.wait_for_jobs(list(submitted), args.job_timeout)
+    elapsed = time.time() - started
+    completion = [finished[job_id] - sent for job_id, sent in submitted.items() if job_id in finished]
+    unfinished = len(submitted) - len(finished)
+    return [
+        summarize('burst: submit latency', latencies, errors),
+        summarize('burst: job completion', completion, unfinished, elapsed, unit='s')
+    ]
+
+
+def run_sse(server, workspace, args):
+    """Fan one job's log stream out to many clients"""
+    status, body, _ = server.submit_command(workspace.vms[:args.hosts_per_job])
+    if status != 200:
+        return [summarize('sse: time to first event', [], 1)]
+    job_id = body['deploymentId']
+    first_event, lags, errors = [], [], 0
+    lock = threading.Lock()
+
+    def stream(_):
+        nonlocal errors
+        started = time.time()
+        conn = http.client.HTTPConnection('127.0.0.1', server.port, timeout=args.job_timeout)
+        try:
+            conn.request('GET', f'/api/deploy/{job_id}/logs', headers={'Accept': 'text/event-stream'})
+            resp = conn.getresponse()
+            first = None
+            for raw in resp:
+                line = raw.decode(errors='replace').strip()
+                if not line.startswith('data:'):
+                    continue
+                now = time.time()
+                if first is None:
+                    first = now - started
+                event = json.loads(line[5:])
+                match = LAG_PATTERN.search(event.get('message', ''))
+                with lock:
+                    if match and float(match.group(1)) >= started:
+                        lags.append(now - float(match.group(1)))
+                if event.get('status') in TERMINAL_STATUSES or 'error' in event:
+                    break
+            with lock:
+                if first is not None:
+                    first_event.append(first)
+                else:
+                    errors += 1
+        except Exception:
+            with lock:
+                errors += 1
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=args.sse_clients) as pool:
+        list(pool.map(stream, range(args.sse_clients)))
+    return [
+        summarize(f'sse: time to first event ({args.sse_clients} clients)', first_event, errors),
+        summarize('sse: line delivery lag', lags)
+    ]
+
+
+def run_history(server, workspace, args):
+    """History listing latency and startup time at each history size"""
+    results = []
+    for size in args.history_sizes:
+        server.stop()
+        workspace.reset_history()
+        # Size the generated file now: the server migrates it into the history store on start
+        file_bytes = write_history(workspace.history_file, size, mean_log_lines=args.history_log_lines)
+        server.start()
+        latencies, errors = [], 0
+        for _ in range(args.history_requests):
+            status, _, elapsed = server.request('GET', '/api/deployments/history', timeout=300)
+            if status == 200:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+        results.append(summarize(f'history: GET /api/deployments/history ({size} records)', latencies, errors,
+                                 startup_s=round(server.startup_seconds, 2),
+                                 file_mb=round(file_bytes / 1e6, 1)))
+    return results
+
+
+def print_results(results):
+    header = f"{'scenario':<58} {'n':>6} {'err':>4} {'tput/s':>8} {'p50':>9} {'p90':>9} {'p99':>9} {'max':>9}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        def cell(key):
+            value = r.get(key)
+            return '-' if value is None else f"{value}{r['unit'] if key != 'throughput' else ''}"
+        print(f"{r['name']:<58} {r['count']:>6} {r['errors']:>4} {cell('throughput'):>8} "
+              f"{cell('p50'):>9} {cell('p90'):>9} {cell('p99'):>9} {cell('max'):>9}")
+        extras = {k: v for k, v in r.items() if k not in ('name', 'count', 'errors', 'unit', 'throughput',
+                                                          'p50', 'p90', 'p99', 'max')}
+        if extras:
+            print(f"{'':<4}{', '.join(f'{k}={v}' for k, v in extras.items())}")
+
+
+def compare(results, baseline_path, tolerance):
+    """Print scenarios whose p90 is more than `tolerance` worse than the baseline; return True if any"""
+    with open(baseline_path) as f:
+        baseline = {r['name']: r for r in json.load(f)['results']}
+    regressed = False
+    for r in results:
+        before = baseline.get(r['name'])
+        if not before or not before.get('p90') or r.get('p90') is None:
+            continue
+        change = (r['p90'] - before['p90']) / before['p90']
+        flag = 'REGRESSION' if change > tolerance else 'ok'
+        regressed = regressed or change > tolerance
+        print(f"{flag:<10} {r['name']}: p90 {before['p90']} -> {r['p90']} {r['unit']} ({change:+.0%})")
+    return regressed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f"comma-separated subset of {', '.join(SCENARIOS)}")
+    parser.add_argument('--vms', type=int, default=20, help='VMs in the generated inventory')
+    parser.add_argument('--hosts-per-job', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=200, help='submit: number of requests')
+    parser.add_argument('--concurrency', type=int, default=8, help='submit: concurrent clients')
+    parser.add_argument('--burst', type=int, default=50, help='burst: jobs submitted at once')
+    parser.add_argument('--sse-clients', type=int, default=50, help='sse: concurrent stream clients')
+    parser.add_argument('--history-sizes', default='10000,100000', help='history: comma-separated record counts')
+    parser.add_argument('--history-log-lines', type=int, default=20, help='history: mean log lines per generated record')
+    parser.add_argument('--history-requests', type=int, default=5, help='history: requests per size')
+    parser.add_argument('--fake-lines', type=int, default=20, help='output lines per host from fake ansible-playbook')
+    parser.add_argument('--fake-line-rate', type=float, default=0, help='fake output lines per second (0 = unpaced)')
+    parser.add_argument('--fake-sleep', type=float, default=0, help='seconds each fake binary sleeps before exiting')
+    parser.add_argument('--fake-fail-rate', type=float, default=0, help='probability a fake host or script fails')
+    parser.add_argument('--server-threads', type=int, default=64)
+    parser.add_argument('--port', type=int, default=0, help='server port (default: a free port)')
+    parser.add_argument('--startup-timeout', type=float, default=300)
+    parser.add_argument('--job-timeout', type=float, default=300)
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare p90 latencies against a previous --json file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p90 regression before flagging')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch workspace')
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+    args.history_sizes = [int(size) for size in args.history_sizes.split(',') if size]
+    return args
+
+
+def main():
+    args = parse_args()
+    workspace = Workspace(args.vms, keep=args.keep)
+    server = Server(workspace, args)
+    results = []
+    try:
+        server.start()
+        print(f"Server ready in {server.startup_seconds:.2f}s on port {server.port} (workspace {workspace.root})")
+        runners = {'submit': run_submit, 'burst': run_burst, 'sse': run_sse, 'history': run_history}
+        for scenario in args.scenarios:
+            print(f"Running {scenario}...", flush=True)
+            results.extend(runners[scenario](server, workspace, args))
+    finally:
+        server.stop()
+        workspace.cleanup()
+
+    print()
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': {k: v for k, v in vars(args).items() if k not in ('json', 'baseline')},
+                       'results': results}, f, indent=2)
+    if args.baseline:
+        print()
+        if compare(results, args.baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
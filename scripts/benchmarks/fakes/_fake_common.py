@@ -0,0 +1,36 @@
+"""Shared behaviour of the fake binaries, configured through FAKE_* environment variables.
+
+FAKE_LINES       output lines per host (ansible) or per statement batch (psql), default 20
+FAKE_LINE_RATE   lines per second to emit, 0 emits as fast as possible (default)
+FAKE_SLEEP       seconds to sleep before exiting, default 0
+FAKE_FAIL_RATE   probability (0..1) that a host or script fails, default 0
+FAKE_SEED        seed for the failure draws, for repeatable runs
+"""
+import os
+import sys
+import time
+import random
+
+LINES = int(os.environ.get('FAKE_LINES', 20))
+LINE_RATE = float(os.environ.get('FAKE_LINE_RATE', 0))
+SLEEP = float(os.environ.get('FAKE_SLEEP', 0))
+FAIL_RATE = float(os.environ.get('FAKE_FAIL_RATE', 0))
+
+rng = random.Random(os.environ.get('FAKE_SEED'))
+
+
+def emit(line):
+    """Print one line, paced to FAKE_LINE_RATE; ts= lets benchmarks measure delivery lag"""
+    print(f"{line} ts={time.time():.6f}", flush=True)
+    if LINE_RATE > 0:
+        time.sleep(1 / LINE_RATE)
+
+
+def fails():
+    return rng.random() < FAIL_RATE
+
+
+def finish(code):
+    if SLEEP > 0:
+        time.sleep(SLEEP)
+    sys.exit(code)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""Generate a realistic synthetic deployment history.
+
+Records follow the shapes the backend writes for each job type (file, file_batch,
+command, rollback, systemd, sql, sql_batch, sql_fanout, template_deployment) and the
+timestamp formats found in real history files: epoch floats from new jobs, the
+'%Y-%m-%dT%H:%M:%SZ' strings that get_deployment_history writes back into records,
+datetime.isoformat() strings and the odd numeric string or missing timestamp. Log
+sizes are long-tailed, with a small share of records carrying thousands of lines.
+
+Example:
+  python scripts/benchmarks/history_gen.py --records 100000 --out /tmp/deployment_history.json
+"""
+import json
+import time
+import uuid
+import random
+import argparse
+from datetime import datetime, timezone
+
+# (job type, weight) - roughly the mix seen on a busy orchestrator
+TYPE_WEIGHTS = (
+    ('file', 35), ('command', 20), ('systemd', 15), ('sql', 10), ('file_batch', 6),
+    ('template_deployment', 5), ('rollback', 4), ('sql_batch', 3), ('sql_fanout', 2)
+)
+
+# (timestamp format, weight)
+TIMESTAMP_WEIGHTS = (
+    ('epoch', 70), ('iso_z', 20), ('isoformat', 6), ('numeric_string', 3), ('missing', 1)
+)
+
+STATUS_WEIGHTS = (('success', 80), ('failed', 15), ('cancelled', 3), ('running', 2))
+
+USERS = ('infadm', 'abpwrk1', 'admin', 'root')
+ORCHESTRATOR_USERS = ('admin', 'alice.ops', 'bob.dev', 'release-bot')
+SERVICES = ('nginx.service', 'fdo-relay.service', 'postgresql.service', 'app-gateway.service')
+FILES = ('config.properties', 'deploy.sh', 'settings.yaml', 'app.jar', 'cron.conf', 'schema.sql')
+
+
+def _weighted(rng, weights):
+    choices, counts = zip(*weights)
+    return rng.choices(choices, weights=counts)[0]
+
+
+def _format_timestamp(rng, epoch):
+    kind = _weighted(rng, TIMESTAMP_WEIGHTS)
+    if kind == 'epoch':
+        return epoch
+    if kind == 'iso_z':
+        return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch))
+    if kind == 'isoformat':
+        return datetime.fromtimestamp(epoch, timezone.utc).isoformat()
+    if kind == 'numeric_string':
+        return str(epoch)
+    return None
+
+
+def _log_count(rng, mean_lines, big_fraction, big_lines):
+    if rng.random() < big_fraction:
+        return int(rng.uniform(big_lines / 2, big_lines * 1.5))
+    # Exponential gives the long tail of real runs: most short, some a few times the mean
+    return max(1, int(rng.expovariate(1 / mean_lines)))
+
+
+def _logs(rng, record, count):
+    vms = record.get('vms') or ['db-host']
+    initiator = record['logged_in_user']
+    lines = [f"DEBUG: Deployment initiated by user: {initiator}",
+             f"Created inventory file with targets: {', '.join(vms)}",
+             "=== ANSIBLE OUTPUT ==="]
+    task = 0
+    while len(lines) < count - 1:
+        task += 1
+        lines.append(f"TASK [Step {task}] " + '*' * 60)
+        for vm in vms:
+            outcome = rng.choice(('ok', 'ok', 'changed'))
+            lines.append(f"{outcome}: [{vm}] => {{\"changed\": {str(outcome == 'changed').lower()}, "
+                         f"\"msg\": \"step {task} on {vm}\"}}")
+            if len(lines) >= count - 1:
+                break
+    if record['status'] == 'success':
+        lines.append(f"SUCCESS: {record['type']} completed successfully (initiated by {initiator})")
+    elif record['status'] == 'failed':
+        lines.append(f"ERROR: {record['type']} failed on VMs: {vms[0]} (initiated by {initiator})")
+    elif record['status'] == 'cancelled':
+        lines.append(f"CANCELLED: Cancelled by {initiator}")
+    return lines[:max(count, 1)]
+
+
+def _record(rng, record_id, job_type, epoch, vm_count, previous_files):
+    vms = [f"vm{rng.randrange(vm_count):03d}" for _ in range(rng.randint(1, min(8, vm_count)))]
+    vms = sorted(set(vms))
+    ft = f"ft-{rng.randint(1000, 9999)}"
+    record = {
+        "id": record_id,
+        "type": job_type,
+        "logged_in_user": rng.choice(ORCHESTRATOR_USERS),
+        "user_role": rng.choice(('admin', 'user')),
+        "status": _weighted(rng, STATUS_WEIGHTS),
+    }
+    if job_type == 'file':
+        record.update({
+            "ft": ft, "file": rng.choice(FILES), "user": rng.choice(USERS),
+            "target_path": f"/app/{ft}/", "vms": vms, "sudo": rng.random() < 0.3,
+            "create_backup": True, "skip_identical": True,
+            "transfer_mode": rng.choice(('auto', 'copy', 'rsync')), "distribution": rng.choice(('direct', 'relay', 'auto'))
+        })
+    elif job_type == 'file_batch':
+        record.update({
+            "entries": [{"ft": ft, "file": name, "target_path": f"/app/{ft}/"}
+                        for name in rng.sample(FILES, rng.randint(2, 4))],
+            "vms": vms, "sudo": False, "create_backup": True, "skip_identical": True,
+            "transfer_mode": rng.choice(('auto', 'copy', 'rsync')), "file_results": []
+        })
+    elif job_type == 'command':
+        record.update({
+            "command": rng.choice(('df -h', 'systemctl status app', 'ls -la /app', 'uptime')),
+            "vms": vms, "sudo": rng.random() < 0.2, "user": rng.choice(USERS), "working_dir": ""
+        })
+    elif job_type == 'rollback':
+        original = rng.choice(previous_files) if previous_files else str(uuid.uuid4())
+        record.update({
+            "original_deployment": original, "ft": ft, "file": rng.choice(FILES),
+            "target_path": f"/app/{ft}/", "vms": vms, "user": rng.choice(USERS), "sudo": False
+        })
+    elif job_type == 'systemd':
+        record.update({"service": rng.choice(SERVICES), "vms": vms,
+                       "operation": rng.choice(('status', 'restart', 'start', 'stop'))})
+    elif job_type in ('sql', 'sql_batch'):
+        record.update({"ft": ft, "hostname": "db-host", "port": 5432, "db_name": "appdb",
+                       "user": "postgres", "statement_timeout": 300})
+        if job_type == 'sql':
+            record["file"] = 'schema.sql'
+        else:
+            record.update({"files": ['01_schema.sql', '02_data.sql'], "mode": "per_file"})
+    elif job_type == 'sql_fanout':
+        record.update({
+            "ft": ft, "files": ['schema.sql'], "user": "postgres", "mode": "single",
+            "statement_timeout": 300, "max_parallel": 4,
+            "databases": {f"db_{n}": {"hostname": f"db{n}", "port": 5432, "db_name": "appdb",
+                                       "status": record['status']} for n in range(rng.randint(2, 6))}
+        })
+    elif job_type == 'template_deployment':
+        steps = rng.randint(2, 8)
+        record.update({
+            "template_name": f"{ft}_template.json", "ft_number": ft,
+            "start_time": datetime.fromtimestamp(epoch, timezone.utc).isoformat(),
+            "steps_total": steps, "steps_completed": steps if record['status'] == 'success' else steps - 1,
+            "max_parallel": 1, "step_results": {}
+        })
+    return record
+
+
+def generate_history(records, seed=0, now=None, span_days=180, vm_count=50,
+                     mean_log_lines=40, big_log_fraction=0.01, big_log_lines=5000):
+    """Return {id: record} for `records` deployments spread over the last `span_days`"""
+    rng = random.Random(seed)
+    now = now or time.time()
+    history = {}
+    previous_files = []
+    # Oldest first, so rollbacks point at earlier file deployments and dict order matches real files
+    epochs = sorted(now - rng.uniform(0, span_days * 86400) for _ in range(records))
+    for epoch in epochs:
+        record_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        job_type = _weighted(rng, TYPE_WEIGHTS)
+        record = _record(rng, record_id, job_type, epoch, vm_count, previous_files)
+        record["logs"] = _logs(rng, record, _log_count(rng, mean_log_lines, big_log_fraction, big_log_lines))
+        timestamp = _format_timestamp(rng, round(epoch, 6))
+        if timestamp is not None:
+            record["timestamp"] = timestamp
+        if job_type == 'file' and record['status'] == 'success':
+            previous_files.append(record_id)
+        history[record_id] = record
+    return history
+
+
+def write_history(path, records, **options):
+    """Write a generated history to `path` in the deployment_history.json format; return its size in bytes"""
+    history = generate_history(records, **options)
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=2)
+        return f.tell()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--out', default='deployment_history.json')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--span-days', type=float, default=180, help='spread records over this many days')
+    parser.add_argument('--vms', type=int, default=50, help='distinct VM names to draw from')
+    parser.add_argument('--mean-log-lines', type=int, default=40)
+    parser.add_argument('--big-log-fraction', type=float, default=0.01, help='share of records with very large logs')
+    parser.add_argument('--big-log-lines', type=int, default=5000)
+    args = parser.parse_args()
+
+    size = write_history(args.out, args.records, seed=args.seed, span_days=args.span_days, vm_count=args.vms,
+                         mean_log_lines=args.mean_log_lines, big_log_fraction=args.big_log_fraction,
+                         big_log_lines=args.big_log_lines)
+    print(f"Wrote {args.records} records ({size / 1e6:.1f} MB) to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
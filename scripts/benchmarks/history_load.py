@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Load test the history endpoints against generated histories of increasing size.
+
+For each scale a history is generated with history_gen, the backend is started on it and
+the following are measured:
+  migration first start, which converts the generated JSON file into the history store
+  startup   a restart on the history store: time until the server answers, and RSS
+  recent    GET /api/deployments/files/recent
+  history   GET /api/deployments/history (latency, response size, peak RSS)
+  clear     POST /api/deployments/clear on a fresh server; the first call deletes records
+            older than --clear-days, later calls measure the scan and save of what is left
+
+The results are the baseline for storage work: keep a --json run and compare later runs
+with --baseline.
+
+Example:
+  python scripts/benchmarks/history_load.py --scales 1000,10000,100000 --json history-baseline.json
+"""
+import sys
+import json
+import time
+import argparse
+
+from bench import Workspace, Server, summarize, print_results, compare
+from history_gen import write_history
+
+
+def measure(server, method, path, body, count, timeout):
+    """Send `count` requests; return (latencies, errors, last JSON body, last response bytes)"""
+    latencies, errors, payload = [], 0, None
+    for _ in range(count):
+        status, payload, elapsed = server.request(method, path, body, timeout=timeout)
+        if status == 200:
+            latencies.append(elapsed)
+        else:
+            errors += 1
+    return latencies, errors, payload, server.last_response_bytes
+
+
+def run_scale(server, workspace, records, args):
+    server.stop()
+    workspace.reset_history()
+    started = time.time()
+    size = write_history(workspace.history_file, records, seed=args.seed, span_days=args.span_days,
+                         mean_log_lines=args.mean_log_lines, big_log_fraction=args.big_log_fraction,
+                         big_log_lines=args.big_log_lines)
+    print(f"  generated {records} records ({size / 1e6:.1f} MB) in {time.time() - started:.1f}s", flush=True)
+    label = f"({records} records)"
+    results = []
+
+    # The first start migrates the generated JSON file into the history store; later starts read its index
+    server.start()
+    rss, _ = server.memory_mb()
+    results.append(summarize(f"migration {label}", [server.startup_seconds], unit='s',
+                             rss_mb=rss, file_mb=round(size / 1e6, 1)))
+    server.stop()
+    server.start()
+    rss, _ = server.memory_mb()
+    results.append(summarize(f"startup {label}", [server.startup_seconds], unit='s', rss_mb=rss))
+
+    latencies, errors, payload, _ = measure(server, 'GET', '/api/deployments/files/recent', None,
+                                            args.requests, args.timeout)
+    results.append(summarize(f"recent: GET /api/deployments/files/recent {label}", latencies, errors))
+
+    latencies, errors, payload, response_bytes = measure(server, 'GET', '/api/deployments/history', None,
+                                                         args.requests, args.timeout)
+    _, peak = server.memory_mb()
+    results.append(summarize(f"history: GET /api/deployments/history {label}", latencies, errors,
+                             response_mb=round(response_bytes / 1e6, 1), peak_rss_mb=peak))
+
+    # The history endpoint rewrites timestamps in memory, so clear runs against a fresh load
+    server.stop()
+    server.start()
+    latencies, errors, first, _ = measure(server, 'POST', '/api/deployments/clear', {'days': args.clear_days}, 1,
+                                          args.timeout)
+    more, more_errors, last, _ = measure(server, 'POST', '/api/deployments/clear', {'days': args.clear_days},
+                                         args.requests - 1, args.timeout)
+    first = first if isinstance(first, dict) else {}
+    last = last if isinstance(last, dict) else first
+    deleted, remaining = first.get('deleted_count'), last.get('remaining_count')
+    results.append(summarize(f"clear: POST /api/deployments/clear {label}", latencies + more, errors + more_errors,
+                             first_ms=round(latencies[0] * 1000, 2) if latencies else None,
+                             deleted=deleted, remaining=remaining))
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scales', default='1000,10000,100000', help='comma-separated record counts')
+    parser.add_argument('--requests', type=int, default=5, help='requests per endpoint and scale')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--span-days', type=float, default=180)
+    parser.add_argument('--mean-log-lines', type=int, default=40)
+    parser.add_argument('--big-log-fraction', type=float, default=0.01)
+    parser.add_argument('--big-log-lines', type=int, default=2000)
+    parser.add_argument('--clear-days', type=int, default=90)
+    parser.add_argument('--server-threads', type=int, default=16)
+    parser.add_argument('--port', type=int, default=0, help='server port (default: a free port)')
+    parser.add_argument('--startup-timeout', type=float, default=600)
+    parser.add_argument('--timeout', type=float, default=600, help='per-request timeout in seconds')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='compare p90 latencies against a previous --json file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed p90 regression before flagging')
+    parser.add_argument('--keep', action='store_true', help='keep the scratch workspace')
+    # The fake binaries are not exercised here, but the server environment expects their settings
+    parser.set_defaults(fake_lines=0, fake_line_rate=0, fake_sleep=0, fake_fail_rate=0)
+    args = parser.parse_args()
+    args.scales = [int(scale) for scale in args.scales.split(',') if scale]
+    args.requests = max(1, args.requests)
+    return args
+
+
+def main():
+    args = parse_args()
+    workspace = Workspace(vms=1, keep=args.keep)
+    server = Server(workspace, args)
+    results = []
+    try:
+        for records in args.scales:
+            print(f"Scale {records}...", flush=True)
+            results.extend(run_scale(server, workspace, records, args))
+    finally:
+        server.stop()
+        workspace.cleanup()
+
+    print()
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': {k: v for k, v in vars(args).items() if k not in ('json', 'baseline')},
+                       'results': results}, f, indent=2)
+    if args.baseline:
+        print()
+        if compare(results, args.baseline, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""Run the orchestrator backend on a given port for benchmarks.
+
+Uses waitress like production; where waitress is not installed it falls back to
+werkzeug's threaded server, which is enough to compare runs on the same machine.
+"""
+import os
+import sys
+import argparse
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'backend'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--threads', type=int, default=64, help='server worker threads (each open SSE stream holds one)')
+    args = parser.parse_args()
+
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(BACKEND_DIR)
+    import app as orchestrator
+
+    try:
+        from waitress import serve
+    except ImportError:
+        from werkzeug.serving import make_server
+        print(f"waitress not installed, serving with werkzeug on {args.host}:{args.port}", flush=True)
+        make_server(args.host, args.port, orchestrator.app, threaded=True).serve_forever()
+    else:
+        serve(orchestrator.app, host=args.host, port=args.port, threads=args.threads)
+
+
+if __name__ == '__main__':
+    main()